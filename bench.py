@@ -0,0 +1,281 @@
+# Бенчмарки ядра (core.py) на локальной замене S3, без интерфейса.
+# По умолчанию поднимается moto (pip install -r requirements-bench.txt);
+# с BENCH_S3_ENDPOINT (и BENCH_S3_ACCESS_KEY, BENCH_S3_SECRET_KEY,
+# BENCH_S3_REGION) - любое S3-совместимое хранилище, например MinIO.
+# Каждый прогон работает во временном бакете и удаляет его в конце.
+# Результаты пишутся в JSON, два файла сравниваются через --compare.
+#
+#   python bench.py
+#   python bench.py --quick --only listing upload
+#   python bench.py --compare bench_results/old.json bench_results/new.json
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Индексы и журналы бенчмарка не должны попасть в состояние приложения
+os.environ["FLET_APP_STORAGE_DATA"] = tempfile.mkdtemp(prefix="s3bench_state_")
+
+from core import CloudStorage, S3ClientPool, FolderListing, FolderTree, PrefixDeleter, BulkDownloader
+
+MB = 1024 * 1024
+SCENARIOS = ["listing", "tree", "upload", "download", "usage", "delete"]
+
+# Параметры сценариев: полный прогон и быстрый (--quick)
+PROFILES = {
+    "full": {
+        "listing_sizes": [100, 1000, 10000],
+        "tree_sizes": [1000, 10000],
+        "file_sizes_mb": [1, 16, 64],
+        "workers": [1, 4, 8],
+        "bytes_per_case_mb": 256,
+        "repeats": 5,
+    },
+    "quick": {
+        "listing_sizes": [100, 1000],
+        "tree_sizes": [1000],
+        "file_sizes_mb": [1, 8],
+        "workers": [1, 4],
+        "bytes_per_case_mb": 32,
+        "repeats": 3,
+    },
+}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class Target:
+    # Хранилище для прогона: внешний endpoint из окружения или moto в этом процессе
+    def __init__(self):
+        self.server = None
+        self.endpoint = os.getenv("BENCH_S3_ENDPOINT")
+        self.access_key = os.getenv("BENCH_S3_ACCESS_KEY", "testing")
+        self.secret_key = os.getenv("BENCH_S3_SECRET_KEY", "testing")
+        self.region = os.getenv("BENCH_S3_REGION", "us-east-1")
+        self.name = self.endpoint or "moto"
+
+    def start(self):
+        if not self.endpoint:
+            try:
+                from moto.server import ThreadedMotoServer
+            except ImportError:
+                sys.exit("Нужен moto (pip install -r requirements-bench.txt) или BENCH_S3_ENDPOINT")
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            port = free_port()
+            self.server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+            self.server.start()
+            self.endpoint = f"http://127.0.0.1:{port}"
+        s3 = S3ClientPool().get(self.access_key, self.secret_key, self.endpoint, self.region, {"pool_size": 64})
+        bucket = f"s3bench-{int(time.time())}"
+        if self.region == "us-east-1":
+            s3.create_bucket(Bucket=bucket)
+        else:
+            s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={'LocationConstraint': self.region})
+        return CloudStorage(s3, self.endpoint, bucket)
+
+    def stop(self, storage):
+        try:
+            PrefixDeleter(storage.s3, storage.bucket, workers=8).delete("")
+            storage.s3.delete_bucket(Bucket=storage.bucket)
+        finally:
+            if self.server: self.server.stop()
+
+class Bench:
+    def __init__(self, storage, profile):
+        self.storage = storage
+        self.s3 = storage.s3
+        self.bucket = storage.bucket
+        self.profile = profile
+        self.results = {}
+        self.workdir = tempfile.mkdtemp(prefix="s3bench_")
+
+    def record(self, name, value, unit, better):
+        self.results[name] = {"value": round(value, 3), "unit": unit, "better": better}
+        print(f"  {name:40} {value:12.2f} {unit}", flush=True)
+
+    def fill(self, prefix, count, size=0, suffix=""):
+        body = b"x" * size
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            list(pool.map(lambda i: self.s3.put_object(Bucket=self.bucket, Key=f"{prefix}{i:08d}{suffix}", Body=body), range(count)))
+
+    def make_files(self, size_mb, count):
+        folder = os.path.join(self.workdir, f"src_{size_mb}mb")
+        os.makedirs(folder, exist_ok=True)
+        files = []
+        for i in range(count):
+            path = os.path.join(folder, f"file_{i:04d}.bin")
+            if not os.path.exists(path):
+                with open(path, 'wb') as f:
+                    for _ in range(size_mb):
+                        f.write(os.urandom(MB))
+            files.append(path)
+        return files
+
+    def case_count(self, size_mb):
+        return max(1, self.profile["bytes_per_case_mb"] // size_mb)
+
+    def run_listing(self):
+        for n in self.profile["listing_sizes"]:
+            prefix = f"listing/{n}/"
+            self.fill(prefix, n)
+            first, full = [], []
+            for _ in range(self.profile["repeats"]):
+                started = time.perf_counter()
+                listing = FolderListing(self.s3, self.bucket, prefix)
+                listing.fetch_page()
+                first.append(time.perf_counter() - started)
+                while not listing.exhausted:
+                    listing.fetch_page()
+                full.append(time.perf_counter() - started)
+            self.record(f"listing.first_page.{n}", statistics.median(first) * 1000, "ms", "lower")
+            self.record(f"listing.full.{n}", statistics.median(full) * 1000, "ms", "lower")
+
+    def run_tree(self):
+        # Дерево папок (выбор папки при перемещении): n папок-соседей, обход всего бакета
+        for n in self.profile["tree_sizes"]:
+            self.fill(f"tree/{n}/", n, suffix="/x")
+            tree = FolderTree(os.path.join(self.workdir, f"tree_{n}.json"))
+            started = time.perf_counter()
+            tree.build(self.s3, self.bucket)
+            elapsed = time.perf_counter() - started
+            self.record(f"tree.build.{n}", elapsed, "s", "lower")
+            self.record(f"tree.build_rate.{n}", len(tree.all_folders()) / elapsed, "folders/s", "higher")
+
+    def run_upload(self):
+        for size_mb in self.profile["file_sizes_mb"]:
+            files = self.make_files(size_mb, self.case_count(size_mb))
+            total = sum(os.path.getsize(p) for p in files)
+            for workers in self.profile["workers"]:
+                prefix = f"upload/{size_mb}mb/{workers}/"
+                self.storage.uploads.configure(8, workers, workers)
+                started = time.perf_counter()
+                results = self.storage.upload([(p, prefix + os.path.basename(p)) for p in files])
+                elapsed = time.perf_counter() - started
+                failed = [k for k, e in results.items() if e]
+                if failed: raise RuntimeError(f"Загрузка не удалась: {failed[0]}: {results[failed[0]]}")
+                self.record(f"upload.{size_mb}mb.w{workers}", total / MB / elapsed, "MB/s", "higher")
+
+    def run_download(self):
+        for size_mb in self.profile["file_sizes_mb"]:
+            prefix = f"download/{size_mb}mb/"
+            files = self.make_files(size_mb, self.case_count(size_mb))
+            self.storage.uploads.configure(8, 8, 8)
+            self.storage.upload([(p, prefix + os.path.basename(p)) for p in files])
+            for workers in self.profile["workers"]:
+                dest = os.path.join(self.workdir, f"dst_{size_mb}mb_{workers}")
+                downloader = BulkDownloader(self.s3, self.bucket, workers=workers, part_workers=workers)
+                objects = list(downloader.iter_objects(folders=[prefix]))
+                total = sum(obj['size'] for obj in objects)
+                started = time.perf_counter()
+                result = downloader.download(objects, dest)
+                elapsed = time.perf_counter() - started
+                if result['failed']: raise RuntimeError(f"Скачивание не удалось: {result['failed'][0]}")
+                shutil.rmtree(dest, ignore_errors=True)
+                self.record(f"download.{size_mb}mb.w{workers}", total / MB / elapsed, "MB/s", "higher")
+
+    def run_usage(self):
+        # Полный обход: каталог + индекс занятого места (то же, что сверка в приложении)
+        count = sum(1 for _ in self.storage.iter_objects())
+        timings = []
+        for _ in range(self.profile["repeats"]):
+            started = time.perf_counter()
+            self.storage.reconcile()
+            timings.append(time.perf_counter() - started)
+        self.record("usage.scan", statistics.median(timings), "s", "lower")
+        self.record("usage.scan_rate", count / statistics.median(timings), "obj/s", "higher")
+
+    def run_delete(self):
+        n = max(self.profile["listing_sizes"])
+        prefix = "delete/"
+        self.fill(prefix, n)
+        started = time.perf_counter()
+        deleted, failed, _ = PrefixDeleter(self.s3, self.bucket).delete(prefix)
+        elapsed = time.perf_counter() - started
+        if failed: raise RuntimeError(f"Не удалено объектов: {failed}")
+        self.record(f"delete.rate.{n}", deleted / elapsed, "obj/s", "higher")
+
+    def close(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return ""
+
+def run(args):
+    profile_name = "quick" if args.quick else "full"
+    target = Target()
+    storage = target.start()
+    bench = Bench(storage, PROFILES[profile_name])
+    print(f"Цель: {target.name}, бакет {storage.bucket}, профиль {profile_name}")
+    try:
+        for scenario in args.only or SCENARIOS:
+            print(f"[{scenario}]", flush=True)
+            getattr(bench, f"run_{scenario}")()
+    finally:
+        bench.close()
+        target.stop(storage)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(), "target": target.name,
+            "profile": profile_name, "python": platform.python_version(), "platform": platform.platform(),
+        },
+        "results": bench.results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)) if args.output else args.results_dir, exist_ok=True)
+    path = args.output or os.path.join(args.results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['meta']['revision'] or 'local'}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты: {path}")
+    return 0
+
+def compare(old_path, new_path, threshold):
+    # Разница в процентах по общим метрикам; хуже порога - регрессия (код возврата 1)
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"Было:  {old['meta'].get('revision') or old_path} ({old['meta'].get('time')}, {old['meta'].get('target')})")
+    print(f"Стало: {new['meta'].get('revision') or new_path} ({new['meta'].get('time')}, {new['meta'].get('target')})")
+    regressions = 0
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before, after = old['results'][name], new['results'][name]
+        if not before['value']: continue
+        change = (after['value'] - before['value']) / before['value'] * 100
+        worse = change > threshold if after['better'] == "lower" else change < -threshold
+        regressions += worse
+        mark = "  РЕГРЕССИЯ" if worse else ""
+        print(f"  {name:40} {before['value']:12.2f} -> {after['value']:12.2f} {after['unit']:6} {change:+7.1f}%{mark}")
+    for name in sorted(set(old['results']) ^ set(new['results'])):
+        print(f"  {name:40} только в {'старом' if name in old['results'] else 'новом'} прогоне")
+    print(f"Регрессий: {regressions} (порог {threshold}%)")
+    return 1 if regressions else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки ядра Личного Облака")
+    parser.add_argument("--quick", action="store_true", help="меньше объектов и байт, для быстрой проверки")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, help="только эти сценарии")
+    parser.add_argument("--results-dir", default="bench_results")
+    parser.add_argument("--output", help="файл результатов (по умолчанию - в --results-dir)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="сравнить два файла результатов")
+    parser.add_argument("--threshold", type=float, default=10, help="порог регрессии, %%")
+    args = parser.parse_args(argv)
+    if args.compare: return compare(*args.compare, args.threshold)
+    return run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# Консольный клиент на том же ядре, что и приложение (core.py).
+# Доступ задается переменными окружения S3_ENDPOINT, S3_ACCESS_KEY,
+# S3_SECRET_KEY, S3_BUCKET, S3_REGION или одноименными параметрами.
+#
+#   python cli.py ls photos/
+#   python cli.py upload ./trip photos/2024/
+#   python cli.py download photos/2024/ ./backup --zip
+#   python cli.py rm photos/old/
+#   python cli.py du photos/ --rescan
+#   python cli.py sync ./notes notes/ --delete --dry-run
+#   python cli.py --metrics s3.prom du --rescan
+import argparse
+import os
+import sys
+import time
+from core import CloudStorage, S3ClientPool, UPLOAD_PART_SIZE_MB, UPLOAD_FILE_WORKERS, UPLOAD_PART_WORKERS, format_size
+
+def connect(args, clients):
+    missing = [name for name in ["endpoint", "access_key", "secret_key", "bucket"] if not getattr(args, name)]
+    if missing:
+        sys.exit("Не заданы параметры доступа: " + ", ".join("--" + m.replace('_', '-') for m in missing))
+    return CloudStorage.connect(args.access_key, args.secret_key, args.endpoint, args.bucket, args.region, clients=clients)
+
+def progress_printer(label):
+    state = {'last': 0}
+    def progress(done, total):
+        now = time.time()
+        if now - state['last'] < 0.5 and done < total: return
+        state['last'] = now
+        percent = f" ({done * 100 // total}%)" if total else ""
+        print(f"\r{label}: {format_size(done)} из {format_size(total)}{percent}", end="", file=sys.stderr, flush=True)
+    return progress
+
+def cmd_ls(storage, args):
+    prefix = args.prefix
+    if prefix and not prefix.endswith('/'): prefix += '/'
+    for entry in storage.list_folder(prefix):
+        name = entry['key'][len(prefix):]
+        if entry['type'] == 'folder':
+            print(f"{'':>12}  {'':16}  {name}")
+        else:
+            modified = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['modified'])) if entry['modified'] else ""
+            print(f"{format_size(entry['size']):>12}  {modified:16}  {name}")
+
+def cmd_upload(storage, args):
+    prefix = args.prefix
+    if prefix and not prefix.endswith('/'): prefix += '/'
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(storage.upload_tree(path, prefix + os.path.basename(os.path.abspath(path)) + '/'))
+        else:
+            files.append((path, prefix + os.path.basename(path)))
+    storage.uploads.configure(args.part_size, args.workers, args.part_workers)
+    skipped = []
+    if not args.force:
+        plan = storage.upload_plan(files, progress_printer("Проверка"))
+        if plan['hashed']: print(file=sys.stderr)
+        files, skipped = plan['upload'], plan['skip']
+        print(f"Уже в облаке: {len(skipped)} ({format_size(plan['skip_bytes'])}), "
+              f"к загрузке: {len(files)} ({format_size(plan['upload_bytes'])})", file=sys.stderr)
+    results = storage.upload(files, on_progress=progress_printer("Загрузка"))
+    if files: print(file=sys.stderr)
+    failed = {key: error for key, error in results.items() if error}
+    for key, error in failed.items():
+        print(f"Ошибка: {key}: {error}", file=sys.stderr)
+    print(f"Загружено файлов: {len(files) - len(failed)} из {len(files)}, пропущено: {len(skipped)}")
+    return 1 if failed else 0
+
+def cmd_download(storage, args):
+    downloader = storage.downloader()
+    if args.key.endswith('/'):
+        objects = downloader.iter_objects(folders=[args.key])
+    else:
+        head = storage.s3.head_object(Bucket=storage.bucket, Key=args.key)
+        objects = downloader.iter_objects(files=[{
+            'key': args.key, 'size': head['ContentLength'], 'etag': head.get('ETag', '').strip('"'),
+            'modified': head['LastModified'].timestamp() if head.get('LastModified') else 0,
+        }])
+    if args.zip:
+        path = args.dest if args.dest.lower().endswith('.zip') else args.dest + '.zip'
+        count = downloader.download_zip(objects, path, progress_printer("Скачивание"))
+        print(file=sys.stderr)
+        print(f"Архив сохранен: {path} ({count} файлов)")
+        return 0
+    os.makedirs(args.dest, exist_ok=True)
+    result = downloader.download(objects, args.dest, on_progress=progress_printer("Скачивание"))
+    print(file=sys.stderr)
+    for key, error in result['failed']:
+        print(f"Ошибка: {key}: {error}", file=sys.stderr)
+    print(f"Скачано: {result['downloaded']}, без изменений: {result['skipped']}, ошибок: {len(result['failed'])}")
+    return 1 if result['failed'] else 0
+
+def cmd_rm(storage, args):
+    if not args.key.endswith('/'):
+        head = storage.s3.head_object(Bucket=storage.bucket, Key=args.key)
+        storage.delete_object(args.key, head['ContentLength'])
+        print(f"Удален: {args.key}")
+        return 0
+    def progress(deleted, failed):
+        print(f"\rУдалено: {deleted}, ошибок: {failed}", end="", file=sys.stderr, flush=True)
+    deleted, failed, errors = storage.delete_prefix(args.key, args.versions, progress)
+    print(file=sys.stderr)
+    for key, code in errors:
+        print(f"Ошибка: {key}: {code}", file=sys.stderr)
+    print(f"Удалено объектов: {deleted}, ошибок: {failed}")
+    return 1 if failed else 0
+
+def cmd_du(storage, args):
+    prefix = args.prefix
+    if prefix and not prefix.endswith('/'): prefix += '/'
+    if args.rescan or storage.usage() is None:
+        started = time.time()
+        storage.reconcile()
+        print(f"Обход бакета: {time.time() - started:.1f} с", file=sys.stderr)
+    size, count = storage.usage(prefix)
+    print(f"{format_size(size)}\t{count} объектов\t{prefix or '/'}")
+    if args.depth:
+        for child in storage.indexes.usage.children(prefix):
+            size, count = storage.usage(child)
+            print(f"{format_size(size)}\t{count} объектов\t{child}")
+
+def cmd_sync(storage, args):
+    prefix = args.prefix
+    if prefix and not prefix.endswith('/'): prefix += '/'
+    engine = storage.sync_engine(args.local_dir, prefix, args.mode, args.delete)
+    actions = engine.plan()
+    labels = {'upload': "в облако", 'download': "из облака", 'delete_remote': "удалить в облаке", 'delete_local': "удалить локально"}
+    for a in actions:
+        if a['action'] in labels:
+            print(f"{labels[a['action']]:18} {a['rel']}" + ("  (конфликт)" if a['conflict'] else ""))
+    totals = engine.summary(actions)
+    print("; ".join(f"{labels[a]}: {totals[a][0]} ({format_size(totals[a][1])})" for a in labels if a in totals) or "Изменений нет")
+    if args.dry_run or not actions: return 0
+    result = engine.run(actions, progress_printer("Синхронизация"))
+    print(file=sys.stderr)
+    for rel, error in result['failed']:
+        print(f"Ошибка: {rel}: {error}", file=sys.stderr)
+    print(f"В облако: {result['uploaded']}, из облака: {result['downloaded']}, удалено: {result['deleted']}, конфликтных копий: {result['conflicts']}, ошибок: {len(result['failed'])}")
+    return 1 if result['failed'] else 0
+
+def write_metrics(metrics, path):
+    text = metrics.to_prometheus() if path.endswith('.prom') else metrics.to_json()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Личное Облако: консольный клиент S3")
+    parser.add_argument("--endpoint", default=os.getenv("S3_ENDPOINT"))
+    parser.add_argument("--access-key", default=os.getenv("S3_ACCESS_KEY"))
+    parser.add_argument("--secret-key", default=os.getenv("S3_SECRET_KEY"))
+    parser.add_argument("--bucket", default=os.getenv("S3_BUCKET"))
+    parser.add_argument("--region", default=os.getenv("S3_REGION", "ru-central-1"))
+    parser.add_argument("--metrics", metavar="FILE", help="записать задержки запросов S3 (.prom - в формате Prometheus, иначе JSON)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ls = commands.add_parser("ls", help="содержимое папки")
+    ls.add_argument("prefix", nargs="?", default="")
+    ls.set_defaults(func=cmd_ls)
+
+    upload = commands.add_parser("upload", help="загрузить файлы и папки")
+    upload.add_argument("paths", nargs="+")
+    upload.add_argument("prefix")
+    upload.add_argument("--part-size", type=float, default=UPLOAD_PART_SIZE_MB, help="размер части multipart, МБ")
+    upload.add_argument("--workers", type=int, default=UPLOAD_FILE_WORKERS, help="файлов одновременно")
+    upload.add_argument("--part-workers", type=int, default=UPLOAD_PART_WORKERS, help="частей файла одновременно")
+    upload.add_argument("--force", action="store_true", help="загружать и то, что уже есть в облаке")
+    upload.set_defaults(func=cmd_upload)
+
+    download = commands.add_parser("download", help="скачать файл или папку (ключ на '/')")
+    download.add_argument("key")
+    download.add_argument("dest")
+    download.add_argument("--zip", action="store_true", help="одним архивом")
+    download.set_defaults(func=cmd_download)
+
+    rm = commands.add_parser("rm", help="удалить файл или папку (ключ на '/')")
+    rm.add_argument("key")
+    rm.add_argument("--versions", action="store_true", help="вместе со всеми версиями")
+    rm.set_defaults(func=cmd_rm)
+
+    du = commands.add_parser("du", help="занятое место")
+    du.add_argument("prefix", nargs="?", default="")
+    du.add_argument("--rescan", action="store_true", help="пересчитать полным обходом бакета")
+    du.add_argument("--depth", action="store_true", help="с разбивкой по вложенным папкам")
+    du.set_defaults(func=cmd_du)
+
+    sync = commands.add_parser("sync", help="синхронизировать локальную папку с папкой в облаке")
+    sync.add_argument("local_dir")
+    sync.add_argument("prefix")
+    sync.add_argument("--mode", choices=["both", "upload", "download"], default="both")
+    sync.add_argument("--delete", action="store_true", help="удалять то, что удалено на другой стороне")
+    sync.add_argument("--dry-run", action="store_true", help="только показать план")
+    sync.set_defaults(func=cmd_sync)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    clients = S3ClientPool()
+    storage = connect(args, clients)
+    try:
+        return args.func(storage, args) or 0
+    finally:
+        storage.close()
+        if args.metrics: write_metrics(clients.metrics, args.metrics)
+
+if __name__ == "__main__":
+    sys.exit(main())
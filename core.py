@@ -0,0 +1,3152 @@
+# Ядро без интерфейса: работа с S3 и локальные индексы хранилища.
+# Используется приложением Flet (main.py), CLI (cli.py) и бенчмарками (bench.py).
+import asyncio
+import contextlib
+import copy
+import functools
+import importlib.util
+import json
+import os
+import time
+import hashlib
+import queue
+import threading
+import sqlite3
+import tempfile
+import zipfile
+from io import BytesIO
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# boto3 импортируется при первом клиенте (import_boto3): импорт и описания API S3
+# занимают сотни мс, а интерфейсу и локальным индексам они не нужны
+boto3 = Config = ClientError = BotoConnectionError = HTTPClientError = ParamValidationError = None
+BOTO3_LOCK = threading.Lock()
+
+# Файлы настроек (в облаке). METADATA_FILE - прежний единый файл метаданных
+# папок, теперь они разложены по файлам в METADATA_DIR
+METADATA_FILE = ".folder_metadata.json"
+METADATA_DIR = ".folder_metadata/"
+# Отметка в облаке: прежний общий файл перенесен по шардам и больше не читается
+METADATA_MIGRATED = METADATA_DIR + "migrated.json"
+SETTINGS_FILE = ".app_settings.json"
+
+# Листинг: ключей за один запрос
+LIST_PAGE_SIZE = 1000
+
+# Кэш листингов: свежая запись рисуется без запроса, устаревшая - рисуется
+# и перепроверяется в фоне, совсем старая считается промахом
+LISTING_CACHE_ENTRIES = 50000
+LISTING_CACHE_TTL = 30
+LISTING_CACHE_MAX_STALE = 15 * 60
+
+# Загрузка: размер части multipart и параллельность (переопределяются в настройках)
+UPLOAD_PART_SIZE_MB = 16
+UPLOAD_FILE_WORKERS = 3
+UPLOAD_PART_WORKERS = 4
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+# Удаление папок: ключей в одном DeleteObjects, параллельных запросов, повторов
+DELETE_BATCH = 1000
+DELETE_WORKERS = 4
+DELETE_RETRIES = 3
+DELETE_MAX_REPORTED_ERRORS = 100
+
+# Пакетное скачивание: файлов одновременно, размер диапазона Range и частей на файл
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+DOWNLOAD_PART_WORKERS = 4
+DOWNLOAD_CHUNK = 1024 * 1024
+
+# Копирование на сервере: предел одного CopyObject, часть UploadPartCopy,
+# объектов и частей одновременно
+COPY_MAX_SINGLE = 5 * 1024 * 1024 * 1024
+COPY_PART_SIZE = 512 * 1024 * 1024
+COPY_WORKERS = 8
+COPY_PART_WORKERS = 8
+
+# Проверка перед загрузкой: потоков хэширования и HEAD, ключей в папке, до
+# которых HEAD дешевле LIST, типичные размеры частей других клиентов (МБ),
+# записей в кэше хэшей локальных файлов
+DEDUP_WORKERS = 4
+DEDUP_HEAD_MAX = 20
+DEDUP_PART_SIZES_MB = (8, 16, 5, 15, 32, 64, 100, 128, 256, 512)
+HASH_CACHE_ENTRIES = 50000
+
+# Подключение: пул соединений, таймауты и повторы (переопределяются на устройстве)
+S3_POOL_SIZE = 50
+S3_CONNECT_TIMEOUT = 10
+S3_READ_TIMEOUT = 60
+S3_MAX_ATTEMPTS = 8
+S3_OPEN_STORAGES = 4
+
+# Фоновые запросы интерфейса: потоков для блокирующих вызовов boto3
+IO_WORKERS = 8
+
+# Предварительная подгрузка подпапок: папок на один переход, запросов одновременно,
+# опрос паузы на время передач (с), полураспад и размер истории переходов
+PREFETCH_BUDGET = 12
+PREFETCH_CONCURRENCY = 2
+PREFETCH_PAUSE_POLL = 0.5
+PREFETCH_HISTORY_HALF_LIFE = 7 * 24 * 3600
+PREFETCH_HISTORY_SIZE = 2000
+
+# Планировщик передач: задач одновременно, S3-запросов передач одновременно
+# на все задачи, на одну задачу и на фоновый обход, доля запросов, оставляемая
+# передачам, пока ждут запросы интерфейса, завершенных задач в списке
+TRANSFER_MAX_JOBS = 2
+TRANSFER_MAX_REQUESTS = 16
+TRANSFER_JOB_REQUESTS = 8
+TRANSFER_BACKGROUND_REQUESTS = 2
+TRANSFER_INTERACTIVE_SHARE = 0.25
+TRANSFER_FINISHED_KEEP = 20
+
+# Классы приоритета задач: действия пользователя, передачи, фоновые обходы
+PRIORITY_INTERACTIVE = 0
+PRIORITY_TRANSFER = 1
+PRIORITY_BACKGROUND = 2
+
+# Диагностика: границы гистограммы задержек (с), последних замеров на операцию
+# для перцентилей, последних ошибок для панели
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_SAMPLES = 2048
+METRICS_ERRORS = 50
+
+# Миниатюры: размер, параллельные загрузки, лимит исходника и дискового кэша
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']
+THUMB_SIZE = 160
+THUMB_WORKERS = 4
+THUMB_MAX_SOURCE = 30 * 1024 * 1024
+THUMB_CACHE_BYTES = 200 * 1024 * 1024
+
+# Поиск по каталогу: результатов на страницу
+SEARCH_PAGE_SIZE = 100
+
+# Локальное состояние (на устройстве)
+APP_DATA_DIR = os.getenv("FLET_APP_STORAGE_DATA") or os.path.join(os.path.expanduser("~"), ".s3privatecloud")
+
+# Группы типов файлов: иконки в сетке и фильтр поиска
+FILE_TYPES = {
+    "image": IMAGE_EXTENSIONS,
+    "audio": ['.mp3', '.wav', '.ogg'],
+    "video": ['.mp4', '.mov', '.avi', '.mkv'],
+    "pdf": ['.pdf'],
+    "archive": ['.zip', '.rar', '.7z', '.tar', '.gz'],
+    "code": ['.py', '.js', '.html', '.css', '.json', '.xml', '.dart'],
+    "document": ['.txt', '.doc', '.docx', '.xls', '.xlsx', '.ppt'],
+    "app": ['.exe', '.apk', '.msi'],
+}
+FILE_TYPE_NAMES = {
+    "image": "Изображения", "audio": "Аудио", "video": "Видео", "pdf": "PDF",
+    "archive": "Архивы", "code": "Код", "document": "Документы", "app": "Приложения",
+}
+
+def file_extension(filename):
+    parts = filename.rsplit('.', 1)
+    return ('.' + parts[1].lower()) if len(parts) > 1 else ''
+
+def file_type(filename):
+    ext = file_extension(filename)
+    return next((group for group, exts in FILE_TYPES.items() if ext in exts), None)
+
+def is_image(filename):
+    return file_extension(filename) in IMAGE_EXTENSIONS
+
+@functools.lru_cache(maxsize=None)
+def has_pil():
+    # Только проверка, что Pillow установлен: сам импорт - в make_thumbnail,
+    # при первой миниатюре, а не при запуске приложения
+    return importlib.util.find_spec("PIL") is not None
+
+def make_thumbnail(source, size=THUMB_SIZE):
+    # Выполняется в отдельном процессе: декодирование не занимает UI-поток.
+    # source - путь к скачанному исходнику: в процесс передается только он, не байты
+    from PIL import Image
+    with Image.open(source) as img:
+        img.draft('RGB', (size * 2, size * 2))
+        img = img.convert('RGB')
+        img.thumbnail((size, size))
+        out = BytesIO()
+        img.save(out, 'JPEG', quality=80)
+        return out.getvalue()
+
+def format_size(total):
+    if total < 1024 * 1024: return f"{total/1024:.1f} KB"
+    elif total < 1024 * 1024 * 1024: return f"{total/(1024*1024):.1f} MB"
+    else: return f"{total/(1024*1024*1024):.2f} GB"
+
+def parent_prefix(key):
+    # "a/b/c.txt" -> "a/b/", "a/b/" -> "a/", "a/" -> ""
+    stripped = key.rstrip('/')
+    return stripped[:stripped.rfind('/') + 1]
+
+def local_state_path(name, *scope, ext=".json"):
+    # Отдельный файл на каждую пару (endpoint, bucket)
+    digest = hashlib.sha1("|".join(str(s) for s in scope).encode('utf-8')).hexdigest()[:16]
+    os.makedirs(APP_DATA_DIR, exist_ok=True)
+    return os.path.join(APP_DATA_DIR, f"{name}_{digest}{ext}")
+
+def import_boto3():
+    global boto3, Config, ClientError, BotoConnectionError, HTTPClientError, ParamValidationError
+    with BOTO3_LOCK:
+        if boto3: return
+        from botocore.config import Config
+        from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError, ParamValidationError
+        import boto3 as module
+        boto3 = module
+
+def is_network_error(e):
+    return boto3 is not None and isinstance(e, (BotoConnectionError, HTTPClientError))
+
+def is_hidden_key(key):
+    return key in [METADATA_FILE, SETTINGS_FILE] or key.startswith(METADATA_DIR)
+
+def error_code(e):
+    return e.response.get('Error', {}).get('Code', '') if boto3 and isinstance(e, ClientError) else ''
+
+def object_exists(s3, bucket, key):
+    return object_head(s3, bucket, key) is not None
+
+def object_head(s3, bucket, key):
+    # -> (размер, ETag) или None, если объекта нет
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if error_code(e) in ('404', 'NoSuchKey', 'NotFound'): return None
+        raise
+    return response['ContentLength'], response.get('ETag', '').strip('"')
+
+def write_json_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+class RequestMetrics:
+    # Замеры каждого вызова S3 через события botocore: задержка (с повторами),
+    # отправленные и полученные байты, число повторов и HTTP-статус по операциям.
+    # Сюда же пишутся ошибки фоновых задач, которые не показываются пользователю.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.reset()
+
+    def phase(self, name, seconds):
+        # Фаза запуска: секунд от старта процесса; пишется первое значение, сброс ее не трогает
+        with self.lock:
+            self.phases.setdefault(name, round(seconds, 3))
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.ops = {}
+            self.errors = deque(maxlen=METRICS_ERRORS)
+
+    def attach(self, client):
+        events = client.meta.events
+        events.register('before-call.s3', self.before_call)
+        events.register('after-call.s3', self.after_call)
+        events.register('after-call-error.s3', self.after_call_error)
+
+    @staticmethod
+    def body_length(params):
+        # Тело запроса к этому моменту - байты или поток (bytes botocore оборачивает в BytesIO)
+        length = params.get('headers', {}).get('Content-Length')
+        if length is not None: return int(length)
+        body = params.get('body')
+        if not body: return 0
+        if isinstance(body, (bytes, bytearray, str)): return len(body)
+        try:
+            pos = body.tell()
+            end = body.seek(0, 2)
+            body.seek(pos)
+            return end - pos
+        except Exception:
+            return 0
+
+    def before_call(self, params, context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+        context['metrics_sent'] = self.body_length(params)
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        received = int(http_response.headers.get('content-length') or 0)
+        error = parsed.get('Error', {}).get('Code') if http_response.status_code >= 300 else None
+        self.record(model.name, context, http_response.status_code, received, error)
+
+    def after_call_error(self, event_name, exception, context, **kwargs):
+        self.record(event_name.rsplit('.', 1)[-1], context, 0, 0, type(exception).__name__)
+
+    def record(self, op, context, status, received, error):
+        started = context.get('metrics_started')
+        if started is None: return
+        latency = time.perf_counter() - started
+        retries = max(0, context.get('retries', {}).get('attempt', 1) - 1)
+        with self.lock:
+            stats = self.ops.get(op)
+            if stats is None:
+                stats = self.ops[op] = {
+                    'count': 0, 'errors': 0, 'retries': 0, 'sent': 0, 'received': 0, 'total': 0.0,
+                    'status': {}, 'buckets': [0] * len(METRICS_BUCKETS), 'samples': deque(maxlen=METRICS_SAMPLES),
+                }
+            stats['count'] += 1
+            stats['retries'] += retries
+            stats['sent'] += context.get('metrics_sent', 0)
+            stats['received'] += received
+            stats['total'] += latency
+            stats['status'][status] = stats['status'].get(status, 0) + 1
+            stats['samples'].append(latency)
+            for i, bound in enumerate(METRICS_BUCKETS):
+                if latency <= bound:
+                    stats['buckets'][i] += 1
+                    break
+            if error:
+                stats['errors'] += 1
+                text = error if not status else f"HTTP {status}" if error == str(status) else f"HTTP {status}: {error}"
+                self.errors.append({'time': time.time(), 'source': op, 'error': text})
+
+    def note_error(self, source, e):
+        # Ошибка фоновой задачи, не связанная с одним запросом
+        with self.lock:
+            self.errors.append({'time': time.time(), 'source': source, 'error': f"{type(e).__name__}: {e}"})
+
+    @staticmethod
+    def percentile(ordered, q):
+        if not ordered: return 0.0
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self):
+        # -> {'uptime', 'operations': {op: {...; p50/p90/p99 в мс}}, 'errors': [...]}
+        with self.lock:
+            ops = {op: dict(stats, samples=sorted(stats['samples']), status=dict(stats['status']), buckets=list(stats['buckets']))
+                   for op, stats in self.ops.items()}
+            errors = list(self.errors)
+            phases = dict(self.phases)
+            uptime = time.time() - self.started
+        operations = {}
+        for op, stats in sorted(ops.items()):
+            samples = stats['samples']
+            operations[op] = {
+                'count': stats['count'], 'errors': stats['errors'], 'retries': stats['retries'],
+                'bytes_sent': stats['sent'], 'bytes_received': stats['received'],
+                'status': {str(k): v for k, v in sorted(stats['status'].items())},
+                'avg_ms': round(stats['total'] / stats['count'] * 1000, 1),
+                'p50_ms': round(self.percentile(samples, 0.5) * 1000, 1),
+                'p90_ms': round(self.percentile(samples, 0.9) * 1000, 1),
+                'p99_ms': round(self.percentile(samples, 0.99) * 1000, 1),
+                'max_ms': round(samples[-1] * 1000, 1) if samples else 0.0,
+                'sum_seconds': stats['total'], 'buckets': stats['buckets'],
+            }
+        return {'uptime': round(uptime, 1), 'operations': operations, 'errors': errors, 'phases': phases}
+
+    def to_json(self):
+        data = self.snapshot()
+        for stats in data['operations'].values():
+            stats.pop('buckets')
+            stats.pop('sum_seconds')
+        return json.dumps(data, indent=2, ensure_ascii=False)
+
+    def to_prometheus(self):
+        # Текстовый формат экспозиции Prometheus
+        data = self.snapshot()
+        ops = data['operations']
+        lines = [
+            "# HELP s3cloud_request_duration_seconds S3 request latency including retries",
+            "# TYPE s3cloud_request_duration_seconds histogram",
+        ]
+        for op, stats in ops.items():
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS, stats['buckets']):
+                cumulative += count
+                lines.append(f's3cloud_request_duration_seconds_bucket{{operation="{op}",le="{bound}"}} {cumulative}')
+            lines.append(f's3cloud_request_duration_seconds_bucket{{operation="{op}",le="+Inf"}} {stats["count"]}')
+            lines.append(f's3cloud_request_duration_seconds_sum{{operation="{op}"}} {stats["sum_seconds"]:.6f}')
+            lines.append(f's3cloud_request_duration_seconds_count{{operation="{op}"}} {stats["count"]}')
+        counters = [
+            ("requests_total", "S3 requests by HTTP status (0 - no response)", None),
+            ("request_errors_total", "Failed S3 requests", 'errors'),
+            ("request_retries_total", "Retried S3 attempts", 'retries'),
+            ("sent_bytes_total", "Request body bytes sent", 'bytes_sent'),
+            ("received_bytes_total", "Response bytes announced by Content-Length", 'bytes_received'),
+        ]
+        for name, help_text, field in counters:
+            lines.append(f"# HELP s3cloud_{name} {help_text}")
+            lines.append(f"# TYPE s3cloud_{name} counter")
+            for op, stats in ops.items():
+                if field:
+                    lines.append(f's3cloud_{name}{{operation="{op}"}} {stats[field]}')
+                else:
+                    for status, count in stats['status'].items():
+                        lines.append(f's3cloud_{name}{{operation="{op}",status="{status}"}} {count}')
+        if data['phases']:
+            lines.append("# HELP s3cloud_startup_phase_seconds Seconds from process start to the end of a startup phase")
+            lines.append("# TYPE s3cloud_startup_phase_seconds gauge")
+            for phase, seconds in data['phases'].items():
+                lines.append(f's3cloud_startup_phase_seconds{{phase="{phase}"}} {seconds}')
+        return "\n".join(lines) + "\n"
+
+class S3ClientPool:
+    # Клиенты boto3 с настроенным пулом соединений, таймаутами, адаптивными
+    # повторами и TCP keepalive. Клиенты кэшируются по (endpoint, регион,
+    # ключи, настройки), поэтому переключение между открытыми хранилищами
+    # не создает новый клиент, TLS-сессию и пробный запрос. Последние
+    # S3_OPEN_STORAGES хранилищ остаются открытыми (см. storage()).
+    def __init__(self, metrics=None):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.storages = OrderedDict()  # (endpoint, бакет) -> CloudStorage, LRU
+        self.verified = set()
+        self.metrics = metrics or RequestMetrics()
+        self.warmed = False
+
+    def warm_up(self):
+        # Импорт boto3 и загрузка описаний API S3 заранее, без сетевых запросов:
+        # следующий клиент создается за миллисекунды
+        import_boto3()
+        with BOTO3_LOCK:
+            if self.warmed: return
+            boto3.client('s3', region_name='us-east-1', aws_access_key_id='-', aws_secret_access_key='-')
+            self.warmed = True
+
+    @staticmethod
+    def client_key(ak, sk, endpoint, region, settings):
+        secret = hashlib.sha256(sk.encode('utf-8')).hexdigest()
+        return (endpoint, region, ak, secret, tuple(sorted(settings.items())))
+
+    def get(self, ak, sk, endpoint, region, settings=None):
+        settings = dict(settings or {})
+        key = self.client_key(ak, sk, endpoint, region, settings)
+        with self.lock:
+            client = self.clients.get(key)
+        if client: return client
+        import_boto3()
+        config = Config(
+            max_pool_connections=int(settings.get("pool_size", S3_POOL_SIZE)),
+            connect_timeout=float(settings.get("connect_timeout", S3_CONNECT_TIMEOUT)),
+            read_timeout=float(settings.get("read_timeout", S3_READ_TIMEOUT)),
+            retries={
+                'mode': 'adaptive' if settings.get("adaptive_retries", True) else 'standard',
+                'max_attempts': int(settings.get("max_attempts", S3_MAX_ATTEMPTS)),
+            },
+            tcp_keepalive=True,
+        )
+        # Сессия boto3 по умолчанию не потокобезопасна при создании клиентов
+        with BOTO3_LOCK:
+            client = boto3.client(
+                's3',
+                endpoint_url=endpoint,
+                aws_access_key_id=ak,
+                aws_secret_access_key=sk,
+                region_name=region,
+                config=config,
+            )
+            self.warmed = True
+        self.metrics.attach(client)
+        with self.lock:
+            return self.clients.setdefault(key, client)
+
+    def is_verified(self, client, bucket):
+        with self.lock:
+            return (id(client), bucket) in self.verified
+
+    def mark_verified(self, client, bucket):
+        with self.lock:
+            self.verified.add((id(client), bucket))
+
+    def storage(self, ak, sk, endpoint, bucket, region, settings=None, listing_cache=None):
+        # Открытое хранилище: при возврате к бакету каталог, индексы и журналы не открываются заново.
+        # Вытесненное из LRU или открытое с другим клиентом (ключи, настройки) закрывается в фоне
+        s3 = self.get(ak, sk, endpoint, region, settings)
+        closing = []
+        with self.lock:
+            storage = self.storages.pop((endpoint, bucket), None)
+            if storage and storage.s3 is not s3:
+                closing.append(storage)
+                storage = None
+            if storage is None: storage = CloudStorage(s3, endpoint, bucket, listing_cache)
+            self.storages[(endpoint, bucket)] = storage
+            while len(self.storages) > S3_OPEN_STORAGES:
+                closing.append(self.storages.popitem(last=False)[1])
+        self.close_later(closing)
+        return storage
+
+    @staticmethod
+    def close_later(storages):
+        for storage in storages: threading.Thread(target=storage.close, daemon=True).start()
+
+    def forget(self, ak, endpoint):
+        # Выход: закрываем все клиенты с этими ключами и их хранилища
+        with self.lock:
+            gone = set()
+            for key in [k for k in self.clients if k[0] == endpoint and k[2] == ak]:
+                client = self.clients.pop(key)
+                gone.add(id(client))
+                self.verified = {v for v in self.verified if v[0] != id(client)}
+            closing = [s for s in self.storages.values() if id(s.s3) in gone]
+            for storage in closing: del self.storages[storage.scope]
+        self.close_later(closing)
+
+class AsyncRunner:
+    # Цикл asyncio в отдельном потоке; блокирующие вызовы boto3 выполняются
+    # в ограниченном пуле потоков (call). Задача с ключом отменяет предыдущую
+    # задачу с тем же ключом - результат ушедшей навигации не доходит до
+    # интерфейса, а ее следующие запросы не отправляются.
+    def __init__(self, workers=IO_WORKERS, on_error=None):
+        self.on_error = on_error
+        self.tasks = {}
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="s3io")
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+
+    async def call(self, fn, *args, **kwargs):
+        return await self.loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+
+    def submit(self, coro, key=None):
+        # Из любого потока -> concurrent.futures.Future
+        future = asyncio.run_coroutine_threadsafe(self._run(coro, key), self.loop)
+        future.add_done_callback(self._report)
+        return future
+
+    async def _run(self, coro, key):
+        # Словарь задач трогается только из потока цикла
+        task = asyncio.current_task()
+        if key is not None:
+            previous = self.tasks.get(key)
+            if previous: previous.cancel()
+            self.tasks[key] = task
+        try:
+            return await coro
+        finally:
+            if key is not None and self.tasks.get(key) is task: del self.tasks[key]
+
+    def cancel(self, *keys):
+        # Тоже задача цикла: она стартует после задач, отправленных раньше,
+        # и застает их в словаре, даже если они еще не начали выполняться
+        async def cancel_tasks():
+            for key in keys:
+                task = self.tasks.get(key)
+                if task: task.cancel()
+        asyncio.run_coroutine_threadsafe(cancel_tasks(), self.loop)
+
+    def _report(self, future):
+        if future.cancelled() or not self.on_error: return
+        error = future.exception()
+        if error: self.on_error(error)
+
+class JobCancelled(Exception):
+    pass
+
+class TransferGate:
+    # Точка контроля передачи внутри движков: check() между единицами работы,
+    # request() вокруг каждого S3-запроса с данными, transferred() после
+    # переданных байтов. Без планировщика (CLI, бенчмарки) ничего не ограничивает.
+    def check(self):
+        pass
+
+    def request(self):
+        return contextlib.nullcontext()
+
+    def transferred(self, direction, n):
+        pass
+
+NO_GATE = TransferGate()
+
+def gated_pages(pages, gate):
+    # Страницы пагинатора: каждый запрос страницы - через gate
+    pages = iter(pages)
+    while True:
+        with gate.request():
+            page = next(pages, None)
+        if page is None: return
+        yield page
+
+class FolderListing:
+    # Постраничный листинг одной папки (Delimiter='/') по ContinuationToken.
+    # Страницы запрашиваются по мере прокрутки, а не все сразу.
+    def __init__(self, s3, bucket, prefix, page_size=LIST_PAGE_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.page_size = page_size
+        self.token = None
+        self.exhausted = False
+        self.pages = 0
+
+    def fetch_page(self):
+        if self.exhausted: return []
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix, 'Delimiter': '/', 'MaxKeys': self.page_size}
+        if self.token: kwargs['ContinuationToken'] = self.token
+        response = self.s3.list_objects_v2(**kwargs)
+        self.token = response.get('NextContinuationToken')
+        self.exhausted = not (response.get('IsTruncated') and self.token)
+        self.pages += 1
+        return self.parse(response)
+
+    def snapshot(self, entries):
+        return {'entries': list(entries), 'token': self.token, 'exhausted': self.exhausted, 'pages': self.pages}
+
+    @classmethod
+    def restore(cls, s3, bucket, prefix, snapshot):
+        listing = cls(s3, bucket, prefix)
+        listing.token = snapshot['token']
+        listing.exhausted = snapshot['exhausted']
+        listing.pages = snapshot['pages']
+        return listing
+
+    def fetch_nonempty(self):
+        # Страница может целиком состоять из скрытых ключей
+        entries = self.fetch_page()
+        while not entries and not self.exhausted:
+            entries = self.fetch_page()
+        return entries
+
+    def parse(self, response):
+        entries = []
+        for p in response.get('CommonPrefixes', []):
+            if is_hidden_key(p['Prefix']): continue
+            entries.append({'type': 'folder', 'key': p['Prefix']})
+        for obj in response.get('Contents', []):
+            key = obj['Key']
+            if key == self.prefix or is_hidden_key(key): continue
+            if not key.split('/')[-1]: continue
+            modified = obj.get('LastModified')
+            entries.append({
+                'type': 'file', 'key': key, 'size': obj['Size'],
+                'etag': obj.get('ETag', '').strip('"'),
+                'modified': modified.timestamp() if modified else 0,
+            })
+        return entries
+
+class ListingCache:
+    # LRU-кэш загруженных страниц листинга по (хранилище, prefix).
+    # Размер ограничен суммарным числом записей во всех папках.
+    def __init__(self, max_entries=LISTING_CACHE_ENTRIES, ttl=LISTING_CACHE_TTL, max_stale=LISTING_CACHE_MAX_STALE):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.total = 0
+
+    def get(self, scope, prefix):
+        # -> (snapshot, fresh) или None
+        with self.lock:
+            item = self.items.get((scope, prefix))
+            if not item: return None
+            age = time.time() - item['time']
+            if age > self.max_stale:
+                self._drop((scope, prefix))
+                return None
+            self.items.move_to_end((scope, prefix))
+            snapshot = dict(item['snapshot'], entries=list(item['snapshot']['entries']))
+            return snapshot, age <= self.ttl
+
+    def put(self, scope, prefix, snapshot):
+        with self.lock:
+            self._drop((scope, prefix))
+            self.items[(scope, prefix)] = {'snapshot': snapshot, 'time': time.time()}
+            self.total += len(snapshot['entries'])
+            while self.total > self.max_entries and len(self.items) > 1:
+                self._drop(next(iter(self.items)))
+
+    def is_fresh(self, scope, prefix):
+        # Без обновления порядка LRU - для проверок перед предзагрузкой
+        with self.lock:
+            item = self.items.get((scope, prefix))
+            return bool(item) and time.time() - item['time'] <= self.ttl
+
+    def invalidate(self, scope, prefix):
+        with self.lock:
+            self._drop((scope, prefix))
+
+    def invalidate_tree(self, scope, prefix):
+        with self.lock:
+            for key in [k for k in self.items if k[0] == scope and k[1].startswith(prefix)]:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.total = 0
+
+    def _drop(self, key):
+        item = self.items.pop(key, None)
+        if item: self.total -= len(item['snapshot']['entries'])
+
+class PersistentState:
+    # Локальный JSON-файл состояния с отложенной (debounce) записью
+    SAVE_DELAY = 2.0
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_timer = None
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception:
+            data = {}
+        self.load_state(data)
+
+    def load_state(self, data):
+        pass
+
+    def dump_state(self):
+        return {}
+
+    def schedule_save(self):
+        with self.lock:
+            if self.save_timer: return
+            self.save_timer = threading.Timer(self.SAVE_DELAY, self.save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def save(self):
+        with self.lock:
+            self.save_timer = None
+            try:
+                write_json_atomic(self.path, self.dump_state())
+            except Exception:
+                pass
+
+class StorageUsageIndex(PersistentState):
+    # Занятое место по префиксам: prefix -> [байты, объекты].
+    # Объект учитывается в каждом родительском префиксе, "" - весь бакет.
+    # Загрузки/удаления правят индекс на месте, полный обход бакета -
+    # только редкая сверка (не чаще RECONCILE_INTERVAL). После неудачной
+    # сверки следующая - не раньше чем через RECONCILE_RETRY, с удвоением.
+    RECONCILE_INTERVAL = 6 * 60 * 60
+    RECONCILE_RETRY = 5 * 60
+
+    def __init__(self, path):
+        self.reconciling = False
+        self.pending = []
+        super().__init__(path)
+
+    def load_state(self, data):
+        self.totals = data.get("totals", {})
+        self.last_reconcile = data.get("last_reconcile", 0)
+        self.last_attempt = data.get("last_attempt", 0)
+        self.failures = data.get("failures", 0)
+        self.stale = data.get("stale", False)
+
+    def dump_state(self):
+        return {"totals": self.totals, "last_reconcile": self.last_reconcile, "last_attempt": self.last_attempt,
+                "failures": self.failures, "stale": self.stale}
+
+    @staticmethod
+    def ancestors(key):
+        # "a/b/c.txt" -> ["", "a/", "a/b/"]
+        parts = key.split('/')[:-1]
+        return [""] + ["/".join(parts[:i + 1]) + "/" for i in range(len(parts))]
+
+    def get(self, prefix=""):
+        with self.lock:
+            size, count = self.totals.get(prefix, (0, 0))
+            return size, count
+
+    def has_data(self):
+        return self.last_reconcile > 0
+
+    def children(self, prefix=""):
+        with self.lock:
+            return sorted(p for p in self.totals if p and parent_prefix(p) == prefix)
+
+    def _apply(self, key, size, count):
+        for prefix in self.ancestors(key):
+            entry = self.totals.setdefault(prefix, [0, 0])
+            entry[0] += size
+            entry[1] += count
+            if entry[1] <= 0 and prefix:
+                del self.totals[prefix]
+
+    def _apply_prefix_removal(self, prefix):
+        size, count = self.totals.get(prefix, (0, 0))
+        for p in self.ancestors(prefix):
+            if p == prefix: continue
+            entry = self.totals.setdefault(p, [0, 0])
+            entry[0] -= size
+            entry[1] -= count
+        for p in [p for p in self.totals if p.startswith(prefix)]:
+            del self.totals[p]
+
+    def add(self, key, size):
+        with self.lock:
+            self._apply(key, size, 1)
+            if self.reconciling: self.pending.append(("add", key, size))
+        self.schedule_save()
+
+    def resize(self, key, delta):
+        # Объект перезаписан: меняется только размер, число объектов то же
+        with self.lock:
+            self._apply(key, delta, 0)
+            if self.reconciling: self.pending.append(("resize", key, delta))
+        self.schedule_save()
+
+    def remove(self, key, size):
+        with self.lock:
+            self._apply(key, -size, -1)
+            if self.reconciling: self.pending.append(("remove", key, size))
+        self.schedule_save()
+
+    def remove_prefix(self, prefix):
+        with self.lock:
+            self._apply_prefix_removal(prefix)
+            if self.reconciling: self.pending.append(("remove_prefix", prefix, 0))
+        self.schedule_save()
+
+    def mark_stale(self):
+        # Итоги известны неточно (например, папка удалена не целиком) - сверка при первой возможности
+        with self.lock:
+            self.stale = True
+        self.schedule_save()
+
+    def reconcile_due(self):
+        now = time.time()
+        if self.reconciling: return False
+        if self.failures and now - self.last_attempt < min(self.RECONCILE_RETRY * 2 ** (self.failures - 1), self.RECONCILE_INTERVAL):
+            return False
+        return self.stale or now - self.last_reconcile > self.RECONCILE_INTERVAL
+
+    def reconcile(self, compute_totals, if_due=False):
+        # compute_totals() - полный обход бакета (см. BucketCatalog.sync).
+        # Изменения, сделанные приложением во время обхода, накапливаются
+        # в pending и применяются поверх результата. if_due=True - обход
+        # по расписанию: пока задача ждала в очереди, сверку могли уже сделать
+        with self.lock:
+            if self.reconciling or (if_due and not self.reconcile_due()): return False
+            self.reconciling = True
+            self.pending = []
+            self.last_attempt = time.time()
+        try:
+            totals = compute_totals()
+        except BaseException:
+            # Попытка запоминается: следующий refresh не начинает полный обход заново
+            with self.lock:
+                self.failures += 1
+                self.reconciling = False
+                self.pending = []
+            self.save()
+            raise
+        try:
+            with self.lock:
+                self.totals = totals
+                for op, key, size in self.pending:
+                    if op == "add": self._apply(key, size, 1)
+                    elif op == "remove": self._apply(key, -size, -1)
+                    elif op == "resize": self._apply(key, size, 0)
+                    else: self._apply_prefix_removal(key)
+                self.last_reconcile = time.time()
+                self.failures = 0
+                self.stale = False
+            self.save()
+            return True
+        finally:
+            with self.lock:
+                self.reconciling = False
+                self.pending = []
+
+class BucketCatalog:
+    # Локальная копия списка объектов бакета (SQLite): ключи, размеры, ETag,
+    # LastModified и папки. Папки открываются из каталога сразу и без сети,
+    # живые листинги и полная сверка вносят в него только разницу.
+    # Он же - индекс для поиска: имя (FTS5 trigram), расширение, размер, дата.
+    SCHEMA_VERSION = 1
+    UPSERT = """INSERT INTO objects (key, parent, name, ext, size, etag, modified) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET size=excluded.size, etag=excluded.etag, modified=excluded.modified"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            if self.db.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                # Каталог - это кэш: старую схему проще пересобрать следующей сверкой
+                for table in ["objects_fts", "objects", "folders", "state"]:
+                    self.db.execute(f"DROP TABLE IF EXISTS {table}")
+                self.db.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY, parent TEXT NOT NULL, name TEXT NOT NULL, ext TEXT NOT NULL,
+                size INTEGER NOT NULL, etag TEXT NOT NULL, modified REAL NOT NULL)""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS objects_parent ON objects(parent, key)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS objects_ext ON objects(ext, key)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS objects_size ON objects(size)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS objects_modified ON objects(modified)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS folders (prefix TEXT PRIMARY KEY, parent TEXT NOT NULL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS folders_parent ON folders(parent, prefix)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT)")
+            try:
+                self.db.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS objects_fts USING fts5(
+                    name, content='objects', content_rowid='rowid', tokenize='trigram')""")
+                self.db.execute("""CREATE TRIGGER IF NOT EXISTS objects_fts_insert AFTER INSERT ON objects BEGIN
+                    INSERT INTO objects_fts(rowid, name) VALUES (new.rowid, new.name); END""")
+                self.db.execute("""CREATE TRIGGER IF NOT EXISTS objects_fts_delete AFTER DELETE ON objects BEGIN
+                    INSERT INTO objects_fts(objects_fts, rowid, name) VALUES ('delete', old.rowid, old.name); END""")
+                self.fts = True
+            except sqlite3.OperationalError:
+                # SQLite без FTS5/trigram: поиск по имени через LIKE
+                self.fts = False
+
+    @staticmethod
+    def row(key, size, etag, modified):
+        name = key[len(parent_prefix(key)):].rstrip('/')
+        return (key, parent_prefix(key), name, file_extension(name) if not key.endswith('/') else '', size, etag, modified)
+
+    def get_state(self, name, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM state WHERE name=?", (name,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, name, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO state VALUES (?, ?)", (name, json.dumps(value)))
+
+    def has_folder(self, prefix):
+        with self.lock:
+            if not prefix: return self.db.execute("SELECT 1 FROM objects LIMIT 1").fetchone() is not None
+            return self.db.execute("SELECT 1 FROM folders WHERE prefix=?", (prefix,)).fetchone() is not None
+
+    def list_folder(self, prefix):
+        # Те же записи, что FolderListing.parse: сначала папки, затем файлы
+        with self.lock:
+            folders = self.db.execute("SELECT prefix FROM folders WHERE parent=? ORDER BY prefix", (prefix,)).fetchall()
+            files = self.db.execute(
+                "SELECT key, size, etag, modified FROM objects WHERE parent=? AND name != '' AND substr(key, -1) != '/' ORDER BY key",
+                (prefix,)).fetchall()
+        entries = [{'type': 'folder', 'key': f[0]} for f in folders if not is_hidden_key(f[0])]
+        entries += [{'type': 'file', 'key': k, 'size': size, 'etag': etag, 'modified': modified}
+                    for k, size, etag, modified in files if not is_hidden_key(k)]
+        return entries
+
+    def _add_folders(self, prefix):
+        rows = [(p, parent_prefix(p)) for p in StorageUsageIndex.ancestors(prefix) if p]
+        self.db.executemany("INSERT OR IGNORE INTO folders VALUES (?, ?)", rows)
+
+    def _delete_prefix(self, prefix):
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        self.db.execute("DELETE FROM objects WHERE key >= ? AND key < ?", (prefix, upper))
+        self.db.execute("DELETE FROM folders WHERE prefix >= ? AND prefix < ?", (prefix, upper))
+
+    def upsert(self, key, size, etag='', modified=None):
+        # -> прежний размер объекта или None, если его в каталоге не было
+        with self.lock, self.db:
+            previous = self.db.execute("SELECT size FROM objects WHERE key=?", (key,)).fetchone()
+            self.db.execute(self.UPSERT,
+                            self.row(key, size, etag, modified or time.time()))
+            self._add_folders(key if key.endswith('/') else parent_prefix(key))
+        return previous[0] if previous else None
+
+    def delete(self, key):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM objects WHERE key=?", (key,))
+
+    def delete_prefix(self, prefix):
+        with self.lock, self.db:
+            self._delete_prefix(prefix)
+
+    def apply_listing(self, prefix, entries, complete):
+        # Разница с живым листингом папки; полный листинг еще и удаляет пропавшее
+        files = [e for e in entries if e['type'] == 'file']
+        folders = {e['key'] for e in entries if e['type'] == 'folder'}
+        with self.lock, self.db:
+            known = {r[0]: r[1:] for r in self.db.execute(
+                "SELECT key, size, etag, modified FROM objects WHERE parent=? AND substr(key, -1) != '/'", (prefix,))}
+            changed = [self.row(e['key'], e['size'], e['etag'], e['modified']) for e in files
+                       if known.get(e['key']) != (e['size'], e['etag'], e['modified'])]
+            self.db.executemany(self.UPSERT, changed)
+            if prefix: self._add_folders(prefix)
+            self.db.executemany("INSERT OR IGNORE INTO folders VALUES (?, ?)", [(f, prefix) for f in folders])
+            if not complete: return
+            seen = {e['key'] for e in files}
+            gone = [(k,) for k in known if k not in seen and not is_hidden_key(k)]
+            self.db.executemany("DELETE FROM objects WHERE key=?", gone)
+            for (f,) in self.db.execute("SELECT prefix FROM folders WHERE parent=?", (prefix,)).fetchall():
+                if f not in folders: self._delete_prefix(f)
+
+    def last_sync(self):
+        return self.get_state("last_sync", 0)
+
+    def search(self, text="", group=None, min_size=None, max_size=None, since=None, until=None,
+               limit=SEARCH_PAGE_SIZE, offset=0):
+        # -> (записи как в листинге, есть ли еще)
+        # Служебные ключи отсекаются до LIMIT, иначе страница выходит короче
+        where = ["substr(key, -1) != '/'", "key NOT IN (?, ?)", "substr(key, 1, ?) != ?"]
+        args = [METADATA_FILE, SETTINGS_FILE, len(METADATA_DIR), METADATA_DIR]
+        text = (text or "").strip()
+        if text and self.fts and len(text) >= 3:
+            where.append("rowid IN (SELECT rowid FROM objects_fts WHERE objects_fts MATCH ?)")
+            args.append('"' + text.replace('"', '""') + '"')
+        elif text:
+            where.append("name LIKE ? ESCAPE '\\'")
+            args.append('%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if group:
+            exts = FILE_TYPES[group]
+            where.append(f"ext IN ({', '.join('?' * len(exts))})")
+            args.extend(exts)
+        for column, op, value in [("size", ">=", min_size), ("size", "<=", max_size),
+                                  ("modified", ">=", since), ("modified", "<=", until)]:
+            if value is not None:
+                where.append(f"{column} {op} ?")
+                args.append(value)
+        sql = f"SELECT key, size, etag, modified FROM objects WHERE {' AND '.join(where)} ORDER BY key LIMIT ? OFFSET ?"
+        with self.lock:
+            rows = self.db.execute(sql, args + [limit + 1, offset]).fetchall()
+        entries = [{'type': 'file', 'key': k, 'size': size, 'etag': etag, 'modified': modified}
+                   for k, size, etag, modified in rows[:limit]]
+        return entries, len(rows) > limit
+
+    def sync(self, s3, bucket, gate=NO_GATE):
+        # Полная сверка слиянием двух отсортированных списков: каждая страница
+        # S3 сравнивается с тем же диапазоном ключей каталога, записывается
+        # только разница. Попутно считаются итоги для StorageUsageIndex.
+        totals = {"": [0, 0]}
+        previous = ""
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in gated_pages(paginator.paginate(Bucket=bucket), gate):
+            objects = page.get('Contents', [])
+            if not objects: continue
+            last = objects[-1]['Key']
+            remote = {}
+            for obj in objects:
+                modified = obj.get('LastModified')
+                remote[obj['Key']] = (obj['Size'], obj.get('ETag', '').strip('"'), modified.timestamp() if modified else 0)
+                for prefix in StorageUsageIndex.ancestors(obj['Key']):
+                    entry = totals.setdefault(prefix, [0, 0])
+                    entry[0] += obj['Size']
+                    entry[1] += 1
+            with self.lock, self.db:
+                local = {r[0]: r[1:] for r in self.db.execute(
+                    "SELECT key, size, etag, modified FROM objects WHERE key > ? AND key <= ?", (previous, last))}
+                self.db.executemany("DELETE FROM objects WHERE key=?", [(k,) for k in local if k not in remote])
+                self.db.executemany(self.UPSERT,
+                                    [self.row(k, *v) for k, v in remote.items() if local.get(k) != v])
+            previous = last
+
+        folders = {p for p in totals if p}
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM objects WHERE key > ?", (previous,))
+            known = {r[0] for r in self.db.execute("SELECT prefix FROM folders")}
+            self.db.executemany("DELETE FROM folders WHERE prefix=?", [(p,) for p in known - folders])
+            self.db.executemany("INSERT INTO folders VALUES (?, ?)", [(p, parent_prefix(p)) for p in folders - known])
+        self.set_state("last_sync", time.time())
+        return totals
+
+class BucketIndexes:
+    # Локальные индексы одного хранилища. Собственные записи приложения
+    # правят их на месте, без повторного листинга.
+    def __init__(self, endpoint, bucket, listing_cache):
+        self.scope = (endpoint, bucket)
+        self.usage = StorageUsageIndex(local_state_path("usage", endpoint, bucket))
+        self.folder_tree = FolderTree(local_state_path("folders", endpoint, bucket))
+        self.catalog = BucketCatalog(local_state_path("catalog", endpoint, bucket, ext=".sqlite"))
+        self.listing_cache = listing_cache
+
+    def object_added(self, key, size, etag=''):
+        # Перезапись известного каталогу объекта меняет только размер в итогах
+        previous = self.catalog.upsert(key, size, etag)
+        if previous is None: self.usage.add(key, size)
+        else: self.usage.resize(key, size - previous)
+        self.folder_tree.add(key if key.endswith('/') else parent_prefix(key))
+        self.listing_cache.invalidate(self.scope, parent_prefix(key))
+
+    def object_removed(self, key, size):
+        self.usage.remove(key, size)
+        self.catalog.delete(key)
+        self.listing_cache.invalidate(self.scope, parent_prefix(key))
+
+    def prefix_changed(self, prefix):
+        # Папка изменилась не целиком (удаление с ошибками или отменено): точные итоги - после сверки
+        self.usage.mark_stale()
+        self.listing_cache.invalidate_tree(self.scope, prefix)
+        self.listing_cache.invalidate(self.scope, parent_prefix(prefix))
+
+    def prefix_removed(self, prefix):
+        self.usage.remove_prefix(prefix)
+        self.folder_tree.remove(prefix)
+        self.catalog.delete_prefix(prefix)
+        self.listing_cache.invalidate_tree(self.scope, prefix)
+        self.listing_cache.invalidate(self.scope, parent_prefix(prefix))
+
+    def listing_seen(self, prefix, entries, complete):
+        folders = [e['key'] for e in entries if e['type'] == 'folder']
+        self.folder_tree.observe(prefix, folders, complete)
+        self.catalog.apply_listing(prefix, entries, complete)
+
+class FolderTree(PersistentState):
+    # Дерево папок бакета: prefix -> дочерние префиксы.
+    # Строится параллельным обходом в ширину с Delimiter='/', поэтому
+    # видит и "неявные" папки без ключа-маркера. Между перестроениями
+    # дополняется листингами и собственными операциями приложения.
+    MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, path):
+        self.building = False
+        self.pending = []
+        super().__init__(path)
+
+    def load_state(self, data):
+        self.children = {k: set(v) for k, v in data.get("children", {}).items()}
+        self.children.setdefault("", set())
+        self.built_at = data.get("built_at", 0)
+
+    def dump_state(self):
+        return {"children": {k: sorted(v) for k, v in self.children.items()}, "built_at": self.built_at}
+
+    def is_built(self):
+        return self.built_at > 0
+
+    def is_stale(self):
+        return not self.building and time.time() - self.built_at > self.MAX_AGE
+
+    def list_children(self, prefix=""):
+        with self.lock:
+            return sorted(self.children.get(prefix, ()))
+
+    def all_folders(self):
+        # Все папки в порядке обхода в глубину
+        with self.lock:
+            result, stack = [], sorted(self.children.get("", ()), reverse=True)
+            while stack:
+                prefix = stack.pop()
+                result.append(prefix)
+                stack.extend(sorted(self.children.get(prefix, ()), reverse=True))
+            return result
+
+    def _add(self, prefix):
+        while prefix:
+            parent = parent_prefix(prefix)
+            self.children.setdefault(prefix, set())
+            siblings = self.children.setdefault(parent, set())
+            if prefix in siblings: break
+            siblings.add(prefix)
+            prefix = parent
+
+    def _remove(self, prefix):
+        self.children.get(parent_prefix(prefix), set()).discard(prefix)
+        for p in [p for p in self.children if p.startswith(prefix)]:
+            del self.children[p]
+
+    def add(self, prefix):
+        with self.lock:
+            self._add(prefix)
+            if self.building: self.pending.append(("add", prefix))
+        self.schedule_save()
+
+    def remove(self, prefix):
+        with self.lock:
+            self._remove(prefix)
+            if self.building: self.pending.append(("remove", prefix))
+        self.schedule_save()
+
+    def observe(self, prefix, folder_keys, complete):
+        # Листинг папки: полный - заменяет список детей, частичный - только дополняет
+        with self.lock:
+            self._add(prefix)
+            if complete:
+                for gone in self.children.get(prefix, set()) - set(folder_keys):
+                    self._remove(gone)
+            for key in folder_keys:
+                self._add(key)
+        self.schedule_save()
+
+    def build(self, s3, bucket, workers=8, gate=NO_GATE, if_stale=False):
+        # if_stale=True - перестроение по устареванию: задача могла ждать в очереди, пока дерево обновили
+        with self.lock:
+            if self.building or (if_stale and not self.is_stale()): return False
+            self.building = True
+            self.pending = []
+        try:
+            children = {}
+
+            def list_prefix(prefix):
+                found = []
+                paginator = s3.get_paginator('list_objects_v2')
+                for page in gated_pages(paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'), gate):
+                    found.extend(p['Prefix'] for p in page.get('CommonPrefixes', []) if not is_hidden_key(p['Prefix']))
+                return prefix, found
+
+            # Очередь префиксов и не больше workers запросов в работе: память и ожидание
+            # не растут с числом папок
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending, running = deque([""]), set()
+                while pending or running:
+                    while pending and len(running) < workers:
+                        running.add(pool.submit(list_prefix, pending.popleft()))
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        prefix, found = future.result()
+                        children[prefix] = set(found)
+                        pending.extend(found)
+
+            with self.lock:
+                self.children = children
+                for op, prefix in self.pending:
+                    if op == "add": self._add(prefix)
+                    else: self._remove(prefix)
+                self.built_at = time.time()
+            self.save()
+            return True
+        finally:
+            with self.lock:
+                self.building = False
+                self.pending = []
+
+class FolderMetadataStore:
+    # Цвета и подписи папок в облаке, по файлу на папку верхнего уровня:
+    # METADATA_DIR/<шард>.json. Папки верхнего уровня лежат в корневом шарде,
+    # остальные - в шарде своей верхней папки, поэтому открытие папки читает
+    # один небольшой файл. Правки - это операции: они сразу видны локально,
+    # копятся и пишутся одним запросом на шард после паузы. Запись условная
+    # (If-Match по ETag, If-None-Match для нового шарда); при конфликте шард
+    # перечитывается, операции накладываются заново и запись повторяется.
+    SAVE_DELAY = 1.5
+    RETRY_DELAY = 30
+    MAX_ATTEMPTS = 5
+    CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.remote = {}    # шард -> (данные, ETag или None, если файла еще нет)
+        self.pending = {}   # шард -> операции, еще не отправленные
+        self.inflight = {}  # шард -> операции, которые пишутся сейчас
+        self.views = {}     # шард -> remote с наложенными операциями
+        self.legacy = None
+        self.legacy_lock = threading.Lock()
+        self.migrating = None   # шарды прежнего файла, пока отметка о переносе не записана
+        self.conditional = True
+        self.save_timer = None
+
+    @staticmethod
+    def shard_name(segment):
+        return hashlib.sha1(segment.encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def shard_of(cls, folder_key):
+        parts = folder_key.rstrip('/').split('/')
+        return cls.shard_name(parts[0] if len(parts) > 1 else "")
+
+    @classmethod
+    def shard_for_children(cls, prefix):
+        return cls.shard_name(prefix.split('/')[0] if prefix else "")
+
+    @staticmethod
+    def shard_key(shard):
+        return f"{METADATA_DIR}{shard}.json"
+
+    @staticmethod
+    def apply(data, ops):
+        data = dict(data)
+        for op, key, meta in ops:
+            if op == "set":
+                data[key] = meta
+            else:
+                for k in [k for k in data if k.startswith(key)]: del data[k]
+        return data
+
+    def _update_view(self, shard):
+        if shard in self.remote:
+            self.views[shard] = self.apply(self.remote[shard][0], self.inflight.get(shard, []) + self.pending.get(shard, []))
+
+    def is_loaded(self, prefix):
+        return self.shard_for_children(prefix) in self.remote
+
+    def get(self, folder_key):
+        with self.lock:
+            return self.views.get(self.shard_of(folder_key), {}).get(folder_key, {})
+
+    def fetch(self, shard):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.shard_key(shard))
+            return json.loads(response['Body'].read().decode('utf-8')), response.get('ETag')
+        except ClientError as e:
+            if error_code(e) not in ('NoSuchKey', '404'): raise
+            return {}, None
+
+    def legacy_entries(self, shard):
+        # Ленивая миграция: шарда еще нет - берем его записи из прежнего общего файла.
+        # Прочитанный файл переносится целиком (все его шарды - в очередь записи),
+        # после чего ставится отметка METADATA_MIGRATED и файл больше не читается
+        with self.legacy_lock:
+            if self.legacy is None: self.legacy = self.read_legacy()
+        return {k: v for k, v in self.legacy.items() if self.shard_of(k) == shard}
+
+    def read_legacy(self):
+        if object_exists(self.s3, self.bucket, METADATA_MIGRATED): return {}
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=METADATA_FILE)
+            legacy = json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if error_code(e) not in ('NoSuchKey', '404'): raise
+            legacy = {}
+        with self.lock:
+            self.migrating = {self.shard_of(k) for k in legacy}
+            for shard in self.migrating: self.pending.setdefault(shard, [])
+        self.schedule_flush()
+        return legacy
+
+    def finish_migration(self):
+        # Все шарды прежнего файла записаны - ставим отметку
+        with self.lock:
+            shards = self.migrating
+            if shards is None: return
+            # Шард перенесен, когда он есть в облаке (ETag) или переносить в него нечего
+            if any(s not in self.remote or (self.remote[s][1] is None and self.remote[s][0]) for s in shards): return
+        self.s3.put_object(Bucket=self.bucket, Key=METADATA_MIGRATED, ContentType='application/json',
+                           Body=json.dumps({'migrated': time.time(), 'shards': len(shards)}).encode('utf-8'))
+        with self.lock:
+            self.migrating = None
+
+    def load(self, prefix):
+        self._load_shard(self.shard_for_children(prefix))
+
+    def _load_shard(self, shard):
+        data, etag = self.fetch(shard)
+        migrated = etag is None and self.legacy_entries(shard)
+        with self.lock:
+            self.remote[shard] = (migrated or data, etag)
+            self._update_view(shard)
+            # Перенесенные записи записываются в новый шард обычным путем
+            if migrated: self.pending.setdefault(shard, [])
+        if migrated: self.schedule_flush()
+
+    def set(self, folder_key, meta):
+        self._queue(self.shard_of(folder_key), ("set", folder_key, meta))
+        self.schedule_flush()
+
+    def move_tree(self, src, dst, keep=False):
+        # Записи папки и вложенных переезжают вместе с ней; keep=True - копия
+        shards = {self.shard_of(src), self.shard_for_children(src)}
+        for shard in shards:
+            if shard not in self.remote: self._load_shard(shard)
+        with self.lock:
+            entries = {k: v for shard in shards for k, v in self.views.get(shard, {}).items() if k.startswith(src)}
+        for key, meta in entries.items():
+            moved = dst + key[len(src):]
+            self._queue(self.shard_of(moved), ("set", moved, meta))
+        if not keep: self.remove_tree(src)
+        self.schedule_flush()
+
+    def remove_tree(self, folder_key):
+        # Запись самой папки и всех вложенных (для папки верхнего уровня - весь ее шард)
+        for shard in {self.shard_of(folder_key), self.shard_for_children(folder_key)}:
+            self._queue(shard, ("drop", folder_key, None))
+        self.schedule_flush()
+
+    def _queue(self, shard, op):
+        with self.lock:
+            self.pending.setdefault(shard, []).append(op)
+            self._update_view(shard)
+
+    def schedule_flush(self, delay=None):
+        with self.lock:
+            if self.save_timer: return
+            self.save_timer = threading.Timer(delay or self.SAVE_DELAY, self.flush)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                if self.save_timer: self.save_timer.cancel()
+                self.save_timer = None
+                self.inflight, self.pending = self.pending, {}
+            failed = False
+            for shard, ops in self.inflight.items():
+                try:
+                    if shard not in self.remote: self._load_shard(shard)
+                    result = self.write_shard(shard, ops)
+                except Exception:
+                    result = None
+                with self.lock:
+                    if result:
+                        self.remote[shard] = result
+                    else:
+                        failed = True
+                        self.pending[shard] = ops + self.pending.get(shard, [])
+                    self.inflight[shard] = []
+                    self._update_view(shard)
+            with self.lock:
+                self.inflight = {}
+            if not failed and self.migrating is not None:
+                try:
+                    self.finish_migration()
+                except Exception:
+                    failed = True
+            if failed: self.schedule_flush(self.RETRY_DELAY)
+            return not failed
+
+    def write_shard(self, shard, ops):
+        data, etag = self.remote[shard]
+        for attempt in range(self.MAX_ATTEMPTS):
+            merged = self.apply(data, ops)
+            if merged == data and (etag or not merged): return data, etag
+            kwargs = {}
+            if self.conditional: kwargs = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+            try:
+                response = self.s3.put_object(Bucket=self.bucket, Key=self.shard_key(shard), Body=json.dumps(merged).encode('utf-8'),
+                                              ContentType='application/json', **kwargs)
+                return merged, response.get('ETag')
+            except ParamValidationError:
+                # botocore до 1.35 не знает IfMatch/IfNoneMatch у put_object - как хранилище без условной записи
+                if not self.conditional: raise
+                self.conditional = False
+                continue
+            except ClientError as e:
+                code = error_code(e)
+                if code in ('NotImplemented', '501') and self.conditional:
+                    # Хранилище без условной записи: пишем как раньше, без защиты от гонок
+                    self.conditional = False
+                    continue
+                if code not in self.CONFLICT_CODES: raise
+            # Шард изменили с другого устройства: перечитываем и накладываем свои операции заново
+            data, etag = self.fetch(shard)
+        raise RuntimeError("metadata write conflict")
+
+class NavigationHistory(PersistentState):
+    # Переходы по папкам хранилища: prefix -> [вес, время]. Вес затухает
+    # с периодом полураспада, поэтому недавние и частые папки выше.
+    def load_state(self, data):
+        self.visits = data.get("visits", {})
+
+    def dump_state(self):
+        return {"visits": self.visits}
+
+    def score(self, prefix, now=None):
+        with self.lock:
+            visit = self.visits.get(prefix)
+        if not visit: return 0.0
+        return visit[0] * 0.5 ** (((now or time.time()) - visit[1]) / PREFETCH_HISTORY_HALF_LIFE)
+
+    def visit(self, prefix):
+        now = time.time()
+        weight = self.score(prefix, now) + 1
+        with self.lock:
+            self.visits[prefix] = [weight, now]
+            if len(self.visits) > PREFETCH_HISTORY_SIZE:
+                for old in sorted(self.visits, key=lambda p: self.visits[p][1])[:len(self.visits) - PREFETCH_HISTORY_SIZE]:
+                    del self.visits[old]
+        self.schedule_save()
+
+class ListingPrefetcher:
+    # Первая страница видимых подпапок и родителя загружается в кэш листингов
+    # заранее, чтобы переход показывал папку без ожидания. Не больше budget
+    # папок на переход и concurrency запросов одновременно; подпапки идут по
+    # убыванию веса в истории переходов. Новый переход отменяет недоделанную
+    # подгрузку, пользовательские передачи приостанавливают ее (paused).
+    def __init__(self, runner, budget=PREFETCH_BUDGET, concurrency=PREFETCH_CONCURRENCY):
+        self.runner = runner
+        self.budget = budget
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.transfers = 0
+        self.idle = threading.Event()
+        self.idle.set()
+        self.prefetched = set()
+        self.requests = 0
+        self.hits = 0
+
+    def visit(self, storage, prefix):
+        # Переход в папку: в историю и в счетчик попаданий предзагрузки
+        storage.history.visit(prefix)
+        with self.lock:
+            if (storage.scope, prefix) in self.prefetched:
+                self.prefetched.discard((storage.scope, prefix))
+                self.hits += 1
+
+    def candidates(self, storage, prefix, folders):
+        now = time.time()
+        ranked = sorted(folders, key=lambda f: -storage.history.score(f, now))
+        if prefix: ranked.insert(0, parent_prefix(prefix))
+        cache = storage.indexes.listing_cache
+        return [p for p in ranked if not cache.is_fresh(storage.scope, p)][:self.budget]
+
+    def schedule(self, storage, prefix, folders):
+        todo = self.candidates(storage, prefix, folders)
+        if todo: self.runner.submit(self.run(storage, todo), key="prefetch")
+
+    async def run(self, storage, prefixes):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def fetch(prefix):
+            async with slots:
+                while not self.idle.is_set():
+                    await asyncio.sleep(PREFETCH_PAUSE_POLL)
+                listing = storage.listing(prefix)
+                entries = await self.runner.call(listing.fetch_nonempty)
+                storage.listing_seen(listing, entries)
+                with self.lock:
+                    self.prefetched.add((storage.scope, prefix))
+                    self.requests += listing.pages
+
+        # Ошибки отдельных папок не важны: не загрузили заранее - загрузим при переходе
+        await asyncio.gather(*(fetch(p) for p in prefixes), return_exceptions=True)
+
+    @contextlib.contextmanager
+    def paused(self):
+        with self.lock:
+            self.transfers += 1
+            self.idle.clear()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.transfers -= 1
+                if not self.transfers: self.idle.set()
+
+class TokenBucket:
+    # Ограничение скорости: rate байт/с (0 - без ограничения), запас - burst секунд.
+    # Байты учитываются после передачи, превышение отрабатывается паузой
+    def __init__(self, rate=0, burst=1.0):
+        self.lock = threading.Lock()
+        self.burst = burst
+        self.configure(rate)
+
+    def configure(self, rate):
+        with self.lock:
+            self.rate = max(0, rate)
+            self.tokens = self.rate * self.burst
+            self.last = time.monotonic()
+
+    def take(self, n):
+        # -> сколько секунд подождать
+        with self.lock:
+            if not self.rate: return 0
+            now = time.monotonic()
+            self.tokens = min(self.rate * self.burst, self.tokens + (now - self.last) * self.rate) - n
+            self.last = now
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+class TransferJob(TransferGate):
+    # Задача планировщика. run(job) выполняется в своем потоке и передает job
+    # в движки как TransferGate; spec - JSON-параметры для продолжения после
+    # перезапуска приложения (только для persist=True), context - объект
+    # вызывающего кода (хранилище), на диск не пишется.
+    # Состояния: queued, running, paused, done, failed, cancelled
+    def __init__(self, scheduler, kind, title, run, spec=None, priority=PRIORITY_TRANSFER, scope=None,
+                 workers=None, persist=False, job_id=None, state="queued", context=None):
+        self.scheduler = scheduler
+        self.kind = kind
+        self.title = title
+        self.run = run
+        self.spec = spec or {}
+        self.context = context
+        self.priority = priority
+        self.scope = list(scope) if scope else None
+        self.persist = persist
+        self.id = job_id or f"{time.time():.6f}-{id(self):x}"
+        self.state = state
+        self.started = False
+        self.created = time.time()
+        self.status = ""
+        self.fraction = None
+        self.error = None
+        self.stop = threading.Event()
+        self.local = threading.local()  # held: поток сейчас занимает слот запроса
+        if workers is None: workers = TRANSFER_BACKGROUND_REQUESTS if priority == PRIORITY_BACKGROUND else TRANSFER_JOB_REQUESTS
+        self.slots = threading.Semaphore(max(1, workers))
+
+    @property
+    def cancelled(self):
+        return self.state == "cancelled"
+
+    @property
+    def finished(self):
+        return self.state in ("done", "failed", "cancelled")
+
+    def check(self):
+        self.scheduler.wait_runnable(self)
+
+    @contextlib.contextmanager
+    def request(self):
+        self.check()
+        self.take_slot()
+        try:
+            yield
+        finally:
+            if self.local.held: self.release_slot()
+
+    def take_slot(self):
+        self.slots.acquire()
+        try:
+            self.scheduler.acquire(self)
+        except BaseException:
+            self.slots.release()
+            raise
+        self.local.held = True
+
+    def release_slot(self):
+        self.local.held = False
+        self.scheduler.release()
+        self.slots.release()
+
+    def transferred(self, direction, n):
+        delay = self.scheduler.buckets[direction].take(n)
+        if not delay: return
+        # Пауза ограничения скорости - без слотов: поток, читающий ответ внутри request(),
+        # отдает их другим задачам и обходам и занимает заново после паузы
+        held = getattr(self.local, 'held', False)
+        if held: self.release_slot()
+        self.stop.wait(delay)
+        if held:
+            self.check()
+            self.take_slot()
+
+    def report(self, status, fraction=None):
+        self.status = status
+        self.fraction = fraction
+        self.scheduler.changed()
+
+    def update(self, change):
+        # change(spec) правит параметры на месте (например, убирает загруженные файлы)
+        with self.scheduler.cond:
+            change(self.spec)
+        if self.persist: self.scheduler.schedule_save()
+
+    def to_dict(self):
+        return {'id': self.id, 'kind': self.kind, 'title': self.title, 'spec': copy.deepcopy(self.spec), 'priority': self.priority,
+                'scope': self.scope, 'state': "paused" if self.state == "paused" else "queued", 'created': self.created}
+
+class TransferScheduler(PersistentState):
+    # Единая очередь передач и фоновых обходов. Задачи стартуют по классу
+    # приоритета и времени постановки, не больше max_jobs одновременно
+    # (действия пользователя - без очереди). S3-запросы всех задач делят
+    # max_requests слотов: свободный слот получает ожидающий запрос с высшим
+    # приоритетом, а пока идут запросы интерфейса (interactive), передачам
+    # остается только доля слотов. Скорость загрузки и скачивания общая на все
+    # задачи. Незавершенные задачи с persist=True хранятся на диске и
+    # продолжаются через restore() после подключения к своему хранилищу.
+    def __init__(self, path, max_jobs=TRANSFER_MAX_JOBS, max_requests=TRANSFER_MAX_REQUESTS, on_change=None):
+        self.cond = threading.Condition()
+        self.jobs = OrderedDict()
+        self.kinds = {}
+        self.saved = []
+        self.max_jobs = max_jobs
+        self.max_requests = max_requests
+        self.active = 0
+        self.waiting = []
+        self.interactive_calls = 0
+        self.buckets = {"upload": TokenBucket(), "download": TokenBucket()}
+        self.on_change = on_change
+        super().__init__(path)
+
+    def load_state(self, data):
+        self.saved = data.get('jobs', [])
+
+    def dump_state(self):
+        # save() держит self.lock; под self.cond запись не планируется, так что порядок блокировок один
+        with self.cond:
+            jobs = [job.to_dict() for job in self.jobs.values() if job.persist and not job.finished]
+            return {'jobs': jobs + list(self.saved)}
+
+    def configure(self, max_jobs=None, max_requests=None, upload_rate=None, download_rate=None):
+        # Скорости - байт/с, 0 - без ограничения
+        if upload_rate is not None: self.buckets["upload"].configure(upload_rate)
+        if download_rate is not None: self.buckets["download"].configure(download_rate)
+        with self.cond:
+            if max_jobs: self.max_jobs = max(1, max_jobs)
+            if max_requests: self.max_requests = max(1, max_requests)
+            self.cond.notify_all()
+        self.pump()
+
+    def register(self, kind, run):
+        # Как выполнять сохраненные задачи этого вида: run(job), параметры в job.spec
+        self.kinds[kind] = run
+
+    def submit(self, kind, title, run=None, spec=None, priority=PRIORITY_TRANSFER, scope=None, workers=None,
+               persist=False, context=None):
+        job = TransferJob(self, kind, title, run or self.kinds[kind], spec, priority, scope, workers, persist, context=context)
+        with self.cond:
+            self.jobs[job.id] = job
+        if persist: self.schedule_save()
+        self.pump()
+        return job
+
+    def restore(self, scope, context=None):
+        # Сохраненные задачи этого хранилища снова в очередь (приостановленные - на паузе)
+        with self.cond:
+            mine = [d for d in self.saved if d.get('scope') == list(scope) and d.get('kind') in self.kinds]
+            self.saved = [d for d in self.saved if d not in mine]
+            for d in mine:
+                job = TransferJob(self, d['kind'], d['title'], self.kinds[d['kind']], d['spec'], d['priority'], scope,
+                                  persist=True, job_id=d['id'], state=d['state'], context=context)
+                job.created = d.get('created', job.created)
+                self.jobs[job.id] = job
+        self.pump()
+        return len(mine)
+
+    def all(self):
+        with self.cond:
+            return list(self.jobs.values())
+
+    def pending(self, kind=None):
+        return [job for job in self.all() if not job.finished and (kind is None or job.kind == kind)]
+
+    def pump(self):
+        with self.cond:
+            running = sum(1 for j in self.jobs.values() if j.state == "running" and j.priority != PRIORITY_INTERACTIVE)
+            queued = sorted((j for j in self.jobs.values() if j.state == "queued"), key=lambda j: (j.priority, j.created))
+            for job in queued:
+                if job.priority != PRIORITY_INTERACTIVE:
+                    if running >= self.max_jobs: continue
+                    running += 1
+                job.state = "running"
+                job.started = True
+                threading.Thread(target=self._execute, args=(job,), daemon=True).start()
+        self.changed()
+
+    def _execute(self, job):
+        try:
+            job.run(job)
+            state = "done"
+        except JobCancelled:
+            state = "cancelled"
+        except Exception as e:
+            job.error = e
+            state = "failed"
+        with self.cond:
+            if job.state != "cancelled": job.state = state
+            finished = [j for j in self.jobs.values() if j.finished]
+            for old in finished[:max(0, len(finished) - TRANSFER_FINISHED_KEEP)]:
+                del self.jobs[old.id]
+            self.cond.notify_all()
+        if job.persist: self.schedule_save()
+        self.pump()
+
+    def pause(self, job):
+        # Начатая задача останавливается перед следующим запросом; слот задачи освобождается
+        with self.cond:
+            if job.state not in ("queued", "running"): return
+            job.state = "paused"
+            self.cond.notify_all()
+        if job.persist: self.schedule_save()
+        self.pump()
+
+    def resume(self, job):
+        # Начатая задача продолжается сразу, даже сверх max_jobs
+        with self.cond:
+            if job.state != "paused": return
+            job.state = "running" if job.started else "queued"
+            self.cond.notify_all()
+        if job.persist: self.schedule_save()
+        self.pump()
+
+    def cancel(self, job):
+        with self.cond:
+            if job.finished: return
+            started, job.state = job.started, "cancelled"
+            job.stop.set()
+            self.cond.notify_all()
+        if job.persist: self.schedule_save()
+        self.pump()
+        if not started: self.changed()
+
+    def wait_runnable(self, job):
+        with self.cond:
+            while job.state == "paused":
+                self.cond.wait()
+            if job.state == "cancelled": raise JobCancelled()
+
+    def can_start(self, job):
+        if self.active >= self.max_requests: return False
+        if any(w.priority < job.priority and w.state == "running" for w in self.waiting): return False
+        if job.priority != PRIORITY_INTERACTIVE and self.interactive_calls:
+            return self.active < max(1, int(self.max_requests * TRANSFER_INTERACTIVE_SHARE))
+        return True
+
+    def acquire(self, job):
+        with self.cond:
+            self.waiting.append(job)
+            try:
+                while job.state == "paused" or not self.can_start(job):
+                    if job.state == "cancelled": raise JobCancelled()
+                    self.cond.wait()
+                if job.state == "cancelled": raise JobCancelled()
+            finally:
+                self.waiting.remove(job)
+            self.active += 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def interactive(self):
+        # Запрос интерфейса (листинг): пока он идет, передачи не занимают новые слоты сверх своей доли
+        with self.cond:
+            self.interactive_calls += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.interactive_calls -= 1
+                self.cond.notify_all()
+
+    def changed(self):
+        if self.on_change: self.on_change()
+
+class FileSlice:
+    # Окно [offset, offset+length) локального файла как seekable-поток для upload_part.
+    # on_read(n) вызывается на каждый отправленный кусок. botocore читает тело
+    # еще и для контрольных сумм и подписи - эти проходы не учитываются (см. attach)
+    def __init__(self, path, offset, length, on_read=None):
+        self.f = open(path, 'rb')
+        self.offset = offset
+        self.length = length
+        self.on_read = on_read
+        self.sending = False
+        self.pos = 0
+        self.f.seek(offset)
+
+    @classmethod
+    def attach(cls, client):
+        # Как в s3transfer: учет выключается в начале request-created и включается
+        # после подписи запроса, то есть только на время отправки тела
+        events = client.meta.events
+        events.register_first('request-created.s3', cls.hold, unique_id='s3cloud-slice-hold')
+        events.register_last('request-created.s3', cls.send, unique_id='s3cloud-slice-send')
+
+    @staticmethod
+    def hold(request, **kwargs):
+        if isinstance(request.body, FileSlice): request.body.sending = False
+
+    @staticmethod
+    def send(request, **kwargs):
+        if isinstance(request.body, FileSlice): request.body.sending = True
+
+    def read(self, n=-1):
+        left = self.length - self.pos
+        if n is None or n < 0 or n > left: n = left
+        data = self.f.read(n)
+        self.pos += len(data)
+        if data and self.sending and self.on_read: self.on_read(len(data))
+        return data
+
+    def seek(self, pos, whence=0):
+        if whence == 1: pos += self.pos
+        elif whence == 2: pos += self.length
+        self.pos = max(0, min(pos, self.length))
+        self.f.seek(self.offset + self.pos)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        self.f.close()
+
+class PrefixDeleter:
+    # Конвейерное удаление всего под префиксом: страницы листинга идут в
+    # ограниченную очередь, несколько потоков параллельно шлют DeleteObjects,
+    # пока листинг продолжается. Память ограничена размером очереди.
+    # versions=True удаляет также все версии и маркеры удаления.
+    def __init__(self, s3, bucket, workers=DELETE_WORKERS, versions=False, gate=NO_GATE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.workers = max(1, workers)
+        self.versions = versions
+        self.gate = gate
+        self.lock = threading.Lock()
+        self.deleted = 0
+        self.failed = 0
+        self.errors = []
+
+    def batches(self, prefix):
+        batch = []
+        if self.versions:
+            paginator = self.s3.get_paginator('list_object_versions')
+            for page in gated_pages(paginator.paginate(Bucket=self.bucket, Prefix=prefix), self.gate):
+                for v in page.get('Versions', []) + page.get('DeleteMarkers', []):
+                    batch.append({'Key': v['Key'], 'VersionId': v['VersionId']})
+                    if len(batch) == DELETE_BATCH:
+                        yield batch
+                        batch = []
+        else:
+            paginator = self.s3.get_paginator('list_objects_v2')
+            for page in gated_pages(paginator.paginate(Bucket=self.bucket, Prefix=prefix), self.gate):
+                for obj in page.get('Contents', []):
+                    batch.append({'Key': obj['Key']})
+                    if len(batch) == DELETE_BATCH:
+                        yield batch
+                        batch = []
+        if batch: yield batch
+
+    def delete(self, prefix, on_progress=None):
+        # on_progress(deleted, failed); -> (deleted, failed, [(key, code)])
+        batches = queue.Queue(maxsize=self.workers * 2)
+
+        def worker():
+            while True:
+                batch = batches.get()
+                if batch is None: return
+                try:
+                    self.delete_batch(batch)
+                except JobCancelled:
+                    # Остаток очереди пропускается, листинг остановится на следующей странице
+                    continue
+                if on_progress: on_progress(self.deleted, self.failed)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.workers)]
+        for t in threads: t.start()
+        try:
+            for batch in self.batches(prefix):
+                batches.put(batch)
+        finally:
+            for _ in threads: batches.put(None)
+            for t in threads: t.join()
+        self.gate.check()
+        return self.deleted, self.failed, self.errors
+
+    def delete_batch(self, batch):
+        # -> [(key, код ошибки)] этого пакета; self.errors - только первые для отчета.
+        # Повторяем только ключи, вернувшиеся в Errors, или весь пакет при сбое запроса
+        errors = []
+        for attempt in range(DELETE_RETRIES + 1):
+            if attempt: time.sleep(min(2 ** attempt * 0.5, 8))
+            try:
+                with self.gate.request():
+                    response = self.s3.delete_objects(Bucket=self.bucket, Delete={'Objects': batch, 'Quiet': True})
+            except JobCancelled:
+                raise
+            except Exception as e:
+                errors = [(o['Key'], str(e)) for o in batch]
+                continue
+            errors = response.get('Errors', [])
+            with self.lock:
+                self.deleted += len(batch) - len(errors)
+            if not errors: return []
+            retry = {(err['Key'], err.get('VersionId')) for err in errors}
+            batch = [o for o in batch if (o['Key'], o.get('VersionId')) in retry]
+            errors = [(err['Key'], err.get('Code', '')) for err in errors]
+        with self.lock:
+            self.failed += len(errors)
+            room = DELETE_MAX_REPORTED_ERRORS - len(self.errors)
+            if room > 0: self.errors.extend(errors[:room])
+        return errors
+
+class ObjectCopier:
+    # Копирование на стороне сервера, данные не проходят через устройство.
+    # До COPY_MAX_SINGLE - один CopyObject, больше - multipart, части
+    # копируются параллельными UploadPartCopy. CopySourceIfMatch не дает
+    # склеить части разных версий, если источник изменился во время копирования.
+    def __init__(self, s3, bucket, part_size=COPY_PART_SIZE, part_workers=COPY_PART_WORKERS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.part_size = part_size
+        self.part_workers = max(1, part_workers)
+
+    def copy(self, src, dst, size, etag=''):
+        # -> ETag нового объекта
+        source = {'Bucket': self.bucket, 'Key': src}
+        condition = {'CopySourceIfMatch': '"' + etag + '"'} if etag else {}
+        if size <= COPY_MAX_SINGLE:
+            response = self.s3.copy_object(Bucket=self.bucket, Key=dst, CopySource=source, **condition)
+            return response.get('CopyObjectResult', {}).get('ETag', '').strip('"')
+        return self.copy_multipart(source, dst, size, condition)
+
+    def copy_multipart(self, source, dst, size, condition):
+        # Multipart не переносит заголовки сам - берем их из источника
+        head = self.s3.head_object(**source)
+        headers = {'Metadata': head.get('Metadata', {})}
+        if head.get('ContentType'): headers['ContentType'] = head['ContentType']
+        upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=dst, **headers)['UploadId']
+        part_size = max(self.part_size, -(-size // MAX_PARTS))
+
+        def copy_part(number):
+            start = (number - 1) * part_size
+            end = min(start + part_size, size) - 1
+            response = self.s3.upload_part_copy(Bucket=self.bucket, Key=dst, UploadId=upload_id, PartNumber=number,
+                                                CopySource=source, CopySourceRange=f"bytes={start}-{end}", **condition)
+            return {'PartNumber': number, 'ETag': response['CopyPartResult']['ETag']}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.part_workers) as pool:
+                parts = list(pool.map(copy_part, range(1, -(-size // part_size) + 1)))
+            response = self.s3.complete_multipart_upload(Bucket=self.bucket, Key=dst, UploadId=upload_id, MultipartUpload={'Parts': parts})
+            return response.get('ETag', '').strip('"')
+        except Exception:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=dst, UploadId=upload_id)
+            except Exception:
+                pass
+            raise
+
+class MoveJournal(PersistentState):
+    # Незавершенные копирования и перемещения папок: id -> {'src', 'dst', 'move'}
+    def load_state(self, data):
+        self.jobs = data.get("jobs", {})
+
+    def dump_state(self):
+        return {"jobs": self.jobs}
+
+    def add(self, src, dst, move):
+        job_id = f"{src}|{dst}"
+        with self.lock:
+            self.jobs[job_id] = {'src': src, 'dst': dst, 'move': move}
+        self.save()
+        return job_id
+
+    def remove(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        self.save()
+
+    def pending(self):
+        with self.lock:
+            return [dict(job) for job in self.jobs.values()]
+
+class PrefixMover:
+    # Копирование или перемещение папки на сервере. Объекты копируются
+    # параллельно по мере листинга; при перемещении скопированные источники
+    # удаляются пакетами DeleteObjects. Задание возобновляемо без отдельного
+    # журнала объектов: повторный запуск заново листит источник (перенесенные
+    # объекты из него уже удалены) и пропускает объекты, уже лежащие в
+    # приемнике с тем же размером - приемник перед первым запуском пуст.
+    def __init__(self, s3, bucket, src, dst, move=True, indexes=None, workers=COPY_WORKERS, gate=NO_GATE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.src = src
+        self.dst = dst
+        self.move = move
+        self.indexes = indexes
+        self.workers = max(1, workers)
+        self.gate = gate
+        self.copier = ObjectCopier(s3, bucket)
+        self.lock = threading.Lock()
+
+    def list_objects(self, prefix):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in gated_pages(paginator.paginate(Bucket=self.bucket, Prefix=prefix), self.gate):
+            for obj in page.get('Contents', []):
+                yield {'key': obj['Key'], 'size': obj['Size'], 'etag': obj.get('ETag', '').strip('"')}
+
+    def run(self, on_progress=None):
+        # -> {'copied', 'skipped', 'failed': [(key, error)]}; on_progress(done_bytes, total_bytes)
+        progress = TransferProgress(on_progress)
+        result = {'copied': 0, 'skipped': 0, 'failed': []}
+        existing = {obj['key'][len(self.dst):]: obj['size'] for obj in self.list_objects(self.dst)}
+        deleter = PrefixDeleter(self.s3, self.bucket, gate=self.gate)
+        doomed = []
+        slots = threading.Semaphore(self.workers * 2)
+
+        def remove_sources(batch):
+            failed = dict(deleter.delete_batch([{'Key': obj['key']} for obj in batch]))
+            for obj in batch:
+                if obj['key'] in failed:
+                    with self.lock: result['failed'].append((obj['key'], failed[obj['key']]))
+                elif self.indexes:
+                    self.indexes.object_removed(obj['key'], obj['size'])
+
+        def run_one(obj):
+            try:
+                rel = obj['key'][len(self.src):]
+                if existing.get(rel) == obj['size']:
+                    status = 'skipped'
+                else:
+                    # Копия целиком на сервере - один слот планировщика на объект; пакеты удаления
+                    # источников берут свои слоты через тот же gate (PrefixDeleter)
+                    with self.gate.request():
+                        etag = self.copier.copy(obj['key'], self.dst + rel, obj['size'], obj['etag'])
+                    if self.indexes: self.indexes.object_added(self.dst + rel, obj['size'], etag)
+                    status = 'copied'
+                progress.add(obj['key'], obj['size'])
+                with self.lock:
+                    result[status] += 1
+                    if self.move: doomed.append(obj)
+                    batch = doomed[:] if len(doomed) >= DELETE_BATCH else None
+                    if batch: del doomed[:]
+                if batch: remove_sources(batch)
+            except JobCancelled:
+                # Отмена - не ошибка объекта; само задание останавливает gate.check() после пула
+                raise
+            except Exception as e:
+                with self.lock: result['failed'].append((obj['key'], e))
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for obj in self.list_objects(self.src):
+                progress.expect(obj['key'], obj['size'])
+                slots.acquire()
+                pool.submit(run_one, obj)
+        self.gate.check()
+        if doomed: remove_sources(doomed)
+        if self.move and not result['failed'] and self.indexes:
+            self.indexes.prefix_removed(self.src)
+        return result
+
+def file_md5(path, chunk=DOWNLOAD_CHUNK):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def multipart_etag(path, part_size, chunk=DOWNLOAD_CHUNK):
+    # ETag объекта, загруженного частями по part_size: MD5 от склеенных MD5 частей
+    digests = []
+    with open(path, 'rb') as f:
+        while True:
+            digest, left = hashlib.md5(), part_size
+            while left:
+                block = f.read(min(chunk, left))
+                if not block: break
+                digest.update(block)
+                left -= len(block)
+            if left == part_size: break
+            digests.append(digest.digest())
+    return f"{hashlib.md5(b''.join(digests)).hexdigest()}-{len(digests)}"
+
+def file_digests(path, part_sizes=(), chunk=DOWNLOAD_CHUNK, on_read=None):
+    # За один проход по файлу: MD5 целиком ('md5') и ETag multipart для
+    # каждого размера части из part_sizes; файл читается блоками по chunk
+    whole = hashlib.md5()
+    parts = {size: {'digest': hashlib.md5(), 'left': size, 'done': []} for size in part_sizes}
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            whole.update(block)
+            for size, state in parts.items():
+                view = memoryview(block)
+                while view:
+                    take = min(len(view), state['left'])
+                    state['digest'].update(view[:take])
+                    state['left'] -= take
+                    view = view[take:]
+                    if not state['left']:
+                        state['done'].append(state['digest'].digest())
+                        state['digest'], state['left'] = hashlib.md5(), size
+            if on_read: on_read(len(block))
+    result = {'md5': whole.hexdigest()}
+    for size, state in parts.items():
+        if state['left'] != size: state['done'].append(state['digest'].digest())
+        result[size] = f"{hashlib.md5(b''.join(state['done'])).hexdigest()}-{len(state['done'])}"
+    return result
+
+class BulkDownloader:
+    # Скачивание папки или набора файлов в локальный каталог пулом потоков.
+    # Большие объекты качаются параллельными Range-запросами в файл .part,
+    # готовые диапазоны пишутся в .part.json - после обрыва докачивается
+    # только недостающее. Совпадающие локальные файлы пропускаются.
+    def __init__(self, s3, bucket, workers=DOWNLOAD_WORKERS, part_size=DOWNLOAD_PART_SIZE, part_workers=DOWNLOAD_PART_WORKERS, gate=NO_GATE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.workers = max(1, workers)
+        self.part_size = part_size
+        self.part_workers = max(1, part_workers)
+        self.gate = gate
+        self.lock = threading.Lock()
+
+    def iter_objects(self, folders=(), files=()):
+        # -> {'key', 'size', 'etag', 'modified', 'name'}; name - путь относительно родителя
+        for entry in files:
+            yield dict(entry, name=entry['key'][len(parent_prefix(entry['key'])):])
+        for folder in folders:
+            base = parent_prefix(folder)
+            paginator = self.s3.get_paginator('list_objects_v2')
+            for page in gated_pages(paginator.paginate(Bucket=self.bucket, Prefix=folder), self.gate):
+                for obj in page.get('Contents', []):
+                    modified = obj.get('LastModified')
+                    yield {
+                        'key': obj['Key'], 'size': obj['Size'], 'etag': obj.get('ETag', '').strip('"'),
+                        'modified': modified.timestamp() if modified else 0, 'name': obj['Key'][len(base):],
+                    }
+
+    def download(self, objects, dest_dir, on_file_done=None, on_progress=None):
+        # -> {'downloaded': n, 'skipped': n, 'failed': [(key, error)]}
+        progress = TransferProgress(on_progress, self.meter)
+        result = {'downloaded': 0, 'skipped': 0, 'failed': []}
+        slots = threading.Semaphore(self.workers * 2)
+
+        def run(obj):
+            try:
+                status = self.download_one(obj, dest_dir, progress)
+                with self.lock: result[status] += 1
+                if on_file_done: on_file_done(obj['key'], None)
+            except Exception as e:
+                with self.lock: result['failed'].append((obj['key'], e))
+                if on_file_done: on_file_done(obj['key'], e)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for obj in objects:
+                progress.expect(obj['key'], obj['size'])
+                slots.acquire()
+                pool.submit(run, obj)
+        return result
+
+    def meter(self, n):
+        self.gate.transferred("download", n)
+
+    def local_path(self, dest_dir, name):
+        path = os.path.normpath(os.path.join(dest_dir, *name.split('/')))
+        if os.path.commonpath([os.path.abspath(path), os.path.abspath(dest_dir)]) != os.path.abspath(dest_dir):
+            raise ValueError(f"Недопустимое имя: {name}")
+        return path
+
+    def is_identical(self, path, obj):
+        if not os.path.isfile(path) or os.path.getsize(path) != obj['size']: return False
+        if obj['modified'] and int(os.path.getmtime(path)) == int(obj['modified']): return True
+        # Простой ETag (не multipart) - это MD5 содержимого
+        etag = obj['etag']
+        if etag and '-' not in etag and file_md5(path) == etag:
+            if obj['modified']: os.utime(path, (obj['modified'], obj['modified']))
+            return True
+        return False
+
+    def download_one(self, obj, dest_dir, progress):
+        path = self.local_path(dest_dir, obj['name'])
+        if obj['key'].endswith('/'):
+            os.makedirs(path, exist_ok=True)
+            return 'skipped'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.is_identical(path, obj):
+            progress.add(obj['key'], obj['size'])
+            return 'skipped'
+
+        size, etag = obj['size'], obj['etag']
+        tmp, state_path = path + ".part", path + ".part.json"
+        done = set()
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if state['etag'] == etag and state['size'] == size and os.path.getsize(tmp) == size:
+                done = set(state['done'])
+        except Exception:
+            pass
+        if not done:
+            with open(tmp, 'wb') as f:
+                f.truncate(size)
+
+        count = max(1, -(-size // self.part_size))
+        for n in done:
+            progress.add(obj['key'], min(self.part_size, size - n * self.part_size))
+
+        def save_state():
+            write_json_atomic(state_path, {'etag': etag, 'size': size, 'done': sorted(done)})
+
+        def fetch_part(n):
+            start = n * self.part_size
+            end = min(start + self.part_size, size) - 1
+            kwargs = {'Bucket': self.bucket, 'Key': obj['key']}
+            if etag: kwargs['IfMatch'] = '"' + etag + '"'
+            if count > 1: kwargs['Range'] = f"bytes={start}-{end}"
+            with self.gate.request(), open(tmp, 'r+b') as f:
+                body = self.s3.get_object(**kwargs)['Body']
+                f.seek(start)
+                for chunk in body.iter_chunks(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    progress.add(obj['key'], len(chunk))
+            with self.lock:
+                done.add(n)
+                save_state()
+
+        todo = [n for n in range(count) if n not in done]
+        if size == 0:
+            pass
+        elif len(todo) == 1:
+            fetch_part(todo[0])
+        else:
+            with ThreadPoolExecutor(max_workers=self.part_workers) as pool:
+                for future in [pool.submit(fetch_part, n) for n in todo]:
+                    future.result()
+
+        if os.path.getsize(tmp) != size:
+            raise IOError(f"Размер не совпал: {obj['key']}")
+        if etag and '-' not in etag and file_md5(tmp) != etag:
+            os.remove(state_path)
+            raise IOError(f"ETag не совпал: {obj['key']}")
+        os.replace(tmp, path)
+        if os.path.exists(state_path): os.remove(state_path)
+        if obj['modified']: os.utime(path, (obj['modified'], obj['modified']))
+        return 'downloaded'
+
+    def download_zip(self, objects, zip_path, on_progress=None):
+        # Потоковая запись в один архив: объекты идут по одному, в памяти - только буфер чтения
+        progress = TransferProgress(on_progress, self.meter)
+        count = 0
+        with zipfile.ZipFile(zip_path + ".part", 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for obj in objects:
+                if obj['key'].endswith('/'): continue
+                progress.expect(obj['key'], obj['size'])
+                info = zipfile.ZipInfo(obj['name'], date_time=time.localtime(obj['modified'] or time.time())[:6])
+                with self.gate.request(), zf.open(info, 'w', force_zip64=True) as dst:
+                    body = self.s3.get_object(Bucket=self.bucket, Key=obj['key'])['Body']
+                    for chunk in body.iter_chunks(DOWNLOAD_CHUNK):
+                        dst.write(chunk)
+                        progress.add(obj['key'], len(chunk))
+                count += 1
+        os.replace(zip_path + ".part", zip_path)
+        return count
+
+class ThumbnailCache:
+    # Дисковый LRU-кэш миниатюр: ключ - (хранилище, ключ объекта, ETag),
+    # поэтому измененный объект получает новую миниатюру. Время доступа -
+    # mtime файла, при превышении лимита удаляются самые старые.
+    def __init__(self, directory, max_bytes=THUMB_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total = sum(e.stat().st_size for e in os.scandir(directory) if e.is_file())
+
+    def path(self, scope, key, etag):
+        digest = hashlib.sha1("|".join([str(scope), key, etag]).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + ".jpg")
+
+    def get(self, scope, key, etag):
+        path = self.path(scope, key, etag)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def put(self, scope, key, etag, data):
+        path = self.path(scope, key, etag)
+        with open(path + ".tmp", 'wb') as f:
+            f.write(data)
+        with self.lock:
+            # Перезапись той же миниатюры (два запроса одновременно) - в итог только разница
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(path + ".tmp", path)
+            self.total += len(data) - replaced
+            if self.total > self.max_bytes: self.evict()
+
+    def evict(self):
+        entries = sorted((e for e in os.scandir(self.directory) if e.is_file()), key=lambda e: e.stat().st_mtime)
+        total = sum(e.stat().st_size for e in entries)
+        for entry in entries:
+            if total <= self.max_bytes * 0.8: break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
+        self.total = total
+
+class ThumbnailLoader:
+    # Загрузка миниатюр только для видимых плиток: запросы вне видимой
+    # области отбрасываются, новые обслуживаются раньше старых. Скачивание
+    # ограничено THUMB_WORKERS потоками, уменьшение - в пуле процессов.
+    def __init__(self, cache, workers=THUMB_WORKERS, use_processes=True):
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.wanted = OrderedDict()
+        self.visible = set()
+        self.inflight = set()
+        self.slots = threading.Semaphore(workers)
+        self.fetch_pool = ThreadPoolExecutor(max_workers=workers)
+        self.decode_pool = None
+        if use_processes:
+            try:
+                self.decode_pool = ProcessPoolExecutor(max_workers=max(1, min(4, (os.cpu_count() or 2) - 1)))
+            except Exception:
+                pass
+        if not self.decode_pool: self.decode_pool = ThreadPoolExecutor(max_workers=2)
+
+    def set_visible(self, keys):
+        with self.lock:
+            self.visible = set(keys)
+            for key in [k for k in self.wanted if k not in self.visible]:
+                del self.wanted[key]
+
+    def request(self, s3, bucket, scope, entry, callback):
+        # callback(key, jpeg_bytes) вызывается из фонового потока
+        key = entry['key']
+        with self.lock:
+            if key in self.inflight or key in self.wanted: return
+            self.wanted[key] = (s3, bucket, scope, entry, callback)
+        self.pump()
+
+    def pump(self):
+        while self.slots.acquire(blocking=False):
+            with self.lock:
+                if not self.wanted:
+                    self.slots.release()
+                    return
+                key, job = self.wanted.popitem(last=True)
+                self.inflight.add(key)
+            self.fetch_pool.submit(self.load, *job)
+
+    def load(self, s3, bucket, scope, entry, callback):
+        key, etag = entry['key'], entry.get('etag', '')
+        try:
+            data = self.cache.get(scope, key, etag)
+            if data is None and entry['size'] <= THUMB_MAX_SOURCE:
+                # Исходник - потоком во временный файл, в памяти только буфер чтения
+                fd, source = tempfile.mkstemp(prefix="s3thumb_")
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        for chunk in s3.get_object(Bucket=bucket, Key=key)['Body'].iter_chunks(DOWNLOAD_CHUNK):
+                            f.write(chunk)
+                    data = self.decode_pool.submit(make_thumbnail, source).result()
+                finally:
+                    os.remove(source)
+                self.cache.put(scope, key, etag, data)
+            if data: callback(key, data)
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.inflight.discard(key)
+            self.slots.release()
+            self.pump()
+
+class TransferProgress:
+    # Байтовый прогресс по файлам и суммарно для одной пачки передач:
+    # callback(done, total) - суммарно, on_file(key, done, size) - по файлу;
+    # meter(n) - учет байтов в ограничении скорости
+    def __init__(self, callback=None, meter=None, on_file=None):
+        self.callback = callback
+        self.meter = meter
+        self.on_file = on_file
+        self.lock = threading.Lock()
+        self.files = {}
+        self.done = 0
+        self.total = 0
+
+    def expect(self, key, size):
+        with self.lock:
+            self.files[key] = [0, size]
+            self.total += size
+
+    def add(self, key, n):
+        with self.lock:
+            entry = self.files.setdefault(key, [0, 0])
+            entry[0] += n
+            self.done += n
+            done, total = self.done, self.total
+            file_done, file_size = entry
+        if self.on_file: self.on_file(key, file_done, file_size)
+        if self.callback: self.callback(done, total)
+        if self.meter: self.meter(n)
+
+class UploadEngine:
+    # Параллельная загрузка файлов: несколько файлов одновременно, большие -
+    # через multipart с параллельными частями. UploadId и готовые части
+    # пишутся в локальный журнал, прерванная загрузка продолжается через
+    # ListParts вместо повторной отправки уже загруженных частей.
+    def __init__(self, s3, bucket, journal_path, part_size_mb=UPLOAD_PART_SIZE_MB,
+                 file_workers=UPLOAD_FILE_WORKERS, part_workers=UPLOAD_PART_WORKERS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.journal_path = journal_path
+        self.lock = threading.Lock()
+        self.configure(part_size_mb, file_workers, part_workers)
+        FileSlice.attach(s3)
+        try:
+            with open(journal_path, encoding='utf-8') as f:
+                self.journal = json.load(f)
+        except Exception:
+            self.journal = {}
+
+    def configure(self, part_size_mb, file_workers, part_workers):
+        self.part_size = max(MIN_PART_SIZE, int(part_size_mb * 1024 * 1024))
+        self.file_workers = max(1, file_workers)
+        self.part_workers = max(1, part_workers)
+
+    def pending(self):
+        # Незавершенные multipart-загрузки этого бакета, файлы которых еще на месте
+        with self.lock:
+            entries = [dict(v) for v in self.journal.values() if v['bucket'] == self.bucket]
+        return [(v['path'], v['key']) for v in entries if os.path.exists(v['path'])]
+
+    def upload(self, files, on_file_done=None, on_progress=None, gate=NO_GATE, on_file_progress=None):
+        # files: [(local_path, key)]; on_file_done(key, size, error, etag); on_progress(done_bytes, total_bytes);
+        # on_file_progress(key, done_bytes, size) - по каждому файлу
+        # Ограничение скорости учитывает байты по мере отправки (FileSlice), а не после части
+        progress = TransferProgress(on_progress, on_file=on_file_progress)
+        for path, key in files:
+            if os.path.exists(path): progress.expect(key, os.path.getsize(path))
+        results = {}
+
+        def run(path, key):
+            try:
+                gate.check()
+                size, etag = self.upload_one(path, key, progress, gate)
+                results[key] = None
+                if on_file_done: on_file_done(key, size, None, etag)
+            except Exception as e:
+                results[key] = e
+                if on_file_done: on_file_done(key, 0, e, '')
+
+        with ThreadPoolExecutor(max_workers=self.file_workers) as pool:
+            for path, key in files:
+                pool.submit(run, path, key)
+        return results
+
+    def upload_one(self, path, key, progress, gate=NO_GATE):
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            body = FileSlice(path, 0, size, lambda n: gate.transferred("upload", n))
+            try:
+                with gate.request():
+                    response = self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+            finally:
+                body.close()
+            progress.add(key, size)
+            return size, response.get('ETag', '').strip('"')
+        return size, self.upload_multipart(path, key, size, progress, gate)
+
+    def upload_multipart(self, path, key, size, progress, gate=NO_GATE):
+        mtime = os.path.getmtime(path)
+        part_size = max(self.part_size, -(-size // MAX_PARTS))
+        job_id = f"{self.bucket}|{key}|{path}"
+        parts = self.resume_parts(job_id, size, mtime, part_size)
+        if parts is None:
+            upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+            parts = {}
+            with self.lock:
+                self.journal[job_id] = {
+                    'bucket': self.bucket, 'key': key, 'path': path, 'size': size, 'mtime': mtime,
+                    'part_size': part_size, 'upload_id': upload_id, 'parts': {},
+                }
+            self.save_journal()
+        upload_id = self.journal[job_id]['upload_id']
+
+        count = -(-size // part_size)
+        for number in parts:
+            progress.add(key, min(part_size, size - (int(number) - 1) * part_size))
+
+        def send_part(number):
+            offset = (number - 1) * part_size
+            length = min(part_size, size - offset)
+            body = FileSlice(path, offset, length, lambda n: gate.transferred("upload", n))
+            try:
+                with gate.request():
+                    response = self.s3.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=body)
+            finally:
+                body.close()
+            with self.lock:
+                self.journal[job_id]['parts'][str(number)] = response['ETag']
+            self.save_journal()
+            progress.add(key, length)
+
+        todo = [n for n in range(1, count + 1) if str(n) not in parts]
+        with ThreadPoolExecutor(max_workers=self.part_workers) as pool:
+            for future in [pool.submit(send_part, n) for n in todo]:
+                future.result()
+
+        with self.lock:
+            done = self.journal[job_id]['parts']
+            manifest = [{'PartNumber': int(n), 'ETag': done[n]} for n in sorted(done, key=int)]
+        response = self.s3.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': manifest})
+        with self.lock:
+            self.journal.pop(job_id, None)
+        self.save_journal()
+        return response.get('ETag', '').strip('"')
+
+    def resume_parts(self, job_id, size, mtime, part_size):
+        # Готовые части по данным сервера; None - начинать заново
+        with self.lock:
+            entry = self.journal.get(job_id)
+        if not entry: return None
+        if entry['size'] != size or entry['mtime'] != mtime or entry['part_size'] != part_size:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=entry['key'], UploadId=entry['upload_id'])
+            except Exception:
+                pass
+            with self.lock:
+                self.journal.pop(job_id, None)
+            return None
+        try:
+            parts = {}
+            kwargs = {'Bucket': self.bucket, 'Key': entry['key'], 'UploadId': entry['upload_id']}
+            while True:
+                response = self.s3.list_parts(**kwargs)
+                for part in response.get('Parts', []):
+                    expected = min(part_size, size - (part['PartNumber'] - 1) * part_size)
+                    if part['Size'] == expected: parts[str(part['PartNumber'])] = part['ETag']
+                if not response.get('IsTruncated'): break
+                kwargs['PartNumberMarker'] = response['NextPartNumberMarker']
+        except Exception:
+            with self.lock:
+                self.journal.pop(job_id, None)
+            return None
+        with self.lock:
+            entry['parts'] = parts
+        self.save_journal()
+        return parts
+
+    def save_journal(self):
+        with self.lock:
+            try:
+                write_json_atomic(self.journal_path, self.journal)
+            except Exception:
+                pass
+
+class HashCache(PersistentState):
+    # Хэши локальных файлов: путь -> {'size', 'mtime', 'md5', 'etags': {размер части: ETag},
+    # 'remote': [ETag объектов, загруженных из этой версии файла], 'used'}.
+    # Запись действительна, пока у файла те же размер и mtime.
+    def load_state(self, data):
+        self.files = data.get("files", {})
+
+    def dump_state(self):
+        return {"files": self.files}
+
+    def get(self, path, size, mtime):
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if not entry or (entry['size'], entry['mtime']) != (size, mtime): return None
+            entry['used'] = time.time()
+            return {'md5': entry.get('md5'), 'etags': dict(entry['etags']), 'remote': list(entry['remote'])}
+
+    def put(self, path, size, mtime, digests=None, remote_etag=None):
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.files.get(path)
+            if not entry or (entry['size'], entry['mtime']) != (size, mtime):
+                entry = self.files[path] = {'size': size, 'mtime': mtime, 'md5': None, 'etags': {}, 'remote': []}
+            for name, value in (digests or {}).items():
+                if name == 'md5': entry['md5'] = value
+                else: entry['etags'][str(name)] = value
+            if remote_etag and remote_etag not in entry['remote']: entry['remote'].append(remote_etag)
+            entry['used'] = time.time()
+            if len(self.files) > HASH_CACHE_ENTRIES:
+                for old in sorted(self.files, key=lambda p: self.files[p]['used'])[:len(self.files) - HASH_CACHE_ENTRIES]:
+                    del self.files[old]
+        self.schedule_save()
+
+class UploadDeduplicator:
+    # Проверка перед загрузкой: какие файлы уже лежат в облаке с тем же
+    # содержимым. Размер и ETag объектов - одним проходом (LIST папки, если
+    # ключей в ней много, иначе параллельные HEAD). Хэшируются только файлы
+    # того же размера, параллельно и потоково; ETag multipart сравнивается
+    # с хэшем частей тех размеров, что дают такое же число частей.
+    def __init__(self, s3, bucket, hash_cache, part_size, workers=DEDUP_WORKERS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.cache = hash_cache
+        self.part_size = part_size
+        self.workers = max(1, workers)
+
+    def remote_objects(self, keys):
+        # -> {key: (размер, ETag)} для существующих объектов
+        by_prefix = {}
+        for key in keys: by_prefix.setdefault(parent_prefix(key), set()).add(key)
+        found, heads = {}, []
+        for prefix, wanted in by_prefix.items():
+            if len(wanted) <= DEDUP_HEAD_MAX:
+                heads.extend(wanted)
+                continue
+            paginator = self.s3.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+                for obj in page.get('Contents', []):
+                    if obj['Key'] in wanted: found[obj['Key']] = (obj['Size'], obj.get('ETag', '').strip('"'))
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for key, head in zip(heads, pool.map(lambda k: object_head(self.s3, self.bucket, k), heads)):
+                if head: found[key] = head
+        return found
+
+    def part_sizes(self, size, count):
+        # Размеры частей, при которых файл режется ровно на count частей
+        mb = 1024 * 1024
+        guesses = [max(self.part_size, -(-size // MAX_PARTS))] + [n * mb for n in DEDUP_PART_SIZES_MB]
+        guesses.append(-(-size // count // mb) * mb)
+        sizes = []
+        for part in guesses:
+            if part > 0 and -(-size // part) == count and part not in sizes: sizes.append(part)
+        return sizes
+
+    def matches(self, path, etag, on_read):
+        # -> (совпадает, взято из кэша)
+        stat = os.stat(path)
+        size, mtime = stat.st_size, stat.st_mtime
+        cached = self.cache.get(path, size, mtime)
+        if cached and etag in cached['remote']: return True, True
+        sizes = []
+        if '-' in etag:
+            try:
+                sizes = self.part_sizes(size, int(etag.rsplit('-', 1)[1]))
+            except ValueError:
+                return False, False
+            if not sizes: return False, False
+            if cached and all(str(part) in cached['etags'] for part in sizes):
+                return etag in [cached['etags'][str(part)] for part in sizes], True
+        elif cached and cached['md5']:
+            return cached['md5'] == etag, True
+        digests = file_digests(path, sizes, on_read=on_read)
+        self.cache.put(path, size, mtime, digests)
+        return etag in digests.values(), False
+
+    def plan(self, files, on_progress=None):
+        # files: [(local_path, key)] -> {'upload': [...], 'skip': [...], 'upload_bytes', 'skip_bytes', 'hashed', 'cached'}
+        remote = self.remote_objects([key for _, key in files])
+        plan = {'upload': [], 'skip': [], 'upload_bytes': 0, 'skip_bytes': 0, 'hashed': 0, 'cached': 0}
+        candidates = []
+        for path, key in files:
+            size = os.path.getsize(path)
+            if key in remote and remote[key][0] == size: candidates.append((path, key, size, remote[key][1]))
+            else:
+                plan['upload'].append((path, key))
+                plan['upload_bytes'] += size
+        progress = {'done': 0, 'total': sum(c[2] for c in candidates)}
+        lock = threading.Lock()
+
+        def on_read(n):
+            with lock:
+                progress['done'] += n
+                done = progress['done']
+            if on_progress: on_progress(done, progress['total'])
+
+        def check(candidate):
+            path, _, size, etag = candidate
+            same, cached = self.matches(path, etag, on_read)
+            if cached: on_read(size)
+            return same, cached
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for (path, key, size, _), (same, cached) in zip(candidates, pool.map(check, candidates)):
+                plan['skip' if same else 'upload'].append((path, key))
+                plan['skip_bytes' if same else 'upload_bytes'] += size
+                plan['cached' if cached else 'hashed'] += 1
+        return plan
+
+class SyncJournal(PersistentState):
+    # Состояние каждого пути после прошлой синхронизации:
+    # rel -> {'size', 'mtime'} локального файла и {'rsize', 'etag'} объекта
+    def load_state(self, data):
+        self.entries = data.get("entries", {})
+
+    def dump_state(self):
+        return {"entries": self.entries}
+
+    def get(self, rel):
+        with self.lock:
+            return self.entries.get(rel)
+
+    def all(self):
+        with self.lock:
+            return list(self.entries)
+
+    def record(self, rel, local, remote):
+        with self.lock:
+            self.entries[rel] = {'size': local['size'], 'mtime': local['mtime'], 'rsize': remote['size'], 'etag': remote['etag']}
+        self.schedule_save()
+
+    def forget(self, rel):
+        with self.lock:
+            self.entries.pop(rel, None)
+        self.schedule_save()
+
+class SyncEngine:
+    # Синхронизация локального каталога с префиксом бакета. По журналу видно,
+    # какая сторона изменилась с прошлого прогона: файл - по размеру и mtime,
+    # объект - по размеру и ETag, без хеширования и скачивания. Содержимое
+    # хешируется, только когда изменившиеся стороны совпадают по размеру
+    # (например, первый прогон). plan() ничего не меняет и служит
+    # предпросмотром, run() выполняет план: загрузки и скачивания идут
+    # параллельно через UploadEngine и BulkDownloader. В режиме "both"
+    # изменения с обеих сторон - конфликт, побеждает более новая версия;
+    # проигравшая перед перезаписью сохраняется рядом (conflict_name) и при
+    # следующем прогоне попадает на другую сторону как обычный новый файл.
+    MODES = ("both", "upload", "download")
+    TEMP_SUFFIXES = (".part", ".part.json")
+
+    def __init__(self, s3, bucket, prefix, local_dir, journal_path, upload_engine, indexes=None, mode="both", deletes=False):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.local_dir = local_dir
+        self.journal = SyncJournal(journal_path)
+        self.upload_engine = upload_engine
+        self.downloader = BulkDownloader(s3, bucket)
+        self.indexes = indexes
+        self.mode = mode
+        self.deletes = deletes
+        self.lock = threading.Lock()
+
+    def scan_local(self):
+        files, stack = {}, [self.local_dir]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file() and not entry.name.endswith(self.TEMP_SUFFIXES):
+                        st = entry.stat()
+                        rel = os.path.relpath(entry.path, self.local_dir).replace(os.sep, '/')
+                        files[rel] = {'size': st.st_size, 'mtime': st.st_mtime}
+        return files
+
+    def scan_remote(self):
+        objects = {}
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                key = obj['Key']
+                if key.endswith('/') or is_hidden_key(key): continue
+                modified = obj.get('LastModified')
+                objects[key[len(self.prefix):]] = {
+                    'key': key, 'size': obj['Size'], 'etag': obj.get('ETag', '').strip('"'),
+                    'modified': modified.timestamp() if modified else 0,
+                }
+        return objects
+
+    def local_path(self, rel):
+        return self.downloader.local_path(self.local_dir, rel)
+
+    def same_content(self, rel, local, remote):
+        if local['size'] != remote['size']: return False
+        etag = remote['etag']
+        if '-' not in etag: return file_md5(self.local_path(rel)) == etag
+        # Multipart: сравнимо, только если объект резали на части так же, как режет UploadEngine
+        part_size = max(self.upload_engine.part_size, -(-local['size'] // MAX_PARTS))
+        if etag.split('-')[-1] != str(-(-local['size'] // part_size)): return False
+        return multipart_etag(self.local_path(rel), part_size) == etag
+
+    @staticmethod
+    def conflict_name(rel, mtime):
+        # "docs/a.txt" -> "docs/a (конфликт 2024-05-01 120000).txt"
+        folder, _, name = rel.rpartition('/')
+        stem, ext = os.path.splitext(name)
+        stamp = time.strftime('%Y-%m-%d %H%M%S', time.localtime(mtime))
+        return (folder + '/' if folder else '') + f"{stem} (конфликт {stamp}){ext}"
+
+    def keep_conflict_copy(self, a, gate=NO_GATE):
+        # Проигравшая сторона: объект копируется на сервере, локальный файл переименовывается
+        if a['action'] == 'upload':
+            remote = a['remote']
+            dst = self.prefix + self.conflict_name(a['rel'], remote['modified'])
+            with gate.request():
+                etag = ObjectCopier(self.s3, self.bucket).copy(remote['key'], dst, remote['size'], remote['etag'])
+            if self.indexes: self.indexes.object_added(dst, remote['size'], etag)
+        else:
+            os.replace(self.local_path(a['rel']), self.local_path(self.conflict_name(a['rel'], a['local']['mtime'])))
+
+    def decide(self, rel, local, remote, known):
+        # -> (действие или None, конфликт)
+        local_changed = local is not None and (known is None or (local['size'], local['mtime']) != (known['size'], known['mtime']))
+        remote_changed = remote is not None and (known is None or (remote['size'], remote['etag']) != (known['rsize'], known['etag']))
+        if local is None and remote is None: return ('forget' if known else None), False
+        if local is not None and remote is not None:
+            if not local_changed and not remote_changed: return None, False
+            if self.same_content(rel, local, remote): return 'record', False
+        if self.mode == "upload":
+            if local is None: return ('delete_remote' if self.deletes else None), False
+            return 'upload', False
+        if self.mode == "download":
+            if remote is None: return ('delete_local' if self.deletes else None), False
+            return 'download', False
+        if remote is None:
+            if known and not local_changed: return ('delete_local' if self.deletes else None), False
+            return 'upload', False
+        if local is None:
+            if known and not remote_changed: return ('delete_remote' if self.deletes else None), False
+            return 'download', False
+        if local_changed and remote_changed:
+            return ('upload' if local['mtime'] >= remote['modified'] else 'download'), True
+        return ('upload' if local_changed else 'download'), False
+
+    def plan(self):
+        # -> [{'action', 'rel', 'local', 'remote', 'conflict'}]
+        local, remote = self.scan_local(), self.scan_remote()
+        actions = []
+        for rel in sorted(set(local) | set(remote) | set(self.journal.all())):
+            action, conflict = self.decide(rel, local.get(rel), remote.get(rel), self.journal.get(rel))
+            if action:
+                actions.append({'action': action, 'rel': rel, 'local': local.get(rel), 'remote': remote.get(rel), 'conflict': conflict})
+        return actions
+
+    @staticmethod
+    def summary(actions):
+        # -> {действие: (файлов, байт)}
+        totals = {}
+        for a in actions:
+            side = a['local'] if a['action'] in ('upload', 'delete_local') else a['remote']
+            count, size = totals.get(a['action'], (0, 0))
+            totals[a['action']] = (count + 1, size + (side['size'] if side else 0))
+        return totals
+
+    def run(self, actions, on_progress=None, gate=NO_GATE):
+        # -> {'uploaded', 'downloaded', 'deleted', 'conflicts', 'failed': [(rel, error)]}
+        result = {'uploaded': 0, 'downloaded': 0, 'deleted': 0, 'conflicts': 0, 'failed': []}
+        by_action = {}
+        for a in actions: by_action.setdefault(a['action'], []).append(a)
+        by_key = {self.prefix + a['rel']: a for a in by_action.get('upload', []) + by_action.get('download', [])}
+        transfers = {}
+
+        def done(counter, a=None, error=None):
+            with self.lock:
+                if error: result['failed'].append((a['rel'], error))
+                else: result[counter] += 1
+
+        def progress(name):
+            def update(sent, total):
+                with self.lock:
+                    transfers[name] = (sent, total)
+                    sent, total = map(sum, zip(*transfers.values()))
+                if on_progress: on_progress(sent, total)
+            return update
+
+        def uploaded(key, size, error, etag):
+            a = by_key[key]
+            if not error:
+                self.journal.record(a['rel'], a['local'], {'size': size, 'etag': etag})
+                if self.indexes: self.indexes.object_added(key, size, etag)
+            done('uploaded', a, error)
+
+        def downloaded(key, error):
+            a = by_key[key]
+            if not error:
+                st = os.stat(self.local_path(a['rel']))
+                self.journal.record(a['rel'], {'size': st.st_size, 'mtime': st.st_mtime}, a['remote'])
+            done('downloaded', a, error)
+
+        # Без сохраненной проигравшей версии конфликт не перезаписывается
+        for a in [a for a in by_key.values() if a['conflict']]:
+            try:
+                self.keep_conflict_copy(a, gate)
+                done('conflicts')
+            except JobCancelled:
+                raise
+            except Exception as e:
+                by_action[a['action']].remove(a)
+                done('conflicts', a, e)
+
+        uploads = [(self.local_path(a['rel']), self.prefix + a['rel']) for a in by_action.get('upload', [])]
+        downloads = [dict(a['remote'], name=a['rel']) for a in by_action.get('download', [])]
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            jobs = []
+            if uploads: jobs.append(pool.submit(self.upload_engine.upload, uploads, uploaded, progress('upload'), gate))
+            if downloads:
+                downloader = BulkDownloader(self.s3, self.bucket, gate=gate)
+                jobs.append(pool.submit(downloader.download, downloads, self.local_dir, downloaded, progress('download')))
+            for job in jobs: job.result()
+
+        removals = by_action.get('delete_remote', [])
+        deleter = PrefixDeleter(self.s3, self.bucket, gate=gate)
+        for start in range(0, len(removals), DELETE_BATCH):
+            batch = removals[start:start + DELETE_BATCH]
+            failed = dict(deleter.delete_batch([{'Key': a['remote']['key']} for a in batch]))
+            for a in batch:
+                key = a['remote']['key']
+                if key in failed:
+                    done('deleted', a, failed[key])
+                    continue
+                self.journal.forget(a['rel'])
+                if self.indexes: self.indexes.object_removed(key, a['remote']['size'])
+                done('deleted')
+
+        for a in by_action.get('delete_local', []):
+            try:
+                os.remove(self.local_path(a['rel']))
+                self.journal.forget(a['rel'])
+                done('deleted')
+            except OSError as e:
+                done('deleted', a, e)
+
+        for a in by_action.get('record', []):
+            self.journal.record(a['rel'], a['local'], a['remote'])
+        for a in by_action.get('forget', []):
+            self.journal.forget(a['rel'])
+        self.journal.save()
+        return result
+
+class CloudStorage:
+    # Одно хранилище (endpoint + бакет): клиент, локальные индексы и все
+    # операции над ними. Операции сами поддерживают индексы в актуальном
+    # состоянии, вызывающему коду остается только показать результат.
+    def __init__(self, s3, endpoint, bucket, listing_cache=None):
+        self.s3 = s3
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.indexes = BucketIndexes(endpoint, bucket, listing_cache or ListingCache())
+        self.uploads = UploadEngine(s3, bucket, local_state_path("uploads", endpoint, bucket))
+        self.moves = MoveJournal(local_state_path("moves", endpoint, bucket))
+        self.history = NavigationHistory(local_state_path("navigation", endpoint, bucket))
+        self.hashes = HashCache(local_state_path("hashes"))
+        self.folder_meta = FolderMetadataStore(s3, bucket)
+
+    @classmethod
+    def connect(cls, ak, sk, endpoint, bucket, region='ru-central-1', settings=None, clients=None, listing_cache=None):
+        s3 = (clients or S3ClientPool()).get(ak, sk, endpoint, region, settings)
+        return cls(s3, endpoint, bucket, listing_cache)
+
+    @property
+    def scope(self):
+        return (self.endpoint, self.bucket)
+
+    def open_folder(self, prefix):
+        # Первая страница папки при входе; она же проверка доступа вместо отдельного пробного запроса
+        listing = self.listing(prefix)
+        entries = listing.fetch_nonempty()
+        self.listing_seen(listing, entries)
+        return listing, entries
+
+    def close(self):
+        # Отложенные записи (метаданные папок, индексы) - сразу, до выхода процесса
+        self.folder_meta.flush()
+        self.indexes.usage.save()
+        self.indexes.folder_tree.save()
+        self.history.save()
+        self.hashes.save()
+
+    # --- Листинг ---
+
+    def listing(self, prefix, snapshot=None):
+        if snapshot: return FolderListing.restore(self.s3, self.bucket, prefix, snapshot)
+        return FolderListing(self.s3, self.bucket, prefix)
+
+    def list_folder(self, prefix):
+        # Полный листинг папки; заодно обновляет каталог, дерево папок и кэш
+        listing = self.listing(prefix)
+        entries = listing.fetch_nonempty()
+        while not listing.exhausted:
+            entries.extend(listing.fetch_page())
+        self.listing_seen(listing, entries)
+        return entries
+
+    def listing_seen(self, listing, entries):
+        self.indexes.listing_cache.put(self.scope, listing.prefix, listing.snapshot(entries))
+        self.indexes.listing_seen(listing.prefix, entries, listing.exhausted)
+
+    def iter_objects(self, prefix=""):
+        # Все объекты под префиксом (без Delimiter)
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if is_hidden_key(obj['Key']): continue
+                modified = obj.get('LastModified')
+                yield {'type': 'file', 'key': obj['Key'], 'size': obj['Size'], 'etag': obj.get('ETag', '').strip('"'),
+                       'modified': modified.timestamp() if modified else 0}
+
+    def build_folder_tree(self, gate=NO_GATE, if_stale=False):
+        return self.indexes.folder_tree.build(self.s3, self.bucket, gate=gate, if_stale=if_stale)
+
+    def search(self, **query):
+        return self.indexes.catalog.search(**query)
+
+    # --- Занятое место ---
+
+    def usage(self, prefix=""):
+        # -> (байты, объектов) из локального индекса; None - индекс еще не собран
+        usage = self.indexes.usage
+        return usage.get(prefix) if usage.has_data() else None
+
+    def reconcile(self, gate=NO_GATE, if_due=False):
+        # Полный обход бакета: каталог и индекс занятого места за один проход
+        indexes = self.indexes
+        return indexes.usage.reconcile(lambda: indexes.catalog.sync(self.s3, self.bucket, gate), if_due)
+
+    # --- Изменения ---
+
+    def upload_plan(self, files, on_progress=None):
+        # Какие из files уже лежат в облаке с тем же содержимым (см. UploadDeduplicator.plan)
+        return UploadDeduplicator(self.s3, self.bucket, self.hashes, self.uploads.part_size).plan(files, on_progress)
+
+    def upload(self, files, on_file_done=None, on_progress=None, gate=NO_GATE, on_file_progress=None):
+        # files: [(local_path, key)] -> {key: ошибка или None}
+        # ETag загруженного объекта запоминается для этой версии файла - повторная проверка без хэширования
+        stats = {key: os.stat(path) for path, key in files if os.path.exists(path)}
+        paths = dict((key, path) for path, key in files)
+
+        def file_done(key, size, error, etag):
+            if not error:
+                self.indexes.object_added(key, size, etag)
+                stat = stats.get(key)
+                if stat and etag: self.hashes.put(paths[key], stat.st_size, stat.st_mtime, remote_etag=etag)
+            if on_file_done: on_file_done(key, size, error, etag)
+        return self.uploads.upload(files, file_done, on_progress, gate, on_file_progress)
+
+    def upload_tree(self, local_dir, prefix):
+        # Файлы каталога рекурсивно -> [(local_path, key)] для upload()
+        files = []
+        for root, _, names in os.walk(local_dir):
+            rel = os.path.relpath(root, local_dir).replace(os.sep, '/')
+            for name in names:
+                files.append((os.path.join(root, name), prefix + ("" if rel == "." else rel + "/") + name))
+        return files
+
+    def create_folder(self, key):
+        self.s3.put_object(Bucket=self.bucket, Key=key)
+        self.indexes.object_added(key, 0)
+
+    def delete_object(self, key, size=0):
+        self.s3.delete_object(Bucket=self.bucket, Key=key)
+        self.indexes.object_removed(key, size)
+
+    def delete_prefix(self, prefix, versions=False, on_progress=None, gate=NO_GATE):
+        # -> (удалено, ошибок, [(key, code)]); on_progress(deleted, failed)
+        try:
+            deleted, failed, errors = PrefixDeleter(self.s3, self.bucket, versions=versions, gate=gate).delete(prefix, on_progress)
+        except JobCancelled:
+            # Удалена только часть: индексы папки больше не точны
+            self.indexes.prefix_changed(prefix)
+            raise
+        if failed:
+            self.indexes.prefix_changed(prefix)
+        else:
+            self.indexes.prefix_removed(prefix)
+            self.folder_meta.remove_tree(prefix)
+        return deleted, failed, errors
+
+    def copy_object(self, src, dst, size, etag='', move=False, gate=NO_GATE):
+        if object_exists(self.s3, self.bucket, dst): raise ValueError(f"{dst} уже существует")
+        with gate.request():
+            new_etag = ObjectCopier(self.s3, self.bucket).copy(src, dst, size, etag)
+        self.indexes.object_added(dst, size, new_etag)
+        if move: self.delete_object(src, size)
+
+    def copy_prefix(self, src, dst, move=False, on_progress=None, resume=False, gate=NO_GATE):
+        # Задание пишется в журнал до начала и удаляется после успеха, прерванное
+        # продолжается повторным вызовом с resume=True (см. pending_moves)
+        if dst.startswith(src):
+            # Копия внутрь себя листала бы уже скопированные объекты
+            raise ValueError(f"Нельзя скопировать {src} внутрь самой себя")
+        if not resume and self.s3.list_objects_v2(Bucket=self.bucket, Prefix=dst, MaxKeys=1).get('KeyCount'):
+            raise ValueError(f"{dst} уже существует")
+        job_id = self.moves.add(src, dst, move)
+        result = PrefixMover(self.s3, self.bucket, src, dst, move, self.indexes, gate=gate).run(on_progress)
+        if not result['failed']:
+            self.folder_meta.move_tree(src, dst, keep=not move)
+            self.moves.remove(job_id)
+        return result
+
+    def pending_moves(self):
+        return self.moves.pending()
+
+    # --- Скачивание и синхронизация ---
+
+    def downloader(self, gate=NO_GATE):
+        return BulkDownloader(self.s3, self.bucket, gate=gate)
+
+    def presigned_url(self, key, filename, expires=3600):
+        return self.s3.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key, 'ResponseContentDisposition': f'attachment; filename="{filename}"'},
+            ExpiresIn=expires)
+
+    def sync_engine(self, local_dir, prefix, mode="both", deletes=False):
+        journal = local_state_path("sync", self.endpoint, self.bucket, prefix, os.path.abspath(local_dir))
+        return SyncEngine(self.s3, self.bucket, prefix, local_dir, journal, self.uploads, self.indexes, mode=mode, deletes=deletes)
+
+    # --- Настройки в облаке ---
+
+    def read_json(self, key, default=None):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=key)
+            return json.loads(response['Body'].read().decode('utf-8'))
+        except ClientError as e:
+            if error_code(e) not in ('NoSuchKey', '404'): raise
+            return default
+
+    def write_json(self, key, data):
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(data))
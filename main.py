@@ -1,568 +1,1853 @@
-import flet as ft
-import boto3
-import json
-import threading
-
-# Файлы настроек (в облаке)
-METADATA_FILE = ".folder_metadata.json"
-SETTINGS_FILE = ".app_settings.json"
-
-def get_file_style(filename):
-    parts = filename.rsplit('.', 1)
-    ext = ('.' + parts[1].lower()) if len(parts) > 1 else ''
-    
-    if ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-        return ft.icons.IMAGE, ft.colors.PURPLE_400
-    elif ext in ['.mp3', '.wav', '.ogg']:
-        return ft.icons.AUDIO_FILE, ft.colors.PINK_400
-    elif ext in ['.mp4', '.mov', '.avi', '.mkv']:
-        return ft.icons.VIDEO_FILE, ft.colors.RED_400
-    elif ext in ['.pdf']:
-        return ft.icons.PICTURE_AS_PDF, ft.colors.RED_700
-    elif ext in ['.zip', '.rar', '.7z', '.tar', '.gz']:
-        return ft.icons.FOLDER_ZIP, ft.colors.AMBER_600
-    elif ext in ['.py', '.js', '.html', '.css', '.json', '.xml', '.dart']:
-        return ft.icons.CODE, ft.colors.CYAN_600
-    elif ext in ['.txt', '.doc', '.docx', '.xls', '.xlsx', '.ppt']:
-        return ft.icons.DESCRIPTION, ft.colors.BLUE_400
-    elif ext in ['.exe', '.apk', '.msi']:
-        return ft.icons.ANDROID, ft.colors.GREEN_400
-    else:
-        return ft.icons.INSERT_DRIVE_FILE, ft.colors.GREY_400
-
-class S3CloudApp:
-    def __init__(self, page: ft.Page):
-        self.page = page
-        self.page.title = "Личное Облако"
-        self.page.theme_mode = ft.ThemeMode.LIGHT
-        self.page.theme = ft.Theme(color_scheme_seed=ft.colors.BLUE)
-        
-        # S3 State
-        self.s3 = None
-        self.bucket_name = None
-        
-        # App State
-        self.metadata = {}
-        self.app_settings = {"default_folder": ""}
-        self.current_path = ""
-        self.is_mobile = page.platform in [ft.PagePlatform.ANDROID, ft.PagePlatform.IOS]
-
-        # UI Components
-        self.file_picker = ft.FilePicker(on_result=self.upload_files_result)
-        self.page.overlay.append(self.file_picker)
-        
-        # 1. Строим UI (все скрыто)
-        self.build_ui()
-        
-        # 2. Проверяем авто-вход
-        if self.page.client_storage.contains_key("s3_creds"):
-            self.try_auto_login()
-        else:
-            self.show_login_screen()
-
-    # --- AUTH & LOGIN ---
-
-    def try_auto_login(self):
-        try:
-            creds = self.page.client_storage.get("s3_creds")
-            if creds:
-                region = creds.get('region', 'ru-central-1')
-                self.connect_s3(creds['access_key'], creds['secret_key'], creds['endpoint'], creds['bucket'], region)
-            else:
-                self.show_login_screen()
-        except Exception:
-            self.show_login_screen()
-
-    def connect_s3(self, ak, sk, endpoint, bucket, region='ru-central-1'):
-        try:
-            self.s3 = boto3.client(
-                's3',
-                endpoint_url=endpoint,
-                aws_access_key_id=ak,
-                aws_secret_access_key=sk,
-                region_name=region
-            )
-            self.bucket_name = bucket
-            
-            # Тестовый запрос
-            self.s3.list_objects_v2(Bucket=self.bucket_name, MaxKeys=1)
-            
-            # Сохраняем (включая регион)
-            self.page.client_storage.set("s3_creds", {
-                'access_key': ak, 
-                'secret_key': sk, 
-                'endpoint': endpoint, 
-                'bucket': bucket,
-                'region': region
-            })
-
-            # Загрузка
-            self.load_metadata()
-            self.load_app_settings()
-            self.current_path = self.app_settings.get("default_folder", "")
-            
-            self.show_main_screen()
-            self.refresh_file_list()
-            self.show_snack("Вход выполнен")
-
-        except Exception as e:
-            self.s3 = None
-            self.show_snack(f"Ошибка входа: {e}", color="red")
-            self.show_login_screen()
-
-    def logout(self, e=None):
-        self.s3 = None
-        self.bucket_name = None
-        self.metadata = {}
-        self.app_settings = {}
-        self.current_path = ""
-        
-        # Удаляем ключи из хранилища
-        self.page.client_storage.remove("s3_creds")
-            
-        self.grid.controls.clear()
-        self.storage_text.value = ""
-        self.path_text.value = "Не авторизован"
-        self.fab.visible = False
-        
-        self.show_login_screen()
-        self.show_snack("Вы вышли из системы")
-
-    # --- UI BUILDING ---
-
-    def build_ui(self):
-        # Header
-        self.storage_text = ft.Text("", color=ft.colors.ORANGE, weight=ft.FontWeight.BOLD, size=12)
-        
-        # Menu
-        self.popup_menu = ft.PopupMenuButton(
-            items=[
-                ft.PopupMenuItem(text="Настройки", icon=ft.icons.SETTINGS, on_click=self.show_global_settings),
-                ft.PopupMenuItem(text="Цвет темы", icon=ft.icons.COLOR_LENS, on_click=self.show_theme_picker),
-                ft.PopupMenuItem(text="Выход", icon=ft.icons.LOGOUT, on_click=self.logout),
-            ]
-        )
-
-        self.app_bar = ft.AppBar(
-            title=ft.Column([
-                ft.Text("Мое Облако", size=18),
-                ft.Row([ft.Icon(ft.icons.CLOUD_QUEUE, size=14, color=ft.colors.ORANGE), self.storage_text], spacing=5)
-            ], spacing=2),
-            actions=[
-                ft.IconButton(ft.icons.REFRESH, on_click=lambda e: self.refresh_file_list(), tooltip="Обновить"),
-                self.popup_menu
-            ],
-            visible=False # Изначально скрыт
-        )
-        self.page.appbar = self.app_bar
-
-        # Path & Back
-        self.path_text = ft.Text("Загрузка...", size=16, weight=ft.FontWeight.BOLD)
-        self.back_btn = ft.IconButton(ft.icons.ARROW_BACK, on_click=self.go_back, disabled=True)
-        
-        # File Grid
-        self.grid = ft.GridView(
-            expand=1,
-            runs_count=5,
-            max_extent=150,
-            child_aspect_ratio=0.8,
-            spacing=10,
-            run_spacing=10,
-        )
-
-        # FAB
-        self.fab = ft.FloatingActionButton(
-            icon=ft.icons.ADD,
-            on_click=self.show_add_menu,
-            visible=False
-        )
-        self.page.floating_action_button = self.fab
-
-        # Containers
-        self.main_container = ft.Column(
-            [
-                ft.Row([self.back_btn, self.path_text], alignment=ft.MainAxisAlignment.START),
-                ft.Divider(),
-                self.grid
-            ],
-            expand=True,
-            visible=False
-        )
-        
-        self.login_container = ft.Column(
-            alignment=ft.MainAxisAlignment.CENTER,
-            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-            expand=True,
-            visible=True
-        )
-
-        self.page.add(self.main_container, self.login_container)
-
-    def show_login_screen(self):
-        # Безопасное переключение
-        if self.page.appbar: self.page.appbar.visible = False
-        self.main_container.visible = False
-        self.fab.visible = False
-        self.login_container.visible = True
-        
-        # Поля
-        endpoint_tf = ft.TextField(label="Endpoint URL", value="https://s3.cloud.ru", width=300)
-        region_tf = ft.TextField(label="Region Name", value="ru-central-1", width=300)
-        bucket_tf = ft.TextField(label="Bucket Name", value="s3-cloud-storage", width=300)
-        ak_tf = ft.TextField(label="Access Key ID", width=300, password=True, can_reveal_password=True)
-        sk_tf = ft.TextField(label="Secret Access Key", width=300, password=True, can_reveal_password=True)
-        
-        def login_click(e):
-            if not all([endpoint_tf.value, bucket_tf.value, ak_tf.value, sk_tf.value]):
-                self.show_snack("Заполните основные поля", color="red")
-                return
-            self.connect_s3(ak_tf.value, sk_tf.value, endpoint_tf.value, bucket_tf.value, region_tf.value)
-
-        self.login_container.controls = [
-            ft.Icon(ft.icons.CLOUD_CIRCLE, size=100, color=ft.colors.BLUE),
-            ft.Text("Вход в S3 Облако", size=24, weight=ft.FontWeight.BOLD),
-            ft.Container(height=20),
-            endpoint_tf, region_tf, bucket_tf, ak_tf, sk_tf,
-            ft.Container(height=20),
-            ft.ElevatedButton("Войти", on_click=login_click, width=200, height=50)
-        ]
-        self.page.update()
-
-    def show_main_screen(self):
-        self.login_container.visible = False
-        if self.page.appbar: self.page.appbar.visible = True
-        self.main_container.visible = True
-        self.fab.visible = True
-        self.page.update()
-
-    # --- S3 LOGIC ---
-
-    def refresh_file_list(self):
-        if not self.s3: return
-
-        self.grid.controls.clear()
-        self.back_btn.disabled = (self.current_path == "")
-        display_path = self.current_path if self.current_path else "/"
-        self.path_text.value = f"Путь: {display_path}"
-        
-        try:
-            response = self.s3.list_objects_v2(
-                Bucket=self.bucket_name, Prefix=self.current_path, Delimiter='/'
-            )
-            
-            if 'CommonPrefixes' in response:
-                for prefix in response['CommonPrefixes']:
-                    folder_key = prefix['Prefix']
-                    folder_name = folder_key.rstrip('/').split('/')[-1]
-                    meta = self.metadata.get(folder_key, {})
-                    self.grid.controls.append(
-                        self.create_folder_item(folder_name, folder_key, meta.get("color", ft.colors.BLUE), meta.get("caption", folder_name))
-                    )
-
-            if 'Contents' in response:
-                for obj in response['Contents']:
-                    key = obj['Key']
-                    if key == self.current_path or key in [METADATA_FILE, SETTINGS_FILE]: 
-                        continue 
-                    filename = key.split('/')[-1]
-                    if filename:
-                        self.grid.controls.append(self.create_file_item(filename, key, obj['Size']))
-
-            self.update_storage_usage()
-
-        except Exception as e:
-            self.show_snack(f"Ошибка S3: {e}", color="red")
-        
-        self.page.update()
-
-    def upload_files_result(self, e):
-        if not self.s3: return
-        
-        if e.files:
-            def upload_in_background():
-                for f in e.files:
-                    try:
-                        self.s3.upload_file(f.path, self.bucket_name, self.current_path + f.name)
-                        self.show_snack(f"Загружен: {f.name}")
-                    except Exception as ex: 
-                        self.show_snack(f"Ошибка загрузки {f.name}: {ex}", color="red")
-                self.refresh_file_list()
-            
-            threading.Thread(target=upload_in_background, daemon=True).start()
-
-    def delete_folder(self, folder_key):
-        if not self.s3: return
-
-        def delete_in_background():
-            try:
-                paginator = self.s3.get_paginator('list_objects_v2')
-                objects = []
-                for page in paginator.paginate(Bucket=self.bucket_name, Prefix=folder_key):
-                    if 'Contents' in page:
-                        objects.extend([{'Key': o['Key']} for o in page['Contents']])
-                
-                if objects:
-                    for i in range(0, len(objects), 1000):
-                        self.s3.delete_objects(Bucket=self.bucket_name, Delete={'Objects': objects[i:i+1000]})
-                
-                if folder_key in self.metadata:
-                    del self.metadata[folder_key]
-                    self.save_metadata()
-                    
-                self.show_snack("Папка удалена")
-                self.refresh_file_list()
-            except Exception as e:
-                self.show_snack(f"Ошибка удаления: {e}", color="red")
-        
-        threading.Thread(target=delete_in_background, daemon=True).start()
-
-    # --- HELPERS ---
-
-    def load_metadata(self):
-        if not self.s3: return
-        try:
-            response = self.s3.get_object(Bucket=self.bucket_name, Key=METADATA_FILE)
-            self.metadata = json.loads(response['Body'].read().decode('utf-8'))
-        except Exception:
-            self.metadata = {}
-
-    def save_metadata(self):
-        if not self.s3: return
-        try:
-            self.s3.put_object(Bucket=self.bucket_name, Key=METADATA_FILE, Body=json.dumps(self.metadata))
-        except Exception: pass
-
-    def load_app_settings(self):
-        if not self.s3: return
-        try:
-            response = self.s3.get_object(Bucket=self.bucket_name, Key=SETTINGS_FILE)
-            self.app_settings = json.loads(response['Body'].read().decode('utf-8'))
-        except Exception:
-            self.app_settings = {"default_folder": ""}
-
-    def save_app_settings(self):
-        if not self.s3: return
-        try:
-            self.s3.put_object(Bucket=self.bucket_name, Key=SETTINGS_FILE, Body=json.dumps(self.app_settings))
-        except Exception as e:
-            self.show_snack(f"Ошибка сохранения настроек: {e}", color="red")
-
-    def update_storage_usage(self):
-        if not self.s3: return
-        def calculate_in_background():
-            try:
-                total = 0
-                paginator = self.s3.get_paginator('list_objects_v2')
-                for page in paginator.paginate(Bucket=self.bucket_name):
-                    if 'Contents' in page:
-                        for obj in page['Contents']: total += obj['Size']
-                
-                if total < 1024 * 1024: display = f"{total/1024:.1f} KB"
-                elif total < 1024 * 1024 * 1024: display = f"{total/(1024*1024):.1f} MB"
-                else: display = f"{total/(1024*1024*1024):.2f} GB"
-                
-                self.storage_text.value = display
-                self.storage_text.update()
-            except: pass
-        threading.Thread(target=calculate_in_background, daemon=True).start()
-
-    # --- DIALOGS ---
-
-    def show_add_menu(self, e):
-        if not self.s3: return
-        dlg = ft.AlertDialog(
-            title=ft.Text("Создать"),
-            content=ft.Column([
-                ft.ElevatedButton("Загрузить файлы", icon=ft.icons.UPLOAD, 
-                    on_click=lambda _: [self.close_dialog(dlg), self.file_picker.pick_files(allow_multiple=True)]),
-                ft.ElevatedButton("Новая папка", icon=ft.icons.CREATE_NEW_FOLDER, 
-                    on_click=lambda _: [self.close_dialog(dlg), self.show_create_folder_dialog()])
-            ], height=120, tight=True)
-        )
-        self.open_dialog(dlg)
-
-    def show_create_folder_dialog(self):
-        tf = ft.TextField(label="Имя папки")
-        def create_action(e):
-            if tf.value and self.s3:
-                try:
-                    self.s3.put_object(Bucket=self.bucket_name, Key=self.current_path + tf.value + "/")
-                    self.close_dialog(dlg)
-                    self.refresh_file_list()
-                except Exception as ex: self.show_snack(f"Ошибка: {ex}", color="red")
-        
-        dlg = ft.AlertDialog(title=ft.Text("Новая папка"), content=tf, actions=[
-            ft.TextButton("Отмена", on_click=lambda e: self.close_dialog(dlg)),
-            ft.ElevatedButton("Создать", on_click=create_action)
-        ])
-        self.open_dialog(dlg)
-
-    def fetch_all_folders(self):
-        if not self.s3: return []
-        folders = ["/ (Корень)"]
-        try:
-            paginator = self.s3.get_paginator('list_objects_v2')
-            for page in paginator.paginate(Bucket=self.bucket_name):
-                if 'Contents' in page:
-                    for obj in page['Contents']:
-                        key = obj['Key']
-                        if key.endswith('/') and key != '/': folders.append(key)
-        except: pass
-        return folders
-
-    def open_folder_settings(self, folder_key, name, current_color, current_caption):
-        if not self.s3: return
-        tf = ft.TextField(label="Имя", value=current_caption)
-        colors_map = {
-            "Синий": ft.colors.BLUE, "Красный": ft.colors.RED, "Зеленый": ft.colors.GREEN, 
-            "Оранжевый": ft.colors.ORANGE, "Фиолетовый": ft.colors.PURPLE, 
-            "Серый": ft.colors.GREY, "Желтый": ft.colors.YELLOW
-        }
-        curr_col_name = next((k for k,v in colors_map.items() if v == current_color), "Синий")
-        dd = ft.Dropdown(label="Цвет", options=[ft.dropdown.Option(k) for k in colors_map], value=curr_col_name)
-
-        def save(e):
-            self.metadata[folder_key] = {"color": colors_map.get(dd.value), "caption": tf.value}
-            self.save_metadata()
-            self.close_dialog(dlg)
-            self.refresh_file_list()
-        
-        def delete(e):
-            self.close_dialog(dlg)
-            self.delete_folder(folder_key)
-
-        dlg = ft.AlertDialog(title=ft.Text(name), content=ft.Column([tf, dd], height=150), actions=[
-            ft.TextButton("УДАЛИТЬ", style=ft.ButtonStyle(color="red"), on_click=delete),
-            ft.ElevatedButton("Сохранить", on_click=save)
-        ])
-        self.open_dialog(dlg)
-
-    def show_file_actions(self, key, filename):
-        if not self.s3: return
-        def delete(e):
-            try:
-                self.s3.delete_object(Bucket=self.bucket_name, Key=key)
-                self.close_dialog(dlg)
-                self.refresh_file_list()
-            except Exception as ex: self.show_snack(f"Ошибка: {ex}", color="red")
-        
-        dlg = ft.AlertDialog(title=ft.Text(filename), actions=[
-            ft.ElevatedButton("Удалить", color="red", on_click=delete)
-        ])
-        self.open_dialog(dlg)
-
-    def show_global_settings(self, e):
-        if not self.s3: return
-        folders = self.fetch_all_folders()
-        dd_start = ft.Dropdown(
-            label="Папка при запуске",
-            options=[ft.dropdown.Option(text=f, key=f if f != "/ (Корень)" else "") for f in folders],
-            value=self.app_settings.get("default_folder", "")
-        )
-        def save_settings(e):
-            self.app_settings["default_folder"] = dd_start.value
-            self.save_app_settings()
-            self.close_dialog(dlg)
-            self.show_snack("Настройки сохранены")
-
-        dlg = ft.AlertDialog(title=ft.Text("Настройки"), content=dd_start, actions=[
-            ft.ElevatedButton("Сохранить", on_click=save_settings)
-        ])
-        self.open_dialog(dlg)
-
-    def show_theme_picker(self, e):
-        colors = [
-            ft.colors.BLUE, ft.colors.LIGHT_BLUE, ft.colors.CYAN, ft.colors.TEAL,
-            ft.colors.GREEN, ft.colors.LIGHT_GREEN, ft.colors.LIME, ft.colors.YELLOW,
-            ft.colors.AMBER, ft.colors.ORANGE, ft.colors.DEEP_ORANGE, ft.colors.RED,
-            ft.colors.PINK, ft.colors.PURPLE, ft.colors.DEEP_PURPLE, ft.colors.INDIGO,
-            ft.colors.BLUE_GREY, ft.colors.BROWN, ft.colors.GREY
-        ]
-        grid = ft.GridView(runs_count=5, height=300, padding=10, spacing=10)
-        for c in colors:
-            grid.controls.append(ft.Container(
-                bgcolor=c, width=40, height=40, border_radius=20, border=ft.border.all(1, ft.colors.OUTLINE),
-                on_click=lambda e, col=c: [setattr(self.page.theme, 'color_scheme_seed', col), self.page.update(), self.close_dialog(dlg)],
-                ink=True
-            ))
-        dlg = ft.AlertDialog(title=ft.Text("Выберите цвет"), content=grid)
-        self.open_dialog(dlg)
-
-    # --- NAVIGATION & DOWNLOAD ---
-
-    def navigate_to(self, folder_key):
-        if not self.s3: return
-        self.current_path = folder_key
-        self.refresh_file_list()
-
-    def go_back(self, e):
-        if not self.s3: return
-        parts = self.current_path.rstrip('/').split('/')
-        if len(parts) > 1: self.current_path = "/".join(parts[:-1]) + "/"
-        else: self.current_path = ""
-        self.refresh_file_list()
-
-    def download_file(self, key, filename):
-        if not self.s3: return
-        def generate_and_launch():
-            try:
-                url = self.s3.generate_presigned_url(
-                    'get_object',
-                    Params={'Bucket': self.bucket_name, 'Key': key, 'ResponseContentDisposition': f'attachment; filename="{filename}"'},
-                    ExpiresIn=3600
-                )
-                self.page.launch_url(url)
-                self.show_snack(f"Скачивание: {filename}")
-            except Exception as e:
-                self.show_snack(f"Ошибка ссылки: {e}", color="red")
-        threading.Thread(target=generate_and_launch, daemon=True).start()
-
-    # --- FACTORIES ---
-
-    def create_folder_item(self, name, full_key, color, caption):
-        return ft.Container(
-            content=ft.Column([
-                ft.Icon(ft.icons.FOLDER, size=50, color=color),
-                ft.Text(caption, text_align=ft.TextAlign.CENTER, overflow=ft.TextOverflow.ELLIPSIS, size=12),
-            ], alignment=ft.MainAxisAlignment.CENTER),
-            ink=True,
-            on_click=lambda e: self.navigate_to(full_key),
-            border_radius=10, padding=10,
-            on_long_press=lambda e: self.open_folder_settings(full_key, name, color, caption)
-        )
-
-    def create_file_item(self, name, full_key, size):
-        icon, color = get_file_style(name)
-        return ft.Container(
-            content=ft.Column([
-                ft.Icon(icon, size=50, color=color),
-                ft.Text(name, text_align=ft.TextAlign.CENTER, overflow=ft.TextOverflow.ELLIPSIS, size=12, weight=ft.FontWeight.W_500),
-                ft.Text(f"{size/1024:.1f} KB", size=10, color=ft.colors.GREY),
-            ], alignment=ft.MainAxisAlignment.CENTER),
-            ink=True,
-            on_click=lambda e: self.download_file(full_key, name),
-            on_long_press=lambda e: self.show_file_actions(full_key, name),
-            border_radius=10, padding=10,
-        )
-
-    # --- UTILS ---
-
-    def open_dialog(self, dlg):
-        self.page.dialog = dlg
-        dlg.open = True
-        self.page.update()
-
-    def close_dialog(self, dlg):
-        dlg.open = False
-        self.page.update()
-
-    def show_snack(self, message, color="green"):
-        self.page.snack_bar = ft.SnackBar(content=ft.Text(message, color="white"), bgcolor=color)
-        self.page.snack_bar.open = True
-        self.page.update()
-
-def main(page: ft.Page):
-    app = S3CloudApp(page)
-
-if __name__ == "__main__":
-    ft.app(target=main)
+import time
+# Отсчет фаз запуска (Диагностика) - до импорта Flet
+STARTED = time.perf_counter()
+import asyncio
+import flet as ft
+import os
+import threading
+import base64
+from core import (
+    S3ClientPool, AsyncRunner, ListingPrefetcher, ListingCache, ThumbnailCache, ThumbnailLoader,
+    TransferScheduler, JobCancelled, FILE_TYPE_NAMES, SETTINGS_FILE, APP_DATA_DIR, SEARCH_PAGE_SIZE,
+    UPLOAD_PART_SIZE_MB, UPLOAD_FILE_WORKERS, UPLOAD_PART_WORKERS, TRANSFER_MAX_JOBS,
+    PRIORITY_INTERACTIVE, PRIORITY_TRANSFER, PRIORITY_BACKGROUND,
+    S3_POOL_SIZE, S3_CONNECT_TIMEOUT, S3_READ_TIMEOUT,
+    file_type, is_image, has_pil, format_size, parent_prefix, is_network_error, local_state_path,
+)
+
+# Сетка: плиток за одну порцию отрисовки, запас прокрутки до подгрузки следующей страницы
+# и окно плиток: дальше от видимой области плитки удаляются и создаются заново при возврате
+RENDER_BATCH = 120
+SCROLL_PRELOAD_PX = 800
+GRID_WINDOW = 600
+
+# Обновления интерфейса из фоновых потоков: не чаще кадров в секунду
+UI_FPS = 15
+
+# Синхронизация и проверка перед загрузкой: строк плана в предпросмотре
+PLAN_PREVIEW_LINES = 200
+
+STARTUP_PHASES = {
+    "ui": "интерфейс", "boto3": "boto3", "client": "клиент S3", "cached_folder": "папка из каталога",
+    "listing": "первая страница", "settings": "настройки", "folder_meta": "метаданные", "first_folder": "папка на экране",
+}
+
+JOB_STATES = {
+    "queued": "в очереди", "running": "выполняется", "paused": "на паузе",
+    "done": "завершено", "failed": "ошибка", "cancelled": "отменено",
+}
+
+FILE_STYLES = {
+    "image": (ft.icons.IMAGE, ft.colors.PURPLE_400),
+    "audio": (ft.icons.AUDIO_FILE, ft.colors.PINK_400),
+    "video": (ft.icons.VIDEO_FILE, ft.colors.RED_400),
+    "pdf": (ft.icons.PICTURE_AS_PDF, ft.colors.RED_700),
+    "archive": (ft.icons.FOLDER_ZIP, ft.colors.AMBER_600),
+    "code": (ft.icons.CODE, ft.colors.CYAN_600),
+    "document": (ft.icons.DESCRIPTION, ft.colors.BLUE_400),
+    "app": (ft.icons.ANDROID, ft.colors.GREEN_400),
+}
+
+def get_file_style(filename):
+    return FILE_STYLES.get(file_type(filename), (ft.icons.INSERT_DRIVE_FILE, ft.colors.GREY_400))
+
+class UiDispatcher:
+    # Единая точка обновления интерфейса из фоновых потоков. Задачи копятся
+    # и выполняются в одном потоке не чаще UI_FPS раз в секунду, после пачки -
+    # один page.update(). Задачи с одинаковым ключом схлопываются: из десятка
+    # обновлений прогресса за кадр выполняется только последнее.
+    # Обработчики событий Flet идут в своих потоках: то, что меняет состояние
+    # сетки (записи, плитки, выделение), передается сюда же (on_thread).
+    def __init__(self, page, fps=UI_FPS, on_error=None):
+        self.page = page
+        self.interval = 1 / fps
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.seq = 0
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def on_thread(self):
+        return threading.current_thread() is self.thread
+
+    def post(self, fn, key=None):
+        # Без ключа задача выполняется всегда; с ключом заменяет ожидающую задачу с тем же ключом
+        with self.lock:
+            if key is None:
+                self.seq += 1
+                key = self.seq
+            self.tasks.pop(key, None)
+            self.tasks[key] = fn
+        self.wake.set()
+
+    def update(self):
+        # Контролы уже изменены - только перерисовать в ближайшем кадре
+        self.post(None, key="update")
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            started = time.monotonic()
+            self.wake.clear()
+            with self.lock:
+                tasks, self.tasks = list(self.tasks.values()), {}
+            for fn in tasks:
+                if fn is None: continue
+                try:
+                    fn()
+                except Exception as e:
+                    if self.on_error: self.on_error(e)
+            try:
+                self.page.update()
+            except Exception as e:
+                if self.on_error: self.on_error(e)
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+class S3CloudApp:
+    def __init__(self, page: ft.Page):
+        self.page = page
+        self.page.title = "Личное Облако"
+        self.page.theme_mode = ft.ThemeMode.LIGHT
+        self.page.theme = ft.Theme(color_scheme_seed=ft.colors.BLUE)
+        
+        # S3 State
+        self.storage = None
+        self.access_key = None
+        self.clients = S3ClientPool()
+        self.ui = UiDispatcher(page, on_error=lambda e: self.clients.metrics.note_error("Интерфейс", e))
+        self.io = AsyncRunner(on_error=lambda e: self.clients.metrics.note_error("Фоновая задача", e))
+        self.prefetcher = ListingPrefetcher(self.io)
+        self.transfers = TransferScheduler(local_state_path("jobs"), on_change=lambda: self.ui.post(self.jobs_changed, key="jobs"))
+        self.transfers.register("upload", self.without_prefetch(self.run_upload_job))
+        self.transfers.register("download", self.without_prefetch(self.run_download_job))
+        self.transfers.register("delete", self.without_prefetch(self.run_delete_job))
+        self.jobs_view = None
+        self.scans = {}
+        self.tree_ready = None
+        self.offline = False
+        self.connecting = False
+        self.cold_start = True
+        
+        # App State
+        self.app_settings = {"default_folder": ""}
+        self.current_path = ""
+        self.listing = None
+        self.listing_gen = 0
+        self.loading = False
+        self.entries = []
+        self.rendered = 0
+        self.grid_start = 0
+        self.fetching_page = False
+        self.listing_cache = ListingCache()
+        self.tiles = {}
+        self.tile_states = {}
+        self.grid_scope = None
+        self.selected = {}
+        self.pending_download = None
+        self.thumbnails = None
+        self.thumbs_shown = set()
+        self.scroll_pixels = 0
+        self.viewport_height = None
+        self.is_mobile = page.platform in [ft.PagePlatform.ANDROID, ft.PagePlatform.IOS]
+
+        # UI Components
+        self.file_picker = ft.FilePicker(on_result=self.upload_files_result)
+        self.dir_picker = ft.FilePicker(on_result=self.download_target_result)
+        self.zip_picker = ft.FilePicker(on_result=self.download_target_result)
+        self.sync_picker = ft.FilePicker(on_result=self.sync_dir_result)
+        self.metrics_picker = ft.FilePicker(on_result=self.metrics_export_result)
+        self.sync_dir_field = None
+        self.pending_export = None
+        self.page.overlay.extend([self.file_picker, self.dir_picker, self.zip_picker, self.sync_picker, self.metrics_picker])
+
+        # boto3 импортируется и готовит клиент, пока строится интерфейс
+        threading.Thread(target=self.preload_s3, daemon=True).start()
+        
+        # 1. Строим UI (все скрыто)
+        self.build_ui()
+        self.mark_phase("ui")
+        self.apply_transfer_settings()
+        
+        # 2. Проверяем авто-вход
+        if self.page.client_storage.contains_key("s3_creds"):
+            self.try_auto_login()
+        else:
+            self.show_login_screen()
+
+    # --- AUTH & LOGIN ---
+
+    def preload_s3(self):
+        try:
+            self.clients.warm_up()
+            self.mark_phase("boto3")
+        except Exception as e:
+            self.clients.metrics.note_error("Запуск", e)
+
+    def mark_phase(self, name):
+        # Фазы холодного запуска: секунды от старта процесса, в диагностику и экспорт метрик
+        if self.cold_start: self.clients.metrics.phase(name, time.perf_counter() - STARTED)
+
+    def folder_shown(self):
+        # Первая живая папка на экране - конец холодного запуска
+        if not self.cold_start: return
+        self.mark_phase("first_folder")
+        self.cold_start = False
+
+    def try_auto_login(self):
+        try:
+            creds = self.page.client_storage.get("s3_creds")
+            if creds:
+                self.connect_profile(creds)
+            else:
+                self.show_login_screen()
+        except Exception:
+            self.show_login_screen()
+
+    def connect_profile(self, creds):
+        region = creds.get('region', 'ru-central-1')
+        self.connect_s3(creds['access_key'], creds['secret_key'], creds['endpoint'], creds['bucket'], region)
+
+    @property
+    def s3(self):
+        return self.storage.s3 if self.storage else None
+
+    @property
+    def bucket_name(self):
+        return self.storage.bucket if self.storage else None
+
+    @property
+    def endpoint(self):
+        return self.storage.endpoint if self.storage else None
+
+    @property
+    def scope(self):
+        return (self.endpoint, self.bucket_name)
+
+    @property
+    def indexes(self):
+        return self.storage.indexes if self.storage else None
+
+    @property
+    def folder_meta(self):
+        return self.storage.folder_meta if self.storage else None
+
+    @property
+    def usage(self):
+        return self.indexes.usage if self.indexes else None
+
+    @property
+    def folder_tree(self):
+        return self.indexes.folder_tree if self.indexes else None
+
+    @property
+    def catalog(self):
+        return self.indexes.catalog if self.indexes else None
+
+    def connection_settings(self):
+        return self.page.client_storage.get("connection_settings") or {}
+
+    def connect_s3(self, ak, sk, endpoint, bucket, region='ru-central-1'):
+        # Вход не блокирует интерфейс: клиент, первая папка, настройки и метаданные - в фоне.
+        # Повторный вход отменяет незавершенный (ключ "connect")
+        self.flush_folder_meta()
+        self.io.submit(self.open_session(ak, sk, endpoint, bucket, region), key="connect")
+
+    async def open_session(self, ak, sk, endpoint, bucket, region):
+        try:
+            storage = await self.io.call(self.clients.storage, ak, sk, endpoint, bucket, region, self.connection_settings(),
+                                         listing_cache=self.listing_cache)
+        except Exception as e:
+            self.ui.post(lambda error=e: self.session_failed(error))
+            return
+        self.mark_phase("client")
+
+        # Стартовая папка из локального каталога рисуется до любых запросов
+        start = storage.indexes.catalog.get_state("start_folder")
+        self.ui.post(lambda: self.session_opened(storage, ak, start))
+
+        # Первая страница стартовой папки (она же проверка доступа), настройки и метаданные папок -
+        # одновременно. Для уже открытого хранилища со свежим листингом запрос папки не повторяем
+        prefix = start or ""
+        cached = self.listing_cache.get(storage.scope, prefix)
+        skip_listing = self.clients.is_verified(storage.s3, bucket) and cached and cached[1]
+        listing, settings, meta = await asyncio.gather(
+            self.startup_step("listing", None if skip_listing else storage.open_folder, prefix),
+            self.startup_step("settings", storage.read_json, SETTINGS_FILE),
+            self.startup_step("folder_meta", storage.folder_meta.load, prefix),
+            return_exceptions=True,
+        )
+        if isinstance(listing, Exception):
+            if start is not None and is_network_error(listing):
+                self.ui.post(self.session_offline)
+            else:
+                self.ui.post(lambda: self.session_failed(listing))
+            return
+        self.clients.mark_verified(storage.s3, bucket)
+        if isinstance(meta, Exception): self.clients.metrics.note_error("Метаданные папок", meta)
+        creds = {'access_key': ak, 'secret_key': sk, 'endpoint': endpoint, 'bucket': bucket, 'region': region}
+        self.ui.post(lambda: self.session_ready(storage, creds, settings))
+
+    async def startup_step(self, phase, fn, *args):
+        if fn is None: return None
+        result = await self.interactive_call(fn, *args)
+        self.mark_phase(phase)
+        return result
+
+    def session_opened(self, storage, ak, start):
+        self.storage = storage
+        self.access_key = ak
+        self.offline = False
+        self.connecting = True
+        self.tiles = {}
+        self.tile_states = {}
+        self.selected = {}
+        self.update_selection_bar()
+        if start is not None and self.catalog.has_folder(start):
+            self.current_path = start
+            self.show_main_screen()
+            self.refresh_file_list(live=False)
+            self.mark_phase("cached_folder")
+
+    def session_offline(self):
+        # Нет сети: остаемся в каталоге до следующего обновления
+        self.connecting = False
+        self.cold_start = False
+        self.offline = True
+        self.show_main_screen()
+        self.refresh_file_list(live=False)
+        self.show_snack("Нет связи с хранилищем, показан локальный каталог", color="orange")
+
+    def session_failed(self, e):
+        self.connecting = False
+        self.storage = None
+        self.show_snack(f"Ошибка входа: {e}", color="red")
+        self.show_login_screen()
+
+    def session_ready(self, storage, creds, settings):
+        if storage is not self.storage: return
+        self.connecting = False
+        if isinstance(settings, Exception):
+            self.clients.metrics.note_error("Настройки", settings)
+            settings = None
+        self.app_settings = settings or {"default_folder": ""}
+        self.current_path = self.app_settings.get("default_folder", "")
+        self.catalog.set_state("start_folder", self.current_path)
+
+        # Сохраняем (включая регион)
+        self.page.client_storage.set("s3_creds", creds)
+        profiles = [p for p in self.saved_profiles() if (p['endpoint'], p['bucket']) != (creds['endpoint'], creds['bucket'])]
+        self.page.client_storage.set("s3_profiles", [creds] + profiles)
+
+        # Стартовая папка уже в кэше листингов, если она не поменялась в настройках
+        self.show_main_screen()
+        self.refresh_file_list()
+        if not self.loading: self.folder_shown()
+        self.show_snack("Вход выполнен")
+        self.resume_jobs()
+        self.resume_moves()
+
+    def saved_profiles(self):
+        return self.page.client_storage.get("s3_profiles") or []
+
+    def logout(self, e=None):
+        if not self.ui.on_thread(): return self.ui.post(self.logout)
+        if self.access_key:
+            self.clients.forget(self.access_key, self.endpoint)
+            profiles = [p for p in self.saved_profiles() if (p['endpoint'], p['bucket']) != self.scope]
+            self.page.client_storage.set("s3_profiles", profiles)
+        self.io.cancel("connect")
+        self.flush_folder_meta()
+        self.storage = None
+        self.access_key = None
+        self.offline = False
+        self.connecting = False
+        self.app_settings = {}
+        self.current_path = ""
+        self.listing = None
+        self.listing_gen += 1
+        self.entries = []
+        self.listing_cache.clear()
+        
+        # Удаляем ключи из хранилища
+        self.page.client_storage.remove("s3_creds")
+            
+        self.grid.controls.clear()
+        self.grid_start = 0
+        self.tiles = {}
+        self.tile_states = {}
+        self.grid_scope = None
+        self.selected = {}
+        self.storage_text.value = ""
+        self.path_text.value = "Не авторизован"
+        self.fab.visible = False
+        
+        self.show_login_screen()
+        self.show_snack("Вы вышли из системы")
+
+    # --- UI BUILDING ---
+
+    def build_ui(self):
+        # Header
+        self.storage_text = ft.Text("", color=ft.colors.ORANGE, weight=ft.FontWeight.BOLD, size=12)
+        
+        # Menu
+        self.popup_menu = ft.PopupMenuButton(
+            items=[
+                ft.PopupMenuItem(text="Хранилища", icon=ft.icons.STORAGE, on_click=self.show_profiles),
+                ft.PopupMenuItem(text="Синхронизация", icon=ft.icons.SYNC, on_click=self.show_sync),
+                ft.PopupMenuItem(text="Передачи", icon=ft.icons.SWAP_VERT, on_click=self.show_transfers),
+                ft.PopupMenuItem(text="Настройки", icon=ft.icons.SETTINGS, on_click=self.show_global_settings),
+                ft.PopupMenuItem(text="Цвет темы", icon=ft.icons.COLOR_LENS, on_click=self.show_theme_picker),
+                ft.PopupMenuItem(text="Диагностика", icon=ft.icons.INSIGHTS, on_click=self.show_diagnostics),
+                ft.PopupMenuItem(text="Выход", icon=ft.icons.LOGOUT, on_click=self.logout),
+            ]
+        )
+
+        self.app_bar = ft.AppBar(
+            title=ft.Column([
+                ft.Text("Мое Облако", size=18),
+                ft.Row([ft.Icon(ft.icons.CLOUD_QUEUE, size=14, color=ft.colors.ORANGE), self.storage_text], spacing=5)
+            ], spacing=2),
+            actions=[
+                ft.IconButton(ft.icons.SEARCH, on_click=self.show_search, tooltip="Поиск"),
+                ft.IconButton(ft.icons.REFRESH, on_click=lambda e: self.refresh_file_list(use_cache=False), tooltip="Обновить"),
+                self.popup_menu
+            ],
+            visible=False # Изначально скрыт
+        )
+        self.page.appbar = self.app_bar
+
+        # Path & Back
+        self.path_text = ft.Text("Загрузка...", size=16, weight=ft.FontWeight.BOLD)
+        self.back_btn = ft.IconButton(ft.icons.ARROW_BACK, on_click=self.go_back, disabled=True)
+        
+        # File Grid
+        self.grid = ft.GridView(
+            expand=1,
+            runs_count=5,
+            max_extent=150,
+            child_aspect_ratio=0.8,
+            spacing=10,
+            run_spacing=10,
+            on_scroll=self.on_grid_scroll,
+            on_scroll_interval=100,
+        )
+
+        # FAB
+        self.fab = ft.FloatingActionButton(
+            icon=ft.icons.ADD,
+            on_click=self.show_add_menu,
+            visible=False
+        )
+        self.page.floating_action_button = self.fab
+
+        # Containers
+        # Transfer progress
+        self.transfer_text = ft.Text("", size=12, color=ft.colors.GREY)
+        self.transfer_bar = ft.ProgressBar(value=0)
+        self.transfer_panel = ft.Column([
+            ft.Row([
+                ft.Container(self.transfer_text, expand=True),
+                ft.IconButton(ft.icons.SWAP_VERT, icon_size=18, tooltip="Передачи", on_click=self.show_transfers),
+            ]),
+            self.transfer_bar,
+        ], spacing=2, visible=False)
+
+        # Selection
+        self.selection_text = ft.Text("", size=14, weight=ft.FontWeight.BOLD)
+        self.selection_bar = ft.Row([
+            self.selection_text,
+            ft.IconButton(ft.icons.DOWNLOAD, tooltip="Скачать в папку", on_click=lambda e: self.download_selection()),
+            ft.IconButton(ft.icons.FOLDER_ZIP, tooltip="Скачать в ZIP", on_click=lambda e: self.download_selection(as_zip=True)),
+            ft.IconButton(ft.icons.CLOSE, tooltip="Снять выделение", on_click=lambda e: self.clear_selection()),
+        ], visible=False)
+
+        self.main_container = ft.Column(
+            [
+                ft.Row([self.back_btn, self.path_text], alignment=ft.MainAxisAlignment.START),
+                self.selection_bar,
+                self.transfer_panel,
+                ft.Divider(),
+                self.grid
+            ],
+            expand=True,
+            visible=False
+        )
+        
+        self.login_container = ft.Column(
+            alignment=ft.MainAxisAlignment.CENTER,
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            expand=True,
+            visible=True
+        )
+
+        self.page.add(self.main_container, self.login_container)
+
+    def show_login_screen(self):
+        self.cold_start = False
+        # Безопасное переключение
+        if self.page.appbar: self.page.appbar.visible = False
+        self.main_container.visible = False
+        self.fab.visible = False
+        self.login_container.visible = True
+        
+        # Поля
+        endpoint_tf = ft.TextField(label="Endpoint URL", value="https://s3.cloud.ru", width=300)
+        region_tf = ft.TextField(label="Region Name", value="ru-central-1", width=300)
+        bucket_tf = ft.TextField(label="Bucket Name", value="s3-cloud-storage", width=300)
+        ak_tf = ft.TextField(label="Access Key ID", width=300, password=True, can_reveal_password=True)
+        sk_tf = ft.TextField(label="Secret Access Key", width=300, password=True, can_reveal_password=True)
+        
+        def login_click(e):
+            if not all([endpoint_tf.value, bucket_tf.value, ak_tf.value, sk_tf.value]):
+                self.show_snack("Заполните основные поля", color="red")
+                return
+            self.connect_s3(ak_tf.value, sk_tf.value, endpoint_tf.value, bucket_tf.value, region_tf.value)
+
+        self.login_container.controls = [
+            ft.Icon(ft.icons.CLOUD_CIRCLE, size=100, color=ft.colors.BLUE),
+            ft.Text("Вход в S3 Облако", size=24, weight=ft.FontWeight.BOLD),
+            ft.Container(height=20),
+            endpoint_tf, region_tf, bucket_tf, ak_tf, sk_tf,
+            ft.Container(height=20),
+            ft.ElevatedButton("Войти", on_click=login_click, width=200, height=50)
+        ]
+        if self.s3:
+            # Добавление еще одного хранилища из открытой сессии
+            self.login_container.controls.append(ft.TextButton("Отмена", on_click=lambda e: self.show_main_screen()))
+        self.page.update()
+
+    def show_main_screen(self):
+        self.login_container.visible = False
+        if self.page.appbar: self.page.appbar.visible = True
+        self.main_container.visible = True
+        self.fab.visible = True
+        self.page.update()
+
+    # --- S3 LOGIC ---
+
+    def refresh_file_list(self, use_cache=True, live=True):
+        # use_cache=False - явное обновление с сервера; live=False - только локальные данные
+        if not self.ui.on_thread(): return self.ui.post(lambda: self.refresh_file_list(use_cache, live))
+        if not self.s3: return
+
+        self.listing_gen += 1
+        # Запросы прежней навигации больше не нужны: отменяем, а уже пришедшие ответы отсекает listing_gen
+        self.io.cancel("listing", "page", "revalidate", "folder_meta", "prefetch")
+        # Та же папка - плитки патчатся на месте с сохранением прокрутки, другая - рисуется заново
+        grid_scope = (self.scope, self.current_path)
+        shown = max(self.rendered, RENDER_BATCH) if grid_scope == self.grid_scope else RENDER_BATCH
+        if grid_scope != self.grid_scope:
+            self.scroll_pixels = 0
+            self.grid_start = 0
+            # Выбор - в пределах одной папки: файлы скачиваются под своими именами без пути
+            if self.selected:
+                self.selected = {}
+                self.update_selection_bar()
+            self.prefetcher.visit(self.storage, self.current_path)
+        self.grid_scope = grid_scope
+        self.entries = []
+        self.fetching_page = False
+        self.loading = False
+        self.back_btn.disabled = (self.current_path == "")
+        if not use_cache: self.offline = False
+        
+        cached = self.listing_cache.get(self.scope, self.current_path) if use_cache else None
+        catalog_entries = self.catalog.list_folder(self.current_path) if use_cache and not cached else None
+        if cached:
+            snapshot, fresh = cached
+            self.listing = self.storage.listing(self.current_path, snapshot)
+            self.entries = snapshot['entries']
+            if not fresh and live and not self.offline: self.revalidate_listing(snapshot['pages'])
+        elif catalog_entries or not live or self.offline:
+            # Из локального каталога сразу, живой листинг подтвердит или поправит в фоне
+            self.show_catalog_entries(catalog_entries or [])
+            if live and not self.offline: self.revalidate_listing(1)
+        else:
+            # Первая страница - без блокировки интерфейса, остальные - по мере прокрутки.
+            # Новая навигация отменяет этот запрос (ключ "listing")
+            self.listing = self.storage.listing(self.current_path)
+            self.loading = True
+            self.io.submit(self.load_listing(self.listing_gen, self.listing, shown), key="listing")
+        self.patch_grid(shown)
+        self.ensure_folder_meta()
+        self.update_storage_usage()
+        self.request_visible_thumbnails()
+        self.prefetch_visible()
+        self.update_path_text()
+        self.page.update()
+
+    async def load_listing(self, gen, listing, shown):
+        try:
+            entries = await self.interactive_call(listing.fetch_nonempty)
+        except Exception as e:
+            self.ui.post(lambda error=e: self.listing_failed(gen, error), key="listing")
+            return
+
+        def apply():
+            if gen != self.listing_gen: return
+            self.loading = False
+            self.entries = entries
+            self.cache_listing()
+            self.patch_grid(shown)
+            self.update_path_text()
+            self.request_visible_thumbnails()
+            self.prefetch_visible()
+            self.folder_shown()
+        self.ui.post(apply, key="listing")
+
+    def listing_failed(self, gen, e):
+        if gen != self.listing_gen: return
+        self.loading = False
+        if is_network_error(e):
+            self.offline = True
+            self.show_catalog_entries(self.catalog.list_folder(self.current_path))
+            self.patch_grid(RENDER_BATCH)
+        self.update_path_text()
+        self.show_snack(f"Ошибка S3: {e}", color="red")
+
+    def update_path_text(self):
+        display_path = self.current_path if self.current_path else "/"
+        self.path_text.value = f"Путь: {display_path}" + (" (офлайн)" if self.offline else "") + (" · загрузка..." if self.loading else "")
+
+    def show_catalog_entries(self, entries):
+        self.listing = self.storage.listing(self.current_path, {'token': None, 'exhausted': True, 'pages': 1})
+        self.entries = entries
+
+    def cache_listing(self):
+        self.storage.listing_seen(self.listing, self.entries)
+
+    def revalidate_listing(self, pages):
+        # Перечитываем столько же страниц, сколько было в кэше, и перерисовываем при расхождении
+        gen, prefix, storage = self.listing_gen, self.current_path, self.storage
+
+        async def revalidate():
+            try:
+                listing = storage.listing(prefix)
+                entries = await self.interactive_call(listing.fetch_nonempty)
+                while listing.pages < pages and not listing.exhausted:
+                    entries.extend(await self.interactive_call(listing.fetch_page))
+                storage.listing_seen(listing, entries)
+            except Exception as e:
+                if is_network_error(e): self.ui.post(went_offline, key="path")
+                return
+
+            def apply():
+                if gen != self.listing_gen or self.fetching_page or entries == self.entries: return
+                self.listing = listing
+                self.entries = entries
+                self.patch_grid(max(self.rendered, RENDER_BATCH))
+                self.request_visible_thumbnails()
+                self.prefetch_visible()
+            self.ui.post(apply, key="revalidate")
+
+        def went_offline():
+            if gen != self.listing_gen: return
+            self.offline = True
+            self.update_path_text()
+        self.io.submit(revalidate(), key="revalidate")
+
+    def render_more(self):
+        # В сетке - записи self.entries[grid_start:rendered], не больше GRID_WINDOW
+        batch = self.entries[self.rendered:self.rendered + RENDER_BATCH]
+        self.grid.controls.extend(self.make_tiles(batch))
+        self.rendered += len(batch)
+        self.trim_grid(from_top=True)
+        return len(batch)
+
+    def render_before(self):
+        # Прокрутка к началу окна: предыдущие ряды возвращаются в сетку, лишние снизу удаляются
+        if not self.grid_start: return
+        columns, row_height = self.grid_geometry()
+        start = max(0, self.grid_start - max(columns, RENDER_BATCH // columns * columns))
+        batch = self.entries[start:self.grid_start]
+        self.grid.controls[:0] = self.make_tiles(batch)
+        self.grid_start = start
+        self.trim_grid(from_top=False)
+        self.scroll_by(-(-len(batch) // columns) * row_height)
+
+    def make_tiles(self, entries):
+        tiles = []
+        for entry in entries:
+            tile = self.create_entry_item(entry)
+            self.tiles[entry['key']] = tile
+            self.tile_states[entry['key']] = self.tile_state(entry)
+            tiles.append(tile)
+        return tiles
+
+    def trim_grid(self, from_top):
+        # Окно по целым рядам, чтобы раскладка оставшихся плиток не сдвинулась
+        extra = self.rendered - self.grid_start - GRID_WINDOW
+        if extra <= 0: return
+        columns, row_height = self.grid_geometry()
+        if from_top:
+            extra = -(-extra // columns) * columns
+            dropped = self.entries[self.grid_start:self.grid_start + extra]
+            del self.grid.controls[:extra]
+            self.grid_start += extra
+        else:
+            dropped = self.entries[self.rendered - extra:self.rendered]
+            del self.grid.controls[-extra:]
+            self.rendered -= extra
+        for entry in dropped:
+            self.tiles.pop(entry['key'], None)
+            self.tile_states.pop(entry['key'], None)
+            self.thumbs_shown.discard(entry['key'])
+        if from_top: self.scroll_by(-extra // columns * row_height)
+
+    def scroll_by(self, delta):
+        # Сверху добавились или ушли ряды: та же видимая область по новому смещению
+        self.scroll_pixels = max(0, self.scroll_pixels + delta)
+        self.grid.update()
+        self.grid.scroll_to(offset=self.scroll_pixels, duration=0)
+
+    def tile_state(self, entry):
+        # Все, от чего зависит вид плитки (кроме выделения): совпало - плитка переиспользуется
+        key = entry['key']
+        if entry['type'] == 'folder':
+            meta = self.folder_meta.get(key)
+            return ('folder', meta.get("color"), meta.get("caption"), self.folder_usage_text(key))
+        return ('file', entry['size'], entry.get('etag'), entry.get('modified'))
+
+    def patch_grid(self, count):
+        # Дифф по ключам: плитки неизменившихся записей (вместе с миниатюрами) остаются
+        # теми же объектами, и Flet отправляет клиенту только добавленные и удаленные.
+        # count - конец окна в self.entries, начало окна (grid_start) не меняется
+        if self.grid_start >= len(self.entries): self.grid_start = 0
+        old_tiles, old_states = self.tiles, self.tile_states
+        self.tiles, self.tile_states = {}, {}
+        controls = []
+        for entry in self.entries[self.grid_start:min(count, self.grid_start + GRID_WINDOW)]:
+            key = entry['key']
+            state = self.tile_state(entry)
+            tile = old_tiles.get(key) if old_states.get(key) == state else None
+            if tile is None:
+                tile = self.create_entry_item(entry)
+                self.thumbs_shown.discard(key)
+            elif entry['type'] == 'file':
+                tile.bgcolor = self.selection_color(key)
+            self.tiles[key] = tile
+            self.tile_states[key] = state
+            controls.append(tile)
+        self.thumbs_shown &= self.tiles.keys()
+        self.grid.controls = controls
+        self.rendered = self.grid_start + len(controls)
+
+    def on_grid_scroll(self, e):
+        # События прокрутки за кадр схлопываются в одно
+        near_end = e.max_scroll_extent is not None and e.max_scroll_extent - e.pixels <= SCROLL_PRELOAD_PX
+        near_start = (e.pixels or 0) <= SCROLL_PRELOAD_PX
+
+        def scrolled():
+            self.scroll_pixels = e.pixels or 0
+            if e.viewport_dimension: self.viewport_height = e.viewport_dimension
+            if near_start: self.render_before()
+            elif near_end: self.load_more()
+            self.request_visible_thumbnails()
+        self.ui.post(scrolled, key="scroll")
+
+    def grid_geometry(self):
+        # Геометрия GridView с max_extent=150, child_aspect_ratio=0.8, отступами 10 -> (колонок, высота ряда)
+        width = (self.page.width or 800) - 20
+        columns = max(1, -(-int(width) // (150 + 10)))
+        tile_height = (width - 10 * (columns - 1)) / columns / 0.8
+        return columns, tile_height + 10
+
+    def visible_range(self):
+        # Индексы self.entries в видимой области
+        columns, row_height = self.grid_geometry()
+        viewport = self.viewport_height or (self.page.height or 800)
+        first_row = int(self.scroll_pixels // row_height)
+        last_row = int((self.scroll_pixels + viewport) // row_height)
+        return self.grid_start + first_row * columns, self.grid_start + (last_row + 1) * columns
+
+    def request_visible_thumbnails(self):
+        if not self.s3 or not has_pil(): return
+        if not self.thumbnails:
+            self.thumbnails = ThumbnailLoader(ThumbnailCache(os.path.join(APP_DATA_DIR, "thumbs")), use_processes=not self.is_mobile)
+        start, end = self.visible_range()
+        visible = [e for e in self.entries[start:min(end, self.rendered)]
+                   if e['type'] == 'file' and is_image(e['key']) and e['key'] not in self.thumbs_shown]
+        self.thumbnails.set_visible(e['key'] for e in visible)
+        for entry in visible:
+            self.thumbnails.request(self.s3, self.bucket_name, self.scope, entry, self.show_thumbnail)
+
+    def prefetch_visible(self):
+        # Видимые подпапки и родитель - в кэш листингов заранее, пока пользователь смотрит на папку
+        if not self.s3 or self.offline or self.loading or self.connecting: return
+        start, end = self.visible_range()
+        folders = [e['key'] for e in self.entries[start:min(end, self.rendered)] if e['type'] == 'folder']
+        self.prefetcher.schedule(self.storage, self.current_path, folders)
+
+    def show_thumbnail(self, key, data):
+        # Из потоков загрузчика: миниатюры, готовые за кадр, уходят одним обновлением
+        def apply():
+            tile = self.tiles.get(key)
+            if not tile: return
+            self.thumbs_shown.add(key)
+            tile.content.controls[0] = ft.Image(
+                src_base64=base64.b64encode(data).decode('ascii'),
+                width=64, height=64, fit=ft.ImageFit.COVER, border_radius=6,
+            )
+        self.ui.post(apply, key=("thumb", key))
+
+    def load_more(self):
+        if not self.s3 or not self.listing or self.loading: return
+        self.render_more()
+
+        # Буфер почти пуст - подтягиваем следующую страницу
+        if len(self.entries) - self.rendered >= RENDER_BATCH: return
+        if self.listing.exhausted or self.fetching_page: return
+        self.fetching_page = True
+        gen, listing = self.listing_gen, self.listing
+
+        async def fetch_page():
+            try:
+                entries = await self.interactive_call(listing.fetch_nonempty)
+            except Exception as e:
+                if gen == self.listing_gen: self.show_snack(f"Ошибка S3: {e}", color="red")
+                entries = []
+
+            def apply():
+                if gen != self.listing_gen: return
+                self.fetching_page = False
+                self.entries.extend(entries)
+                self.cache_listing()
+                self.render_more()
+            self.ui.post(apply)
+        self.io.submit(fetch_page(), key="page")
+
+    def upload_files_result(self, e):
+        if not self.s3: return
+        
+        if e.files:
+            prefix = self.current_path
+            self.plan_uploads([(f.path, prefix + f.name) for f in e.files])
+
+    def plan_uploads(self, files):
+        # Перед загрузкой: что уже лежит в облаке с тем же содержимым - это не загружается
+        storage = self.storage
+
+        def plan_in_background(job):
+            job.report("Проверка файлов...")
+            try:
+                plan = storage.upload_plan(files, self.byte_progress(job, "Проверка"))
+            except Exception as ex:
+                self.clients.metrics.note_error("Проверка перед загрузкой", ex)
+                self.show_snack("Не удалось сверить файлы с облаком, загружаются все", color="orange")
+                self.start_uploads(files)
+                return
+            if job.cancelled: return
+            if plan['skip']: self.ui.post(lambda: self.show_upload_plan(plan, files))
+            else: self.start_uploads(files)
+        self.start_transfer("Проверка перед загрузкой", plan_in_background)
+
+    def show_upload_plan(self, plan, files):
+        upload, skip = plan['upload'], plan['skip']
+
+        def start(selected):
+            self.close_dialog(dlg)
+            if selected: self.start_uploads(selected)
+
+        skipped = ft.ListView(height=150, spacing=2, controls=[
+            ft.Text(key.split('/')[-1], size=12, color=ft.colors.GREY) for _, key in skip[:PLAN_PREVIEW_LINES]
+        ])
+        actions = [
+            ft.TextButton("Отмена", on_click=lambda e: start([])),
+            ft.TextButton("Загрузить все", on_click=lambda e: start(files)),
+        ]
+        if upload: actions.append(ft.ElevatedButton(f"Загрузить {len(upload)}", on_click=lambda e: start(upload)))
+        dlg = ft.AlertDialog(title=ft.Text("Загрузка"), content=ft.Column([
+            ft.Text(f"Новых или измененных: {len(upload)} ({format_size(plan['upload_bytes'])})"),
+            ft.Text(f"Уже в облаке: {len(skip)} ({format_size(plan['skip_bytes'])})"),
+            ft.Text(f"Сверено по хэшу: {plan['hashed']}, по кэшу: {plan['cached']}", size=12, color=ft.colors.GREY),
+            ft.Text("Будут пропущены:", weight=ft.FontWeight.BOLD, size=13),
+            skipped,
+        ], tight=True), actions=actions)
+        self.open_dialog(dlg)
+
+    def configure_upload_engine(self, storage):
+        storage.uploads.configure(
+            float(self.app_settings.get("upload_part_size_mb", UPLOAD_PART_SIZE_MB)),
+            int(self.app_settings.get("upload_file_workers", UPLOAD_FILE_WORKERS)),
+            int(self.app_settings.get("upload_part_workers", UPLOAD_PART_WORKERS)),
+        )
+
+    def resume_jobs(self):
+        # Очередь с прошлого запуска, затем multipart-загрузки, которых в очереди нет (начатые до нее или из CLI)
+        if not self.s3: return
+        restored = self.transfers.restore(self.scope, self.storage)
+        if restored: self.show_snack(f"Продолжаем задачи из очереди: {restored}")
+        queued = {key for job in self.transfers.pending("upload") if job.context is self.storage for key in job.spec['files']}
+        pending = [(path, key) for path, key in self.storage.uploads.pending() if key not in queued]
+        if pending:
+            self.show_snack(f"Продолжаем прерванные загрузки: {len(pending)}")
+            self.start_uploads(pending)
+
+    def start_uploads(self, files):
+        # spec['files']: ключ -> локальный путь; загруженные файлы из задачи убираются
+        title = f"Загрузка: {files[0][1].split('/')[-1]}" if len(files) == 1 else f"Загрузка: {len(files)} файлов"
+        self.transfers.submit("upload", title, spec={'files': {key: path for path, key in files}},
+                              scope=self.scope, persist=True, context=self.storage)
+
+    def run_upload_job(self, job):
+        storage = job.context
+        files = [(path, key) for key, path in job.spec['files'].items()]
+        self.configure_upload_engine(storage)
+
+        def file_done(key, size, error, etag):
+            if error is None: job.update(lambda spec: spec['files'].pop(key, None))
+            elif not isinstance(error, JobCancelled): self.show_snack(f"Ошибка загрузки {key.split('/')[-1]}: {error}", color="red")
+
+        # В строке задачи - общий объем и файл, по которому пришел последний прогресс
+        current = {}
+
+        def file_progress(key, done, size):
+            current['file'] = (key.split('/')[-1], done, size)
+
+        def progress(done, total):
+            text = f"Загрузка: {format_size(done)} из {format_size(total)}"
+            name, file_done, file_size = current.get('file', ("", 0, 0))
+            if file_done < file_size: text += f" · {name}: {file_done * 100 // file_size}%"
+            job.report(text, done / total if total else None)
+
+        job.report("Загрузка...", 0)
+        results = storage.upload(files, file_done, progress, gate=job, on_file_progress=file_progress)
+        self.refresh_later()
+        if job.cancelled: return
+        ok = sum(1 for error in results.values() if error is None)
+        self.show_snack(f"Загружено файлов: {ok} из {len(files)}", color="green" if ok == len(files) else "orange")
+
+    def delete_folder(self, folder_key, versions=False):
+        if not self.s3: return
+        self.transfers.submit("delete", f"Удаление: {folder_key}", spec={'prefix': folder_key, 'versions': versions},
+                              scope=self.scope, persist=True, context=self.storage)
+
+    def run_delete_job(self, job):
+        storage, folder_key = job.context, job.spec['prefix']
+
+        # Оценка общего числа объектов из индекса занятого места
+        usage = storage.indexes.usage
+        expected = usage.get(folder_key)[1] if usage.has_data() else 0
+
+        def progress(deleted, failed):
+            text = f"Удаление: {deleted}" + (f" из ~{expected}" if expected else "") + (f", ошибок: {failed}" if failed else "")
+            job.report(text, min(deleted / expected, 1) if expected else None)
+
+        try:
+            job.report("Удаление...")
+            deleted, failed, errors = storage.delete_prefix(folder_key, job.spec['versions'], progress, gate=job)
+            if failed:
+                sample = ", ".join(f"{key} ({code})" for key, code in errors[:3])
+                self.show_snack(f"Не удалено объектов: {failed}. {sample}", color="red")
+            else:
+                self.show_snack(f"Папка удалена ({deleted} объектов)")
+        except JobCancelled:
+            raise
+        except Exception as e:
+            self.show_snack(f"Ошибка удаления: {e}", color="red")
+        finally:
+            self.refresh_later()
+
+    # --- HELPERS ---
+
+    def without_prefetch(self, fn):
+        # Пользовательская передача: предзагрузка папок на это время приостановлена
+        def run(job):
+            with self.prefetcher.paused(): fn(job)
+        return run
+
+    def start_transfer(self, title, fn, priority=PRIORITY_TRANSFER):
+        # Разовая передача через общий планировщик; fn(job), job передается в ядро как gate
+        return self.transfers.submit("transfer", title, self.without_prefetch(fn), priority=priority, scope=self.scope)
+
+    def byte_progress(self, job, label):
+        def progress(done, total):
+            job.report(f"{label}: {format_size(done)} из {format_size(total)}", done / total if total else None)
+        return progress
+
+    def refresh_later(self):
+        # Из фоновых потоков: несколько запросов за кадр - одно обновление списка
+        self.ui.post(self.refresh_file_list, key="refresh")
+
+    async def interactive_call(self, fn, *args):
+        # Запрос, которого ждет пользователь: передачи на это время уступают ему слоты
+        with self.transfers.interactive():
+            return await self.io.call(fn, *args)
+
+    def apply_transfer_settings(self):
+        conn = self.connection_settings()
+        self.transfers.configure(
+            max_jobs=int(conn.get("transfer_jobs", TRANSFER_MAX_JOBS)),
+            upload_rate=int(conn.get("upload_limit_kb", 0) * 1024),
+            download_rate=int(conn.get("download_limit_kb", 0) * 1024),
+        )
+
+    def jobs_changed(self):
+        # Панель передач: первая выполняемая задача и число остальных; фоновые обходы не показываются
+        jobs = [j for j in self.transfers.all() if not j.finished and j.priority != PRIORITY_BACKGROUND]
+        running = [j for j in jobs if j.state == "running"]
+        self.transfer_panel.visible = bool(jobs)
+        if running:
+            self.transfer_text.value = (running[0].status or running[0].title) + (f" · еще задач: {len(jobs) - 1}" if len(jobs) > 1 else "")
+            self.transfer_bar.value = running[0].fraction
+        elif jobs:
+            self.transfer_text.value = f"Передачи на паузе или в очереди: {len(jobs)}"
+            self.transfer_bar.value = 0
+        if self.jobs_view: self.jobs_view()
+
+    def ensure_folder_meta(self):
+        # Шард с цветами папок текущего уровня подгружается в фоне, плитки папок перерисовываются
+        if self.offline or self.connecting or self.folder_meta.is_loaded(self.current_path): return
+        gen, prefix, folder_meta = self.listing_gen, self.current_path, self.folder_meta
+
+        async def load():
+            try:
+                await self.io.call(folder_meta.load, prefix)
+            except Exception as e:
+                self.clients.metrics.note_error("Метаданные папок", e)
+                return
+            # Плитки папок с изменившимися цветами и подписями пересоздаются диффом
+            def apply():
+                if gen == self.listing_gen: self.patch_grid(self.rendered)
+            self.ui.post(apply, key="folder_meta")
+        self.io.submit(load(), key="folder_meta")
+
+    def flush_folder_meta(self):
+        # Несохраненные правки уходят в облако перед сменой хранилища
+        if self.folder_meta: threading.Thread(target=self.folder_meta.flush, daemon=True).start()
+
+    def save_app_settings(self):
+        if not self.s3: return
+        try:
+            self.storage.write_json(SETTINGS_FILE, self.app_settings)
+        except Exception as e:
+            self.show_snack(f"Ошибка сохранения настроек: {e}", color="red")
+
+    def update_storage_usage(self):
+        if not self.s3: return
+        # Итог берется из локального индекса, полный обход - только сверка по расписанию
+        if self.usage.has_data():
+            self.storage_text.value = format_size(self.usage.get("")[0])
+        if self.offline or self.connecting or not self.usage.reconcile_due(): return
+        self.reconcile_indexes()
+
+    def reconcile_indexes(self, on_done=None):
+        # Один обход бакета обновляет и каталог, и индекс занятого места.
+        # Без on_done - сверка по расписанию: одна в очереди на хранилище, и та пропускается, если уже не нужна
+        storage = self.storage
+        def reconcile_in_background(job):
+            try:
+                if storage.reconcile(job, if_due=on_done is None) and storage is self.storage:
+                    self.ui.post(lambda: setattr(self.storage_text, 'value', format_size(storage.usage()[0])), key="usage")
+                    if on_done: self.ui.post(on_done)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                self.clients.metrics.note_error("Сверка индексов", e)
+        if on_done:
+            self.transfers.submit("scan", "Сверка индексов", reconcile_in_background, priority=PRIORITY_BACKGROUND, scope=self.scope)
+        else:
+            self.submit_scan("Сверка индексов", reconcile_in_background)
+
+    def submit_scan(self, title, run):
+        # Фоновый обход хранилища: пока такой же ждет в очереди или идет, второй не ставится
+        key = (self.scope, title)
+        job = self.scans.get(key)
+        if job and not job.finished: return job
+        self.scans[key] = job = self.transfers.submit("scan", title, run, priority=PRIORITY_BACKGROUND, scope=self.scope)
+        return job
+
+    def folder_usage_text(self, folder_key):
+        if not self.usage or not self.usage.has_data(): return None
+        size, count = self.usage.get(folder_key)
+        return f"{format_size(size)} · {count}"
+
+    # --- DIALOGS ---
+
+    def show_add_menu(self, e):
+        if not self.s3: return
+        dlg = ft.AlertDialog(
+            title=ft.Text("Создать"),
+            content=ft.Column([
+                ft.ElevatedButton("Загрузить файлы", icon=ft.icons.UPLOAD, 
+                    on_click=lambda _: [self.close_dialog(dlg), self.file_picker.pick_files(allow_multiple=True)]),
+                ft.ElevatedButton("Новая папка", icon=ft.icons.CREATE_NEW_FOLDER, 
+                    on_click=lambda _: [self.close_dialog(dlg), self.show_create_folder_dialog()])
+            ], height=120, tight=True)
+        )
+        self.open_dialog(dlg)
+
+    def show_create_folder_dialog(self):
+        tf = ft.TextField(label="Имя папки")
+        def create_action(e):
+            if not tf.value or not self.s3: return
+            storage, key = self.storage, self.current_path + tf.value + "/"
+
+            async def create():
+                try:
+                    await self.io.call(storage.create_folder, key)
+                except Exception as ex:
+                    self.show_snack(f"Ошибка: {ex}", color="red")
+                    return
+                self.ui.post(lambda: self.close_dialog(dlg))
+                self.refresh_later()
+            self.io.submit(create())
+        
+        dlg = ft.AlertDialog(title=ft.Text("Новая папка"), content=tf, actions=[
+            ft.TextButton("Отмена", on_click=lambda e: self.close_dialog(dlg)),
+            ft.ElevatedButton("Создать", on_click=create_action)
+        ])
+        self.open_dialog(dlg)
+
+    def fetch_all_folders(self):
+        if not self.s3: return []
+        return ["/ (Корень)"] + self.folder_tree.all_folders()
+
+    def refresh_folder_tree(self, on_done=None):
+        # Перестроение дерева в фоне, если оно устарело. Обход на хранилище один;
+        # по готовности вызывается on_done последнего вызова (открытого сейчас диалога)
+        if not self.s3 or not self.folder_tree.is_stale(): return False
+        storage = self.storage
+        self.tree_ready = on_done
+
+        def build_in_background(job):
+            try:
+                if storage.build_folder_tree(job, if_stale=True) and storage is self.storage and self.tree_ready:
+                    self.ui.post(self.tree_ready)
+            except JobCancelled:
+                raise
+            except Exception as e:
+                self.show_snack(f"Ошибка чтения папок: {e}", color="red")
+        self.submit_scan("Дерево папок", build_in_background)
+        return True
+
+    def open_folder_settings(self, folder_key, name, current_color, current_caption):
+        if not self.s3: return
+        tf = ft.TextField(label="Имя", value=current_caption)
+        colors_map = {
+            "Синий": ft.colors.BLUE, "Красный": ft.colors.RED, "Зеленый": ft.colors.GREEN, 
+            "Оранжевый": ft.colors.ORANGE, "Фиолетовый": ft.colors.PURPLE, 
+            "Серый": ft.colors.GREY, "Желтый": ft.colors.YELLOW
+        }
+        curr_col_name = next((k for k,v in colors_map.items() if v == current_color), "Синий")
+        dd = ft.Dropdown(label="Цвет", options=[ft.dropdown.Option(k) for k in colors_map], value=curr_col_name)
+        versions_cb = ft.Checkbox(label="Удалять все версии объектов", value=False)
+
+        def save(e):
+            self.folder_meta.set(folder_key, {"color": colors_map.get(dd.value), "caption": tf.value})
+            self.close_dialog(dlg)
+            self.refresh_file_list()
+        
+        def delete(e):
+            self.close_dialog(dlg)
+            self.delete_folder(folder_key, versions=versions_cb.value)
+
+        def download(as_zip):
+            self.close_dialog(dlg)
+            self.start_bulk_download(folders=[folder_key], as_zip=as_zip, zip_name=f"{name}.zip")
+
+        def move(e):
+            self.close_dialog(dlg)
+            self.show_move_dialog(folder_key)
+
+        content = [tf, dd, versions_cb, ft.TextButton("Переместить или копировать", icon=ft.icons.DRIVE_FILE_MOVE, on_click=move)]
+        if self.can_download_locally():
+            content.append(ft.Row([
+                ft.TextButton("Скачать", icon=ft.icons.DOWNLOAD, on_click=lambda e: download(False)),
+                ft.TextButton("В ZIP", icon=ft.icons.FOLDER_ZIP, on_click=lambda e: download(True)),
+            ]))
+
+        dlg = ft.AlertDialog(title=ft.Text(name), content=ft.Column(content, height=250), actions=[
+            ft.TextButton("УДАЛИТЬ", style=ft.ButtonStyle(color="red"), on_click=delete),
+            ft.ElevatedButton("Сохранить", on_click=save)
+        ])
+        self.open_dialog(dlg)
+
+    def show_file_actions(self, key, filename, size=0, entry=None):
+        if not self.s3: return
+        entry = entry or {'type': 'file', 'key': key, 'size': size, 'etag': '', 'modified': 0}
+        def delete(e):
+            storage = self.storage
+
+            async def remove():
+                try:
+                    await self.io.call(storage.delete_object, key, size)
+                except Exception as ex:
+                    self.show_snack(f"Ошибка: {ex}", color="red")
+                    return
+                self.ui.post(lambda: self.close_dialog(dlg))
+                self.refresh_later()
+            self.io.submit(remove())
+        
+        def select(e):
+            self.close_dialog(dlg)
+            self.toggle_selection(entry)
+
+        def move(e):
+            self.close_dialog(dlg)
+            self.show_move_dialog(key, entry['size'], entry['etag'])
+
+        dlg = ft.AlertDialog(title=ft.Text(filename), actions=[
+            ft.TextButton("Снять выделение" if key in self.selected else "Выделить", on_click=select),
+            ft.TextButton("Переместить", on_click=move),
+            ft.ElevatedButton("Удалить", color="red", on_click=delete)
+        ])
+        self.open_dialog(dlg)
+
+    def show_global_settings(self, e):
+        if not self.s3: return
+        dd_start = ft.Dropdown(
+            label="Папка при запуске",
+            options=self.folder_options(),
+            value=self.app_settings.get("default_folder", "")
+        )
+
+        def tree_ready():
+            dd_start.options = self.folder_options()
+            if dlg.open: dd_start.update()
+        part_tf = ft.TextField(label="Размер части загрузки (МБ)", value=str(self.app_settings.get("upload_part_size_mb", UPLOAD_PART_SIZE_MB)), keyboard_type=ft.KeyboardType.NUMBER)
+        files_tf = ft.TextField(label="Файлов одновременно", value=str(self.app_settings.get("upload_file_workers", UPLOAD_FILE_WORKERS)), keyboard_type=ft.KeyboardType.NUMBER)
+        parts_tf = ft.TextField(label="Частей файла одновременно", value=str(self.app_settings.get("upload_part_workers", UPLOAD_PART_WORKERS)), keyboard_type=ft.KeyboardType.NUMBER)
+
+        # Параметры соединения и передач хранятся на устройстве: соединение - со следующего подключения, передачи - сразу
+        conn = self.connection_settings()
+        pool_tf = ft.TextField(label="Соединений в пуле", value=str(conn.get("pool_size", S3_POOL_SIZE)), keyboard_type=ft.KeyboardType.NUMBER)
+        connect_tf = ft.TextField(label="Таймаут соединения (с)", value=str(conn.get("connect_timeout", S3_CONNECT_TIMEOUT)), keyboard_type=ft.KeyboardType.NUMBER)
+        read_tf = ft.TextField(label="Таймаут чтения (с)", value=str(conn.get("read_timeout", S3_READ_TIMEOUT)), keyboard_type=ft.KeyboardType.NUMBER)
+        adaptive_cb = ft.Checkbox(label="Адаптивные повторы при троттлинге", value=conn.get("adaptive_retries", True))
+        jobs_tf = ft.TextField(label="Передач одновременно", value=str(conn.get("transfer_jobs", TRANSFER_MAX_JOBS)), keyboard_type=ft.KeyboardType.NUMBER)
+        up_limit_tf = ft.TextField(label="Скорость загрузки, КБ/с (0 - без ограничения)", value=str(conn.get("upload_limit_kb", 0)), keyboard_type=ft.KeyboardType.NUMBER)
+        down_limit_tf = ft.TextField(label="Скорость скачивания, КБ/с (0 - без ограничения)", value=str(conn.get("download_limit_kb", 0)), keyboard_type=ft.KeyboardType.NUMBER)
+
+        def save_settings(e):
+            try:
+                part_size = max(5, float(part_tf.value))
+                file_workers = max(1, int(files_tf.value))
+                part_workers = max(1, int(parts_tf.value))
+                conn = {
+                    "pool_size": max(1, int(pool_tf.value)),
+                    "connect_timeout": max(1, float(connect_tf.value)),
+                    "read_timeout": max(1, float(read_tf.value)),
+                    "adaptive_retries": adaptive_cb.value,
+                    "transfer_jobs": max(1, int(jobs_tf.value)),
+                    "upload_limit_kb": max(0, int(up_limit_tf.value)),
+                    "download_limit_kb": max(0, int(down_limit_tf.value)),
+                }
+            except ValueError:
+                self.show_snack("Параметры загрузки и соединения должны быть числами", color="red")
+                return
+            self.page.client_storage.set("connection_settings", conn)
+            self.apply_transfer_settings()
+            self.app_settings["default_folder"] = dd_start.value
+            self.app_settings["upload_part_size_mb"] = part_size
+            self.app_settings["upload_file_workers"] = file_workers
+            self.app_settings["upload_part_workers"] = part_workers
+            self.save_app_settings()
+            self.close_dialog(dlg)
+            self.show_snack("Настройки сохранены")
+
+        dlg = ft.AlertDialog(title=ft.Text("Настройки"), content=ft.Column([dd_start, part_tf, files_tf, parts_tf, pool_tf, connect_tf, read_tf, adaptive_cb,
+                                                                       jobs_tf, up_limit_tf, down_limit_tf], tight=True, scroll=ft.ScrollMode.AUTO), actions=[
+            ft.ElevatedButton("Сохранить", on_click=save_settings)
+        ])
+        self.open_dialog(dlg)
+        self.refresh_folder_tree(tree_ready)
+
+    def folder_options(self):
+        return [ft.dropdown.Option(text=f, key=f if f != "/ (Корень)" else "") for f in self.fetch_all_folders()]
+
+    def show_profiles(self, e):
+        if not self.s3: return
+
+        def switch(profile):
+            self.close_dialog(dlg)
+            if (profile['endpoint'], profile['bucket']) != self.scope:
+                self.connect_profile(profile)
+
+        def add_profile(e):
+            self.close_dialog(dlg)
+            self.show_login_screen()
+
+        tiles = []
+        for profile in self.saved_profiles():
+            current = (profile['endpoint'], profile['bucket']) == self.scope
+            tiles.append(ft.ListTile(
+                leading=ft.Icon(ft.icons.CHECK if current else ft.icons.STORAGE),
+                title=ft.Text(profile['bucket']),
+                subtitle=ft.Text(profile['endpoint'], size=11),
+                on_click=lambda e, p=profile: switch(p),
+            ))
+        dlg = ft.AlertDialog(title=ft.Text("Хранилища"), content=ft.Column(tiles, tight=True, scroll=ft.ScrollMode.AUTO), actions=[
+            ft.TextButton("Добавить", icon=ft.icons.ADD, on_click=add_profile)
+        ])
+        self.open_dialog(dlg)
+
+    def show_search(self, e):
+        if not self.s3: return
+        text_tf = ft.TextField(label="Имя содержит", autofocus=True, on_submit=lambda e: run_search())
+        type_dd = ft.Dropdown(label="Тип", value="", options=[ft.dropdown.Option(key="", text="Все")] +
+                              [ft.dropdown.Option(key=g, text=n) for g, n in FILE_TYPE_NAMES.items()])
+        min_tf = ft.TextField(label="От (МБ)", width=120, keyboard_type=ft.KeyboardType.NUMBER)
+        max_tf = ft.TextField(label="До (МБ)", width=120, keyboard_type=ft.KeyboardType.NUMBER)
+        since_tf = ft.TextField(label="С (ГГГГ-ММ-ДД)", width=150)
+        until_tf = ft.TextField(label="По (ГГГГ-ММ-ДД)", width=150)
+        results = ft.ListView(height=300, spacing=2)
+        status = ft.Text("", size=12, color=ft.colors.GREY)
+        more_btn = ft.TextButton("Показать еще", visible=False, on_click=lambda e: run_search(append=True))
+        state = {'offset': 0}
+
+        def parse_query():
+            def size(tf): return int(float(tf.value) * 1024 * 1024) if tf.value else None
+            def date(tf, end=False):
+                if not tf.value: return None
+                return time.mktime(time.strptime(tf.value.strip(), "%Y-%m-%d")) + (86399 if end else 0)
+            return dict(text=text_tf.value, group=type_dd.value or None, min_size=size(min_tf), max_size=size(max_tf),
+                        since=date(since_tf), until=date(until_tf, end=True))
+
+        def index_status():
+            synced = self.catalog.last_sync()
+            if not synced: return "Индекс строится, результаты могут быть неполными"
+            return "Индекс от " + time.strftime("%d.%m.%Y %H:%M", time.localtime(synced))
+
+        def run_search(append=False):
+            try:
+                query = parse_query()
+            except ValueError:
+                status.value = "Проверьте размер и даты"
+                self.page.update()
+                return
+            if not append:
+                state['offset'] = 0
+                results.controls.clear()
+            entries, has_more = self.catalog.search(offset=state['offset'], **query)
+            state['offset'] += SEARCH_PAGE_SIZE
+            results.controls.extend(self.create_search_result(entry, dlg) for entry in entries)
+            more_btn.visible = has_more
+            status.value = f"Найдено: {len(results.controls)}{'+' if has_more else ''}. {index_status()}"
+            self.page.update()
+
+        def reindex(e):
+            status.value = "Обновление индекса..."
+            self.page.update()
+            self.reconcile_indexes(on_done=lambda: run_search() if dlg.open else None)
+
+        dlg = ft.AlertDialog(title=ft.Text("Поиск"), content=ft.Column([
+            text_tf, type_dd,
+            ft.Row([min_tf, max_tf], wrap=True),
+            ft.Row([since_tf, until_tf], wrap=True),
+            status, results, more_btn,
+        ], tight=True, scroll=ft.ScrollMode.AUTO), actions=[
+            ft.TextButton("Обновить индекс", on_click=reindex),
+            ft.ElevatedButton("Найти", icon=ft.icons.SEARCH, on_click=lambda e: run_search()),
+        ])
+        self.open_dialog(dlg)
+        if not self.catalog.last_sync() and not self.offline: reindex(None)
+
+    def create_search_result(self, entry, dlg):
+        key = entry['key']
+        name, folder = key.split('/')[-1], parent_prefix(key)
+        icon, color = get_file_style(name)
+        modified = time.strftime("%d.%m.%Y", time.localtime(entry['modified'])) if entry['modified'] else ""
+
+        def open_folder(e):
+            self.close_dialog(dlg)
+            self.navigate_to(folder)
+
+        return ft.ListTile(
+            leading=ft.Icon(icon, color=color),
+            title=ft.Text(name, overflow=ft.TextOverflow.ELLIPSIS),
+            subtitle=ft.Text(f"{folder or '/'} · {format_size(entry['size'])} · {modified}", size=11),
+            trailing=ft.IconButton(ft.icons.DOWNLOAD, tooltip="Скачать", on_click=lambda e: self.download_file(key, name)),
+            on_click=open_folder,
+        )
+
+    def show_theme_picker(self, e):
+        colors = [
+            ft.colors.BLUE, ft.colors.LIGHT_BLUE, ft.colors.CYAN, ft.colors.TEAL,
+            ft.colors.GREEN, ft.colors.LIGHT_GREEN, ft.colors.LIME, ft.colors.YELLOW,
+            ft.colors.AMBER, ft.colors.ORANGE, ft.colors.DEEP_ORANGE, ft.colors.RED,
+            ft.colors.PINK, ft.colors.PURPLE, ft.colors.DEEP_PURPLE, ft.colors.INDIGO,
+            ft.colors.BLUE_GREY, ft.colors.BROWN, ft.colors.GREY
+        ]
+        grid = ft.GridView(runs_count=5, height=300, padding=10, spacing=10)
+        for c in colors:
+            grid.controls.append(ft.Container(
+                bgcolor=c, width=40, height=40, border_radius=20, border=ft.border.all(1, ft.colors.OUTLINE),
+                on_click=lambda e, col=c: [setattr(self.page.theme, 'color_scheme_seed', col), self.page.update(), self.close_dialog(dlg)],
+                ink=True
+            ))
+        dlg = ft.AlertDialog(title=ft.Text("Выберите цвет"), content=grid)
+        self.open_dialog(dlg)
+
+    # --- NAVIGATION & DOWNLOAD ---
+
+    def navigate_to(self, folder_key):
+        if not self.ui.on_thread(): return self.ui.post(lambda: self.navigate_to(folder_key))
+        if not self.s3: return
+        self.current_path = folder_key
+        self.refresh_file_list()
+
+    def go_back(self, e):
+        if not self.ui.on_thread(): return self.ui.post(lambda: self.go_back(e))
+        if not self.s3: return
+        parts = self.current_path.rstrip('/').split('/')
+        if len(parts) > 1: self.current_path = "/".join(parts[:-1]) + "/"
+        else: self.current_path = ""
+        self.refresh_file_list()
+
+    def download_file(self, key, filename):
+        if not self.s3: return
+        storage = self.storage
+        def generate_and_launch(job):
+            try:
+                self.page.launch_url(storage.presigned_url(key, filename))
+                self.show_snack(f"Скачивание: {filename}")
+            except Exception as e:
+                self.show_snack(f"Ошибка ссылки: {e}", color="red")
+        self.transfers.submit("link", f"Ссылка: {filename}", generate_and_launch, priority=PRIORITY_INTERACTIVE, scope=self.scope)
+
+    def can_download_locally(self):
+        return not self.is_mobile and not self.page.web
+
+    def start_bulk_download(self, folders=(), files=(), as_zip=False, zip_name="archive.zip"):
+        if not self.s3: return
+        if not self.can_download_locally():
+            self.show_snack("Пакетное скачивание доступно только в настольной версии", color="red")
+            return
+        self.pending_download = {'folders': list(folders), 'files': list(files), 'zip': as_zip}
+        if as_zip: self.zip_picker.save_file(file_name=zip_name, allowed_extensions=["zip"])
+        else: self.dir_picker.get_directory_path()
+
+    def download_target_result(self, e):
+        spec, self.pending_download = self.pending_download, None
+        if not spec or not e.path or not self.s3: return
+        spec['dest'] = e.path if not spec['zip'] or e.path.lower().endswith('.zip') else e.path + '.zip'
+        title = f"Скачивание: {os.path.basename(spec['dest'].rstrip(os.sep)) or spec['dest']}"
+        self.transfers.submit("download", title, spec=spec, scope=self.scope, persist=True, context=self.storage)
+
+    def run_download_job(self, job):
+        # Повтор после перезапуска докачивает: совпадающие файлы пропускаются, .part продолжаются (архив - заново)
+        spec = job.spec
+        downloader = job.context.downloader(gate=job)
+        progress = self.byte_progress(job, "Скачивание")
+        try:
+            job.report("Скачивание...")
+            objects = downloader.iter_objects(spec['folders'], spec['files'])
+            if spec['zip']:
+                count = downloader.download_zip(objects, spec['dest'], progress)
+                self.show_snack(f"Архив сохранен: {count} файлов")
+            else:
+                result = downloader.download(objects, spec['dest'], on_progress=progress)
+                if job.cancelled: return
+                failed = result['failed']
+                text = f"Скачано: {result['downloaded']}, без изменений: {result['skipped']}"
+                if failed: text += f", ошибок: {len(failed)} ({failed[0][0]}: {failed[0][1]})"
+                self.show_snack(text, color="red" if failed else "green")
+        except JobCancelled:
+            raise
+        except Exception as ex:
+            self.show_snack(f"Ошибка скачивания: {ex}", color="red")
+
+    # --- COPY & MOVE ---
+
+    def show_move_dialog(self, key, size=0, etag=''):
+        # Переименование - перемещение в ту же папку под другим именем
+        if not self.s3: return
+        is_folder = key.endswith('/')
+        name_tf = ft.TextField(label="Имя", value=key.rstrip('/').split('/')[-1])
+        dd_target = ft.Dropdown(label="Папка назначения", options=self.move_targets(key), value=parent_prefix(key))
+
+        def tree_ready():
+            dd_target.options = self.move_targets(key)
+            if dlg.open: dd_target.update()
+
+        def submit(move):
+            name = name_tf.value.strip()
+            if not name or '/' in name:
+                self.show_snack("Недопустимое имя", color="red")
+                return
+            dst = (dd_target.value or "") + name + ('/' if is_folder else '')
+            self.close_dialog(dlg)
+            if dst == key: return
+            if is_folder and dst.startswith(key):
+                self.show_snack("Нельзя переместить папку в саму себя", color="red")
+            elif is_folder:
+                self.start_folder_copy(key, dst, move)
+            else:
+                self.start_file_copy(key, dst, size, etag, move)
+
+        dlg = ft.AlertDialog(title=ft.Text("Переместить или копировать"), content=ft.Column([name_tf, dd_target], tight=True), actions=[
+            ft.TextButton("Копировать", icon=ft.icons.COPY, on_click=lambda e: submit(False)),
+            ft.ElevatedButton("Переместить", icon=ft.icons.DRIVE_FILE_MOVE, on_click=lambda e: submit(True)),
+        ])
+        self.open_dialog(dlg)
+        self.refresh_folder_tree(tree_ready)
+
+    def move_targets(self, key):
+        # Папку нельзя переместить в нее саму или во вложенную
+        return [o for o in self.folder_options() if not (key.endswith('/') and o.key.startswith(key))]
+
+    def start_file_copy(self, src, dst, size, etag, move):
+        storage = self.storage
+        verb = "Перемещение" if move else "Копирование"
+
+        def copy_in_background(job):
+            try:
+                storage.copy_object(src, dst, size, etag, move, gate=job)
+                self.show_snack("Файл перемещен" if move else "Файл скопирован")
+                self.refresh_later()
+            except JobCancelled:
+                raise
+            except Exception as ex:
+                self.show_snack(f"{verb} не удалось: {ex}", color="red")
+        self.start_transfer(f"{verb}: {dst.split('/')[-1]}", copy_in_background)
+
+    def start_folder_copy(self, src, dst, move, resume=False):
+        # Прерванное задание продолжится при следующем подключении (resume_moves)
+        storage = self.storage
+        verb = "Перемещение" if move else "Копирование"
+
+        def copy_in_background(job):
+            try:
+                job.report(f"{verb}...")
+                result = storage.copy_prefix(src, dst, move, self.byte_progress(job, verb), resume, gate=job)
+                self.refresh_later()
+                if job.cancelled: return
+                failed = result['failed']
+                if failed:
+                    self.show_snack(f"{verb} не завершено, ошибок: {len(failed)} ({failed[0][0]}: {failed[0][1]}). "
+                                    "Продолжится при следующем подключении", color="red")
+                else:
+                    self.show_snack(f"{verb} завершено: {result['copied'] + result['skipped']} объектов")
+            except JobCancelled:
+                raise
+            except Exception as ex:
+                self.show_snack(f"{verb} не удалось: {ex}", color="red")
+        self.start_transfer(f"{verb}: {src}", copy_in_background)
+
+    def resume_moves(self):
+        if not self.s3: return
+        for job in self.storage.pending_moves():
+            self.show_snack(f"Продолжаем {'перемещение' if job['move'] else 'копирование'} {job['src']}")
+            self.start_folder_copy(job['src'], job['dst'], job['move'], resume=True)
+
+    # --- SYNC ---
+
+    def show_sync(self, e):
+        if not self.s3: return
+        if not self.can_download_locally():
+            self.show_snack("Синхронизация доступна только в настольной версии", color="red")
+            return
+        last = self.catalog.get_state("sync_last", {})
+        dir_tf = ft.TextField(label="Локальная папка", value=last.get("local_dir", ""), expand=True)
+        self.sync_dir_field = dir_tf
+        dd_prefix = ft.Dropdown(label="Папка в облаке", options=self.folder_options(), value=last.get("prefix", self.current_path))
+        dd_mode = ft.Dropdown(label="Направление", value=last.get("mode", "both"), options=[
+            ft.dropdown.Option(key="both", text="В обе стороны"),
+            ft.dropdown.Option(key="upload", text="Только в облако"),
+            ft.dropdown.Option(key="download", text="Только из облака"),
+        ])
+        deletes_cb = ft.Checkbox(label="Удалять то, что удалено на другой стороне", value=last.get("deletes", False))
+        status = ft.Text("", size=12)
+        preview = ft.ListView(height=200, spacing=2)
+        run_btn = ft.ElevatedButton("Синхронизировать", icon=ft.icons.SYNC, disabled=True)
+        state = {}
+        labels = {'upload': "В облако", 'download': "Из облака", 'delete_remote': "Удалить в облаке", 'delete_local': "Удалить локально"}
+
+        def make_engine():
+            prefix, local_dir = dd_prefix.value or "", dir_tf.value.strip()
+            if not os.path.isdir(local_dir): raise ValueError("Локальная папка не найдена")
+            settings = {"local_dir": local_dir, "prefix": prefix, "mode": dd_mode.value, "deletes": deletes_cb.value}
+            self.catalog.set_state("sync_last", settings)
+            self.configure_upload_engine(self.storage)
+            return self.storage.sync_engine(local_dir, prefix, dd_mode.value, deletes_cb.value)
+
+        def check(e):
+            # Предпросмотр: план считается заново при каждом изменении параметров
+            try:
+                engine = make_engine()
+            except ValueError as ex:
+                status.value = str(ex)
+                self.page.update()
+                return
+            run_btn.disabled = True
+            status.value = "Сравнение..."
+            preview.controls.clear()
+            self.page.update()
+
+            def plan_in_background(job):
+                try:
+                    actions = engine.plan()
+                except Exception as ex:
+                    self.ui.post(lambda text=f"Ошибка: {ex}": setattr(status, 'value', text))
+                    return
+                self.ui.post(lambda: show_plan(actions))
+
+            def show_plan(actions):
+                state.update(engine=engine, actions=actions)
+                totals = engine.summary(actions)
+                lines = [f"{labels[a]}: {totals[a][0]} ({format_size(totals[a][1])})" for a in labels if a in totals]
+                status.value = "; ".join(lines) if lines else "Изменений нет"
+                conflicts = sum(1 for a in actions if a['conflict'])
+                if conflicts: status.value += f". Конфликтов: {conflicts} (побеждает более новая версия, другая сохраняется рядом с пометкой «конфликт»)"
+                for a in [a for a in actions if a['action'] in labels][:PLAN_PREVIEW_LINES]:
+                    color = ft.colors.RED if a['action'].startswith('delete') else (ft.colors.ORANGE if a['conflict'] else None)
+                    preview.controls.append(ft.Text(f"{labels[a['action']]}: {a['rel']}", size=12, color=color))
+                run_btn.disabled = not actions
+            self.transfers.submit("scan", "Сравнение для синхронизации", plan_in_background, priority=PRIORITY_INTERACTIVE, scope=self.scope)
+
+        def run(e):
+            self.close_dialog(dlg)
+            self.start_sync(state['engine'], state['actions'])
+
+        run_btn.on_click = run
+        for control in [dir_tf, dd_prefix, dd_mode, deletes_cb]:
+            control.on_change = lambda e: [setattr(run_btn, 'disabled', True), run_btn.update()]
+
+        dlg = ft.AlertDialog(title=ft.Text("Синхронизация"), content=ft.Column([
+            ft.Row([dir_tf, ft.IconButton(ft.icons.FOLDER_OPEN, tooltip="Выбрать", on_click=lambda e: self.sync_picker.get_directory_path())]),
+            dd_prefix, dd_mode, deletes_cb, status, preview,
+        ], tight=True, scroll=ft.ScrollMode.AUTO), actions=[
+            ft.TextButton("Проверить", on_click=check),
+            run_btn,
+        ])
+        self.open_dialog(dlg)
+
+    def sync_dir_result(self, e):
+        if not e.path or not self.sync_dir_field: return
+        self.sync_dir_field.value = e.path
+        self.sync_dir_field.update()
+
+    def start_sync(self, engine, actions):
+        def sync_in_background(job):
+            try:
+                job.report("Синхронизация...")
+                result = engine.run(actions, self.byte_progress(job, "Синхронизация"), gate=job)
+                self.refresh_later()
+                if job.cancelled: return
+                failed = result['failed']
+                text = f"В облако: {result['uploaded']}, из облака: {result['downloaded']}, удалено: {result['deleted']}"
+                if result['conflicts']: text += f", сохранено конфликтных копий: {result['conflicts']}"
+                if failed: text += f", ошибок: {len(failed)} ({failed[0][0]}: {failed[0][1]})"
+                self.show_snack(text, color="red" if failed else "green")
+            except JobCancelled:
+                raise
+            except Exception as ex:
+                self.show_snack(f"Ошибка синхронизации: {ex}", color="red")
+        self.start_transfer(f"Синхронизация: {engine.local_dir}", sync_in_background)
+
+    def toggle_selection(self, entry):
+        if not self.ui.on_thread(): return self.ui.post(lambda: self.toggle_selection(entry))
+        if entry['key'] in self.selected: del self.selected[entry['key']]
+        else: self.selected[entry['key']] = entry
+        tile = self.tiles.get(entry['key'])
+        if tile: tile.bgcolor = self.selection_color(entry['key'])
+        self.update_selection_bar()
+        self.page.update()
+
+    def clear_selection(self):
+        if not self.ui.on_thread(): return self.ui.post(self.clear_selection)
+        for key in self.selected:
+            if key in self.tiles: self.tiles[key].bgcolor = None
+        self.selected = {}
+        self.update_selection_bar()
+        self.page.update()
+
+    def update_selection_bar(self):
+        self.selection_bar.visible = bool(self.selected)
+        self.selection_text.value = f"Выбрано: {len(self.selected)}"
+
+    def selection_color(self, key):
+        return ft.colors.with_opacity(0.15, ft.colors.PRIMARY) if key in self.selected else None
+
+    def download_selection(self, as_zip=False):
+        self.start_bulk_download(files=self.selected.values(), as_zip=as_zip, zip_name="selection.zip")
+
+    # --- TRANSFERS ---
+
+    def show_transfers(self, e=None):
+        # Очередь планировщика: пауза, продолжение и отмена; список обновляется вместе с панелью передач
+        jobs_list = ft.Column(spacing=8, scroll=ft.ScrollMode.AUTO, height=360, width=460)
+
+        def job_row(job):
+            buttons = []
+            if job.state in ("queued", "running"):
+                buttons.append(ft.IconButton(ft.icons.PAUSE, tooltip="Пауза", on_click=lambda e: self.transfers.pause(job)))
+            if job.state == "paused":
+                buttons.append(ft.IconButton(ft.icons.PLAY_ARROW, tooltip="Продолжить", on_click=lambda e: self.transfers.resume(job)))
+            if not job.finished:
+                buttons.append(ft.IconButton(ft.icons.CLOSE, tooltip="Отменить", on_click=lambda e: self.transfers.cancel(job)))
+            details = JOB_STATES[job.state]
+            if job.state == "failed": details += f": {job.error}"
+            elif job.status and not job.finished: details += f" · {job.status}"
+            row = [
+                ft.Row([ft.Text(job.title, size=13, weight=ft.FontWeight.BOLD, expand=True), *buttons]),
+                ft.Text(details, size=12, color=ft.colors.RED if job.state == "failed" else ft.colors.GREY),
+            ]
+            if job.state == "running": row.append(ft.ProgressBar(value=job.fraction))
+            return ft.Column(row, spacing=2)
+
+        def refresh():
+            jobs = self.transfers.all()
+            jobs_list.controls = [job_row(j) for j in reversed(jobs)] or [ft.Text("Задач нет", color=ft.colors.GREY)]
+
+        def close(_=None):
+            self.jobs_view = None
+            self.close_dialog(dlg)
+
+        dlg = ft.AlertDialog(title=ft.Text("Передачи"), content=jobs_list, on_dismiss=lambda _: setattr(self, 'jobs_view', None),
+                             actions=[ft.TextButton("Закрыть", on_click=close)])
+        refresh()
+        self.jobs_view = refresh
+        self.open_dialog(dlg)
+
+    # --- DIAGNOSTICS ---
+
+    def show_diagnostics(self, e):
+        # Задержки запросов S3 по операциям (перцентили с учетом повторов) и последние ошибки
+        metrics = self.clients.metrics
+        summary = ft.Text("", size=12)
+        table = ft.DataTable(columns=[
+            ft.DataColumn(ft.Text("Операция")),
+            ft.DataColumn(ft.Text("Запросов"), numeric=True),
+            ft.DataColumn(ft.Text("Ошибок"), numeric=True),
+            ft.DataColumn(ft.Text("Повторов"), numeric=True),
+            ft.DataColumn(ft.Text("p50, мс"), numeric=True),
+            ft.DataColumn(ft.Text("p90, мс"), numeric=True),
+            ft.DataColumn(ft.Text("p99, мс"), numeric=True),
+            ft.DataColumn(ft.Text("Передано"), numeric=True),
+        ], column_spacing=16, heading_row_height=32, data_row_min_height=28, data_row_max_height=28)
+        errors = ft.Column(spacing=2)
+
+        def refresh(_=None):
+            data = metrics.snapshot()
+            ops = data['operations']
+            total = sum(s['count'] for s in ops.values())
+            failed = sum(s['errors'] for s in ops.values())
+            retries = sum(s['retries'] for s in ops.values())
+            summary.value = (f"За {int(data['uptime'] // 60)} мин: запросов {total}, ошибок {failed}, повторов {retries}. "
+                             f"Предзагрузка: запросов {self.prefetcher.requests}, попаданий {self.prefetcher.hits}")
+            if data['phases']:
+                summary.value += "\nЗапуск: " + ", ".join(f"{STARTUP_PHASES.get(name, name)} {seconds * 1000:.0f} мс"
+                                                          for name, seconds in data['phases'].items())
+            table.rows = [ft.DataRow(cells=[ft.DataCell(ft.Text(v, size=12)) for v in [
+                op, str(s['count']), str(s['errors']), str(s['retries']),
+                f"{s['p50_ms']:.0f}", f"{s['p90_ms']:.0f}", f"{s['p99_ms']:.0f}",
+                format_size(s['bytes_sent'] + s['bytes_received']),
+            ]]) for op, s in ops.items()]
+            errors.controls = [
+                ft.Text(f"{time.strftime('%H:%M:%S', time.localtime(err['time']))}  {err['source']}: {err['error']}", size=11, color=ft.colors.RED)
+                for err in reversed(data['errors'])
+            ] or [ft.Text("Ошибок нет", size=11, color=ft.colors.GREY)]
+            if dlg.open: dlg.update()
+
+        def reset(_):
+            metrics.reset()
+            refresh()
+
+        dlg = ft.AlertDialog(
+            title=ft.Text("Диагностика"),
+            content=ft.Column([
+                summary,
+                ft.Row([table], scroll=ft.ScrollMode.AUTO),
+                ft.Text("Последние ошибки", weight=ft.FontWeight.BOLD, size=13),
+                errors,
+            ], tight=True, scroll=ft.ScrollMode.AUTO, width=700),
+            actions=[
+                ft.TextButton("Обновить", on_click=refresh),
+                ft.TextButton("Сбросить", on_click=reset),
+                ft.TextButton("JSON", on_click=lambda _: self.export_metrics("json")),
+                ft.TextButton("Prometheus", on_click=lambda _: self.export_metrics("prom")),
+                ft.TextButton("Закрыть", on_click=lambda _: self.close_dialog(dlg)),
+            ],
+        )
+        refresh()
+        self.open_dialog(dlg)
+
+    def export_metrics(self, fmt):
+        # В настольной версии - в файл, иначе в буфер обмена
+        metrics = self.clients.metrics
+        text = metrics.to_json() if fmt == "json" else metrics.to_prometheus()
+        if not self.can_download_locally():
+            self.page.set_clipboard(text)
+            self.show_snack("Метрики скопированы в буфер обмена")
+            return
+        self.pending_export = text
+        self.metrics_picker.save_file(file_name=f"s3cloud_metrics.{fmt}", allowed_extensions=[fmt])
+
+    def metrics_export_result(self, e):
+        text, self.pending_export = self.pending_export, None
+        if not text or not e.path: return
+        try:
+            with open(e.path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            self.show_snack(f"Метрики сохранены: {e.path}")
+        except Exception as ex:
+            self.show_snack(f"Ошибка сохранения: {ex}", color="red")
+
+    # --- FACTORIES ---
+
+    def create_entry_item(self, entry):
+        if entry['type'] == 'folder':
+            folder_key = entry['key']
+            folder_name = folder_key.rstrip('/').split('/')[-1]
+            meta = self.folder_meta.get(folder_key)
+            return self.create_folder_item(folder_name, folder_key, meta.get("color", ft.colors.BLUE), meta.get("caption", folder_name), self.folder_usage_text(folder_key))
+        return self.create_file_item(entry['key'].split('/')[-1], entry['key'], entry['size'], entry)
+
+    def create_folder_item(self, name, full_key, color, caption, usage_text=None):
+        controls = [
+            ft.Icon(ft.icons.FOLDER, size=50, color=color),
+            ft.Text(caption, text_align=ft.TextAlign.CENTER, overflow=ft.TextOverflow.ELLIPSIS, size=12),
+        ]
+        if usage_text: controls.append(ft.Text(usage_text, size=10, color=ft.colors.GREY))
+        return ft.Container(
+            content=ft.Column(controls, alignment=ft.MainAxisAlignment.CENTER),
+            ink=True,
+            on_click=lambda e: self.navigate_to(full_key),
+            border_radius=10, padding=10,
+            on_long_press=lambda e: self.open_folder_settings(full_key, name, color, caption)
+        )
+
+    def create_file_item(self, name, full_key, size, entry=None):
+        entry = entry or {'type': 'file', 'key': full_key, 'size': size, 'etag': '', 'modified': 0}
+        icon, color = get_file_style(name)
+        return ft.Container(
+            content=ft.Column([
+                ft.Icon(icon, size=50, color=color),
+                ft.Text(name, text_align=ft.TextAlign.CENTER, overflow=ft.TextOverflow.ELLIPSIS, size=12, weight=ft.FontWeight.W_500),
+                ft.Text(f"{size/1024:.1f} KB", size=10, color=ft.colors.GREY),
+            ], alignment=ft.MainAxisAlignment.CENTER),
+            ink=True,
+            on_click=lambda e: self.toggle_selection(entry) if self.selected else self.download_file(full_key, name),
+            on_long_press=lambda e: self.show_file_actions(full_key, name, size, entry),
+            border_radius=10, padding=10,
+            bgcolor=self.selection_color(full_key),
+        )
+
+    # --- UTILS ---
+
+    def open_dialog(self, dlg):
+        self.page.dialog = dlg
+        dlg.open = True
+        self.page.update()
+
+    def close_dialog(self, dlg):
+        dlg.open = False
+        self.page.update()
+
+    def show_snack(self, message, color="green"):
+        # Из любого потока; из нескольких сообщений за кадр показывается последнее
+        def show():
+            self.page.snack_bar = ft.SnackBar(content=ft.Text(message, color="white"), bgcolor=color)
+            self.page.snack_bar.open = True
+        self.ui.post(show, key="snack")
+
+def main(page: ft.Page):
+    app = S3CloudApp(page)
+
+if __name__ == "__main__":
+    ft.app(target=main)
@@ -0,0 +1,95 @@
+# Общие фикстуры: moto-сервер на сессию и чистый бакет на каждый тест.
+# Локальное состояние (индексы, журналы) пишется во временный каталог.
+import itertools
+import logging
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["FLET_APP_STORAGE_DATA"] = tempfile.mkdtemp(prefix="s3tests_")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from core import CloudStorage, JobCancelled, PrefixDeleter, S3ClientPool, TransferGate
+
+BUCKETS = itertools.count()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class CancelAfter(TransferGate):
+    # Gate, который отменяет задание после requests запросов
+    def __init__(self, requests):
+        self.left = requests
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled: raise JobCancelled()
+
+    def request(self):
+        with self.lock:
+            self.left -= 1
+            if self.left < 0: self.cancelled = True
+        self.check()
+        return super().request()
+
+class RejectingDeletes:
+    # Клиент, у которого DeleteObjects не удаляет ключи из reject
+    def __init__(self, s3, reject):
+        self.s3 = s3
+        self.reject = set(reject)
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+    def delete_objects(self, **kwargs):
+        objects = kwargs['Delete']['Objects']
+        allowed = [o for o in objects if o['Key'] not in self.reject]
+        response = self.s3.delete_objects(**dict(kwargs, Delete=dict(kwargs['Delete'], Objects=allowed))) if allowed else {}
+        errors = [{'Key': o['Key'], 'Code': 'AccessDenied'} for o in objects if o['Key'] in self.reject]
+        return dict(response, Errors=errors)
+
+def fill(storage, prefix, count, body=b"x"):
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda i: storage.s3.put_object(Bucket=storage.bucket, Key=f"{prefix}{i:05d}", Body=body), range(count)))
+
+def keys(storage, prefix):
+    return [obj['Key'] for page in storage.s3.get_paginator('list_objects_v2').paginate(Bucket=storage.bucket, Prefix=prefix)
+            for obj in page.get('Contents', [])]
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline: raise AssertionError("не дождались условия")
+        time.sleep(0.01)
+
+@pytest.fixture(scope="session")
+def endpoint():
+    server_module = pytest.importorskip("moto.server", reason="нужен moto (pip install -r requirements-bench.txt)")
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = free_port()
+    server = server_module.ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield f"http://127.0.0.1:{port}"
+    server.stop()
+
+@pytest.fixture(scope="session")
+def s3(endpoint):
+    return S3ClientPool().get("testing", "testing", endpoint, "us-east-1", {"pool_size": 32})
+
+@pytest.fixture
+def storage(s3, endpoint):
+    bucket = f"test-{os.getpid()}-{next(BUCKETS)}"
+    s3.create_bucket(Bucket=bucket)
+    storage = CloudStorage(s3, endpoint, bucket)
+    yield storage
+    PrefixDeleter(s3, bucket).delete("")
+    s3.delete_bucket(Bucket=bucket)
@@ -0,0 +1,51 @@
+# Фоновый цикл asyncio: задача с ключом отменяет предыдущую с тем же ключом, ошибки уходят в on_error
+import asyncio
+import threading
+
+import pytest
+
+from conftest import wait_for
+from core import AsyncRunner
+
+@pytest.fixture
+def runner():
+    errors = []
+    runner = AsyncRunner(workers=2, on_error=errors.append)
+    runner.errors = errors
+    return runner
+
+def test_newer_task_cancels_previous_with_same_key(runner):
+    started, release = threading.Event(), threading.Event()
+    reached = []
+
+    async def navigate(name, slow):
+        if slow: await runner.call(lambda: started.set() or release.wait(5))
+        reached.append(name)
+        return name
+    first = runner.submit(navigate("first", True), key="listing")
+    assert started.wait(5)
+    other = runner.submit(navigate("other", False), key="thumbs")
+    second = runner.submit(navigate("second", False), key="listing")
+    assert second.result(5) == "second" and other.result(5) == "other"
+    release.set()
+    # Ушедшая навигация не продолжается после своего блокирующего вызова
+    with pytest.raises(Exception):
+        first.result(5)
+    assert first.cancelled() and "first" not in reached
+    assert runner.errors == []
+
+def test_cancel_by_key(runner):
+    async def forever():
+        await asyncio.sleep(60)
+    task = runner.submit(forever(), key="prefetch")
+    runner.cancel("prefetch", "unknown")
+    with pytest.raises(Exception):
+        task.result(5)
+    assert task.cancelled() and runner.errors == []
+
+def test_errors_are_reported(runner):
+    async def broken():
+        raise ValueError("сбой")
+    with pytest.raises(ValueError):
+        runner.submit(broken()).result(5)
+    wait_for(lambda: [str(e) for e in runner.errors] == ["сбой"])
@@ -0,0 +1,82 @@
+# Каталог бакета: полная сверка слиянием по страницам, правки из живых листингов
+import pytest
+
+from core import BucketCatalog
+
+class SmallPages:
+    # Клиент, который листает бакет страницами по page_size ключей
+    def __init__(self, s3, page_size=3):
+        self.s3 = s3
+        self.page_size = page_size
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+    def get_paginator(self, name):
+        paginator = self.s3.get_paginator(name)
+        page_size = self.page_size
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                return paginator.paginate(PaginationConfig={'PageSize': page_size}, **kwargs)
+        return Paginator()
+
+@pytest.fixture
+def catalog(tmp_path):
+    return BucketCatalog(str(tmp_path / "catalog.sqlite"))
+
+def put(storage, key, body=b"x"):
+    storage.s3.put_object(Bucket=storage.bucket, Key=key, Body=body)
+
+def listed(catalog, prefix):
+    return [(e['type'], e['key']) for e in catalog.list_folder(prefix)]
+
+def test_sync_builds_folders_and_totals(storage, catalog):
+    for key in ["a/b/one.txt", "a/two.txt", "c/", "top.txt", ".folder_metadata/a.json"]: put(storage, key, b"12345")
+    totals = catalog.sync(SmallPages(storage.s3), storage.bucket)
+    assert totals[""] == [25, 5] and totals["a/"] == [10, 2] and totals["a/b/"] == [5, 1]
+    assert listed(catalog, "") == [('folder', "a/"), ('folder', "c/"), ('file', "top.txt")]
+    assert listed(catalog, "a/") == [('folder', "a/b/"), ('file', "a/two.txt")]
+    assert catalog.has_folder("a/b/") and catalog.has_folder("") and not catalog.has_folder("x/")
+    assert catalog.last_sync() > 0
+
+def test_sync_applies_only_the_difference(storage, catalog):
+    for i in range(10): put(storage, f"d/{i:02d}.txt")
+    client = SmallPages(storage.s3)
+    catalog.sync(client, storage.bucket)
+    rowids = dict(catalog.db.execute("SELECT key, rowid FROM objects"))
+
+    # Удаления и добавления на разных страницах, в том числе после последнего ключа
+    storage.s3.delete_objects(Bucket=storage.bucket, Delete={'Objects': [{'Key': "d/00.txt"}, {'Key': "d/05.txt"}]})
+    put(storage, "d/03.txt", b"changed")
+    put(storage, "d/04a.txt")
+    catalog.upsert("z/stale.txt", 1)
+    catalog.sync(client, storage.bucket)
+
+    keys = [e['key'] for e in catalog.list_folder("d/")]
+    assert keys == ["d/01.txt", "d/02.txt", "d/03.txt", "d/04.txt", "d/04a.txt",
+                    "d/06.txt", "d/07.txt", "d/08.txt", "d/09.txt"]
+    assert next(e['size'] for e in catalog.list_folder("d/") if e['key'] == "d/03.txt") == 7
+    assert not catalog.has_folder("z/") and listed(catalog, "") == [('folder', "d/")]
+    # Неизменные строки не переписываются
+    after = dict(catalog.db.execute("SELECT key, rowid FROM objects"))
+    assert all(after[k] == rowids[k] for k in after if k in rowids and k != "d/03.txt")
+
+def test_apply_listing_removes_only_on_complete(catalog):
+    catalog.upsert("p/old.txt", 1)
+    catalog.upsert("p/sub/deep.txt", 1)
+    entries = [{'type': 'file', 'key': "p/new.txt", 'size': 2, 'etag': "e", 'modified': 1.0}]
+    catalog.apply_listing("p/", entries, complete=False)
+    assert listed(catalog, "p/") == [('folder', "p/sub/"), ('file', "p/new.txt"), ('file', "p/old.txt")]
+    catalog.apply_listing("p/", entries, complete=True)
+    assert listed(catalog, "p/") == [('file', "p/new.txt")]
+    assert not catalog.has_folder("p/sub/")
+
+def test_storage_keeps_catalog_current(storage):
+    put(storage, "docs/a.txt")
+    storage.reconcile()
+    catalog = storage.indexes.catalog
+    assert listed(catalog, "docs/") == [('file', "docs/a.txt")]
+    storage.create_folder("docs/new/")
+    storage.delete_object("docs/a.txt", 1)
+    assert listed(catalog, "docs/") == [('folder', "docs/new/")]
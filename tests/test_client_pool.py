@@ -0,0 +1,53 @@
+# Пул клиентов и открытых хранилищ: повторное использование по области, закрытие вытесненных
+from conftest import wait_for
+from core import S3_OPEN_STORAGES, FolderMetadataStore, S3ClientPool
+
+def open_storage(pool, endpoint, bucket, **settings):
+    return pool.storage("testing", "testing", endpoint, bucket, "us-east-1", settings or None)
+
+def test_clients_are_shared_by_settings(endpoint):
+    pool = S3ClientPool()
+    client = pool.get("testing", "testing", endpoint, "us-east-1", {"pool_size": 8})
+    assert pool.get("testing", "testing", endpoint, "us-east-1", {"pool_size": 8}) is client
+    assert pool.get("testing", "testing", endpoint, "us-east-1", {"pool_size": 9}) is not client
+    assert pool.get("other", "testing", endpoint, "us-east-1", {"pool_size": 8}) is not client
+
+def test_storage_is_reused_per_scope(s3, endpoint):
+    buckets = [f"pool-{i}" for i in range(2)]
+    for bucket in buckets: s3.create_bucket(Bucket=bucket)
+    pool = S3ClientPool()
+    first = open_storage(pool, endpoint, buckets[0])
+    second = open_storage(pool, endpoint, buckets[1])
+    # Возврат к бакету - тот же объект с тем же каталогом и индексами
+    assert open_storage(pool, endpoint, buckets[0]) is first
+    assert first.indexes.catalog is open_storage(pool, endpoint, buckets[0]).indexes.catalog
+    assert second is not first
+    # Другие настройки - другой клиент, хранилище открывается заново
+    assert open_storage(pool, endpoint, buckets[0], pool_size=3) is not first
+
+def test_evicted_storage_is_closed(s3, endpoint):
+    buckets = [f"evict-{i}" for i in range(S3_OPEN_STORAGES + 1)]
+    for bucket in buckets: s3.create_bucket(Bucket=bucket)
+    pool = S3ClientPool()
+    oldest = open_storage(pool, endpoint, buckets[0])
+    oldest.folder_meta.SAVE_DELAY = 3600
+    oldest.folder_meta.set("work/", {"color": "red"})
+    for bucket in buckets[1:]: open_storage(pool, endpoint, bucket)
+
+    # Вытесненное хранилище закрыто: отложенные правки метаданных записаны
+    assert list(pool.storages) == [(endpoint, b) for b in buckets[1:]]
+
+    def saved():
+        store = FolderMetadataStore(s3, buckets[0])
+        store.load("")
+        return store.get("work/") == {"color": "red"}
+    wait_for(saved)
+    assert open_storage(pool, endpoint, buckets[0]) is not oldest
+
+def test_forget_drops_storages_of_the_account(s3, endpoint):
+    s3.create_bucket(Bucket="forget-0")
+    pool = S3ClientPool()
+    storage = open_storage(pool, endpoint, "forget-0")
+    pool.forget("testing", endpoint)
+    assert pool.storages == {}
+    assert open_storage(pool, endpoint, "forget-0") is not storage
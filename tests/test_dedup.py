@@ -0,0 +1,37 @@
+# Проверка дублей перед загрузкой: размер, затем хэш; кэш хэшей только что загруженных файлов
+import os
+
+from core import MIN_PART_SIZE, UploadEngine
+
+def test_upload_plan_skips_same_content(storage, tmp_path):
+    files = []
+    for name, data in (("same.bin", b"a" * 1000), ("changed.bin", b"b" * 1000), ("new.bin", b"c" * 10)):
+        path = str(tmp_path / name)
+        with open(path, 'wb') as f: f.write(data)
+        files.append((path, "up/" + name))
+    assert set(storage.upload(files[:2]).values()) == {None}
+
+    # Тот же размер, другое содержимое: решает хэш, а не размер
+    with open(files[1][0], 'wb') as f: f.write(b"B" * 1000)
+    plan = storage.upload_plan(files)
+    assert sorted(key for _, key in plan['skip']) == ["up/same.bin"]
+    assert sorted(key for _, key in plan['upload']) == ["up/changed.bin", "up/new.bin"]
+    assert (plan['skip_bytes'], plan['upload_bytes']) == (1000, 1010)
+
+    # Только что загруженный файл проверяется по кэшу, без повторного хэширования
+    plan = storage.upload_plan(files[:1])
+    assert (plan['cached'], plan['hashed']) == (1, 0)
+
+def test_multipart_etag_with_other_part_size(storage, tmp_path):
+    # Объект загружен другим клиентом частями по 6 МБ: хэш подбирается по числу частей из ETag
+    path = str(tmp_path / "big.bin")
+    with open(path, 'wb') as f: f.write(os.urandom(2 * MIN_PART_SIZE + 100))
+    engine = UploadEngine(storage.s3, storage.bucket, str(tmp_path / "journal.json"), part_size_mb=6)
+    assert engine.upload([(path, "up/big.bin")]) == {"up/big.bin": None}
+    assert storage.s3.head_object(Bucket=storage.bucket, Key="up/big.bin")['ETag'].strip('"').endswith("-2")
+    plan = storage.upload_plan([(path, "up/big.bin")])
+    assert [key for _, key in plan['skip']] == ["up/big.bin"] and plan['hashed'] == 1
+
+    with open(path, 'r+b') as f: f.write(b"changed")
+    plan = storage.upload_plan([(path, "up/big.bin")])
+    assert [key for _, key in plan['upload']] == ["up/big.bin"]
@@ -0,0 +1,30 @@
+# Удаление папки: пакеты DeleteObjects параллельно с листингом, отмена, частичные ошибки
+import pytest
+
+from conftest import CancelAfter, RejectingDeletes, fill, keys
+from core import DELETE_BATCH, JobCancelled, PrefixDeleter
+
+def test_delete_prefix_in_batches(storage):
+    fill(storage, "del/", DELETE_BATCH + 50)
+    fill(storage, "delta/", 3)
+    storage.reconcile()
+    progress = []
+    deleted, failed, errors = storage.delete_prefix("del/", on_progress=lambda d, f: progress.append((d, f)))
+    assert (deleted, failed, errors) == (DELETE_BATCH + 50, 0, [])
+    assert max(progress) == (DELETE_BATCH + 50, 0)
+    assert keys(storage, "del/") == []
+    assert len(keys(storage, "delta/")) == 3
+    assert storage.usage("") == (3, 3)
+
+def test_delete_prefix_stops_on_cancel(storage):
+    fill(storage, "del/", 20)
+    with pytest.raises(JobCancelled):
+        PrefixDeleter(storage.s3, storage.bucket, gate=CancelAfter(0)).delete("del/")
+    assert len(keys(storage, "del/")) == 20
+
+def test_failed_keys_are_reported_and_retried(storage, monkeypatch):
+    monkeypatch.setattr("core.time.sleep", lambda s: None)
+    fill(storage, "del/", 10)
+    deleter = PrefixDeleter(RejectingDeletes(storage.s3, {"del/00003"}), storage.bucket)
+    assert deleter.delete("del/") == (9, 1, [("del/00003", "AccessDenied")])
+    assert keys(storage, "del/") == ["del/00003"]
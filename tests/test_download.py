@@ -0,0 +1,92 @@
+# Скачивание: папки с вложенностью, пропуск совпадающих файлов, докачка .part после обрыва, архив
+import json
+import os
+import zipfile
+
+from core import BulkDownloader
+
+class FailingRanges:
+    # Клиент, у которого обрываются GET диапазонов, начинающихся с fail, и который считает запросы
+    def __init__(self, s3, fail=()):
+        self.s3 = s3
+        self.fail = set(fail)
+        self.ranges = []
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+    def get_object(self, **kwargs):
+        start = int(kwargs.get('Range', "bytes=0-").split('=')[1].split('-')[0])
+        if start in self.fail: raise ConnectionError("обрыв")
+        self.ranges.append((kwargs['Key'], start))
+        return self.s3.get_object(**kwargs)
+
+def put(storage, key, data):
+    storage.s3.put_object(Bucket=storage.bucket, Key=key, Body=data)
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_folder_and_files_keep_relative_names(storage, tmp_path):
+    put(storage, "photos/2024/a.jpg", b"a")
+    put(storage, "photos/2024/trip/b.jpg", b"bb")
+    put(storage, "docs/c.txt", b"ccc")
+    downloader = BulkDownloader(storage.s3, storage.bucket)
+    files = [{'key': "docs/c.txt", 'size': 3, 'etag': "", 'modified': 0}]
+    objects = list(downloader.iter_objects(["photos/2024/"], files))
+    assert sorted(o['name'] for o in objects) == ["2024/a.jpg", "2024/trip/b.jpg", "c.txt"]
+
+    result = downloader.download(objects, str(tmp_path))
+    assert (result['downloaded'], result['failed']) == (3, [])
+    assert read(tmp_path / "2024" / "trip" / "b.jpg") == b"bb"
+    assert read(tmp_path / "c.txt") == b"ccc"
+
+    archive = str(tmp_path / "all.zip")
+    assert downloader.download_zip(downloader.iter_objects(["photos/2024/"], files), archive) == 3
+    with zipfile.ZipFile(archive) as zf:
+        assert sorted(zf.namelist()) == ["2024/a.jpg", "2024/trip/b.jpg", "c.txt"]
+        assert zf.read("2024/a.jpg") == b"a"
+
+def test_unchanged_files_are_skipped(storage, tmp_path):
+    put(storage, "f/one.txt", b"one")
+    put(storage, "f/two.txt", b"two")
+    downloader = BulkDownloader(storage.s3, storage.bucket)
+    assert downloader.download(downloader.iter_objects(["f/"]), str(tmp_path))['downloaded'] == 2
+
+    # Второй раз - ни одного GET: совпадают размер и время изменения
+    client = FailingRanges(storage.s3)
+    downloader = BulkDownloader(client, storage.bucket)
+    result = downloader.download(downloader.iter_objects(["f/"]), str(tmp_path))
+    assert (result['downloaded'], result['skipped']) == (0, 2)
+    assert client.ranges == []
+
+    # Другое время, то же содержимое - проверка по MD5 без скачивания; другое содержимое - скачивается
+    os.utime(tmp_path / "f" / "one.txt", (1, 1))
+    with open(tmp_path / "f" / "two.txt", 'wb') as f: f.write(b"TWO")
+    os.utime(tmp_path / "f" / "two.txt", (1, 1))
+    result = downloader.download(downloader.iter_objects(["f/"]), str(tmp_path))
+    assert (result['downloaded'], result['skipped']) == (1, 1)
+    assert client.ranges == [("f/two.txt", 0)]
+    assert read(tmp_path / "f" / "two.txt") == b"two"
+
+def test_interrupted_download_resumes_from_part_file(storage, tmp_path):
+    data = os.urandom(10 * 1024)
+    put(storage, "big.bin", data)
+    part = 4 * 1024
+    broken = FailingRanges(storage.s3, fail={part})
+    downloader = BulkDownloader(broken, storage.bucket, part_size=part, part_workers=1)
+    objects = list(downloader.iter_objects(["big"]))
+    result = downloader.download(objects, str(tmp_path))
+    assert len(result['failed']) == 1
+    assert not os.path.exists(tmp_path / "big.bin")
+    with open(tmp_path / "big.bin.part.json", encoding='utf-8') as f:
+        assert sorted(json.load(f)['done']) == [0, 2]
+
+    # Повтор качает только недостающий диапазон
+    client = FailingRanges(storage.s3)
+    downloader = BulkDownloader(client, storage.bucket, part_size=part, part_workers=1)
+    assert downloader.download(objects, str(tmp_path))['downloaded'] == 1
+    assert client.ranges == [("big.bin", part)]
+    assert read(tmp_path / "big.bin") == data
+    assert sorted(os.listdir(tmp_path)) == ["big.bin"]
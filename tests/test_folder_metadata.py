@@ -0,0 +1,85 @@
+# Метаданные папок: условная запись шардов, слияние правок двух устройств, перенос прежнего файла
+import json
+
+from core import METADATA_FILE, METADATA_MIGRATED, FolderMetadataStore
+
+class CountingS3:
+    # Клиент, запоминающий коды ошибок и прочитанные ключи
+    def __init__(self, s3):
+        self.s3 = s3
+        self.errors = []
+        self.gets = []
+
+    def __getattr__(self, name):
+        return getattr(self.s3, name)
+
+    def get_object(self, **kwargs):
+        self.gets.append(kwargs['Key'])
+        return self.s3.get_object(**kwargs)
+
+    def put_object(self, **kwargs):
+        try:
+            return self.s3.put_object(**kwargs)
+        except Exception as e:
+            self.errors.append(getattr(e, 'response', {}).get('Error', {}).get('Code'))
+            raise
+
+def reopened(storage):
+    store = FolderMetadataStore(storage.s3, storage.bucket)
+    store.load("")
+    store.load("photos/")
+    return store
+
+def test_new_shard_conflict_merges(storage):
+    first, second = FolderMetadataStore(storage.s3, storage.bucket), FolderMetadataStore(CountingS3(storage.s3), storage.bucket)
+    first.load("")
+    second.load("")
+    first.set("work/", {"color": "red"})
+    assert first.flush()
+
+    # Второе устройство не видело шард и пишет с If-None-Match: 412, перечитывание, повтор
+    second.set("home/", {"color": "blue"})
+    assert second.flush()
+    assert second.s3.errors == ["PreconditionFailed"]
+    assert second.conditional
+    store = reopened(storage)
+    assert (store.get("work/"), store.get("home/")) == ({"color": "red"}, {"color": "blue"})
+
+def test_stale_etag_conflict_replays_ops(storage):
+    first, second = FolderMetadataStore(storage.s3, storage.bucket), FolderMetadataStore(CountingS3(storage.s3), storage.bucket)
+    first.set("photos/2023/", {"caption": "old"})
+    first.set("photos/2024/", {"caption": "trip"})
+    first.load("photos/")
+    assert first.flush()
+    second.load("photos/")
+
+    first.set("photos/2025/", {"color": "green"})
+    assert first.flush()
+    # У второго ETag устарел (If-Match): его удаление и правка накладываются на свежий шард
+    second.remove_tree("photos/2023/")
+    second.set("photos/2024/", {"caption": "trip", "color": "red"})
+    assert second.flush()
+    assert second.s3.errors == ["PreconditionFailed"]
+    store = reopened(storage)
+    assert store.get("photos/2023/") == {}
+    assert store.get("photos/2024/") == {"caption": "trip", "color": "red"}
+    assert store.get("photos/2025/") == {"color": "green"}
+
+def test_legacy_file_migrates_once(storage):
+    legacy = {"a/": {"color": "red"}, "a/b/": {"caption": "x"}, "c/": {"color": "blue"}}
+    storage.s3.put_object(Bucket=storage.bucket, Key=METADATA_FILE, Body=json.dumps(legacy).encode('utf-8'))
+    store = FolderMetadataStore(storage.s3, storage.bucket)
+    store.load("")
+    assert store.get("c/") == {"color": "blue"}
+    assert store.flush()
+    assert store.migrating is None
+    keys = [obj['Key'] for obj in storage.s3.list_objects_v2(Bucket=storage.bucket)['Contents']]
+    assert METADATA_MIGRATED in keys
+
+    # После отметки прежний файл больше не читается, записи берутся из шардов
+    client = CountingS3(storage.s3)
+    store = FolderMetadataStore(client, storage.bucket)
+    store.load("a/")
+    store.load("zzz/")
+    assert store.get("a/b/") == {"caption": "x"}
+    assert METADATA_FILE not in client.gets
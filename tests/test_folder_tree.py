@@ -0,0 +1,67 @@
+# Дерево папок: обход с Delimiter, неявные папки, правки во время обхода, перестроение по устареванию
+import threading
+
+import pytest
+
+from core import FolderTree
+
+@pytest.fixture
+def tree(tmp_path):
+    return FolderTree(str(tmp_path / "tree.json"))
+
+def put(storage, *keys):
+    for key in keys: storage.s3.put_object(Bucket=storage.bucket, Key=key, Body=b"")
+
+def test_build_finds_implicit_folders(storage, tree):
+    # b/c/ и d/ существуют только как части ключей, без маркеров папок
+    put(storage, "a/", "a/file.txt", "b/c/deep.txt", "d/e/f/g.txt", "top.txt", ".folder_metadata/x.json")
+    assert tree.build(storage.s3, storage.bucket, workers=2)
+    assert tree.all_folders() == ["a/", "b/", "b/c/", "d/", "d/e/", "d/e/f/"]
+    assert tree.list_children("d/") == ["d/e/"]
+    assert tree.is_built() and not tree.is_stale()
+
+def test_changes_during_build_are_kept(storage, tree):
+    put(storage, "a/x.txt")
+    started, finish = threading.Event(), threading.Event()
+
+    class SlowS3:
+        def __getattr__(self, name):
+            return getattr(storage.s3, name)
+
+        def get_paginator(self, name):
+            started.set()
+            finish.wait(5)
+            return storage.s3.get_paginator(name)
+    thread = threading.Thread(target=tree.build, args=(SlowS3(), storage.bucket))
+    thread.start()
+    assert started.wait(5)
+    # Создание и удаление папок приложением во время обхода накладываются на его результат
+    tree.add("new/")
+    tree.remove("a/")
+    finish.set()
+    thread.join()
+    assert tree.all_folders() == ["new/"]
+
+def test_if_stale_skips_fresh_tree(storage, tree):
+    put(storage, "a/x.txt")
+    assert tree.build(storage.s3, storage.bucket)
+    put(storage, "b/y.txt")
+    # Задача из очереди не перестраивает дерево, которое уже обновили; явный вызов - перестраивает
+    assert not tree.build(storage.s3, storage.bucket, if_stale=True)
+    assert tree.all_folders() == ["a/"]
+    tree.built_at -= tree.MAX_AGE + 1
+    assert tree.is_stale()
+    assert tree.build(storage.s3, storage.bucket, if_stale=True)
+    assert tree.all_folders() == ["a/", "b/"]
+
+def test_observe_complete_listing_drops_missing(tree):
+    tree.observe("", ["a/", "b/"], complete=True)
+    tree.observe("a/", ["a/x/"], complete=False)
+    tree.observe("", ["b/"], complete=True)
+    assert tree.all_folders() == ["b/"]
+
+def test_tree_is_saved(storage, tmp_path):
+    put(storage, "a/b/c.txt")
+    tree = FolderTree(str(tmp_path / "tree.json"))
+    tree.build(storage.s3, storage.bucket)
+    assert FolderTree(str(tmp_path / "tree.json")).all_folders() == ["a/", "a/b/"]
@@ -0,0 +1,72 @@
+# Кэш листингов: свежесть по TTL, устаревшие записи до max_stale, LRU по числу записей
+import time
+
+import pytest
+
+from core import ListingCache
+
+SCOPE = ("endpoint", "bucket")
+
+def snapshot(count, token=None):
+    return {'entries': [{'type': 'file', 'key': f"k{i}"} for i in range(count)], 'token': token, 'exhausted': token is None, 'pages': 1}
+
+def age(cache, prefix, seconds):
+    cache.items[(SCOPE, prefix)]['time'] = time.time() - seconds
+
+@pytest.fixture
+def cache():
+    return ListingCache(max_entries=10, ttl=30, max_stale=600)
+
+def test_fresh_then_stale_then_dropped(cache):
+    cache.put(SCOPE, "a/", snapshot(3))
+    cached, fresh = cache.get(SCOPE, "a/")
+    assert fresh and len(cached['entries']) == 3 and cache.is_fresh(SCOPE, "a/")
+
+    # Старше TTL - отдается сразу, но помечается для фоновой перепроверки
+    age(cache, "a/", 60)
+    cached, fresh = cache.get(SCOPE, "a/")
+    assert not fresh and len(cached['entries']) == 3 and not cache.is_fresh(SCOPE, "a/")
+
+    age(cache, "a/", 601)
+    assert cache.get(SCOPE, "a/") is None
+    assert cache.total == 0
+
+def test_returned_snapshot_is_a_copy(cache):
+    cache.put(SCOPE, "a/", snapshot(2))
+    cached, _ = cache.get(SCOPE, "a/")
+    cached['entries'].append({'type': 'file', 'key': "extra"})
+    assert len(cache.get(SCOPE, "a/")[0]['entries']) == 2
+
+def test_lru_evicts_by_total_entries(cache):
+    cache.put(SCOPE, "a/", snapshot(4))
+    cache.put(SCOPE, "b/", snapshot(4))
+    cache.get(SCOPE, "a/")
+    cache.put(SCOPE, "c/", snapshot(4))
+    # Давно не открытая b/ вытесняется первой
+    assert cache.get(SCOPE, "b/") is None
+    assert cache.get(SCOPE, "a/") and cache.get(SCOPE, "c/")
+    assert cache.total == 8
+
+    # Папка больше лимита все равно остается одна - ее только что открыли
+    cache.put(SCOPE, "huge/", snapshot(25))
+    assert list(cache.items) == [(SCOPE, "huge/")]
+    assert cache.total == 25
+
+def test_replace_and_invalidate_keep_total(cache):
+    cache.put(SCOPE, "a/", snapshot(3))
+    cache.put(SCOPE, "a/", snapshot(5, token="next"))
+    assert cache.total == 5 and cache.get(SCOPE, "a/")[0]['token'] == "next"
+    cache.put(SCOPE, "a/b/", snapshot(1))
+    cache.put(("other", "bucket"), "a/b/", snapshot(1))
+    cache.invalidate_tree(SCOPE, "a/")
+    assert cache.get(SCOPE, "a/") is None and cache.get(SCOPE, "a/b/") is None
+    assert cache.get(("other", "bucket"), "a/b/")
+    assert cache.total == 1
+
+def test_storage_changes_invalidate_parent(storage):
+    storage.s3.put_object(Bucket=storage.bucket, Key="docs/a.txt", Body=b"a")
+    assert [e['key'] for e in storage.list_folder("docs/")] == ["docs/a.txt"]
+    cache = storage.indexes.listing_cache
+    assert cache.is_fresh(storage.scope, "docs/")
+    storage.create_folder("docs/new/")
+    assert cache.get(storage.scope, "docs/") is None
@@ -0,0 +1,49 @@
+# Метрики запросов: счетчики по операциям через события botocore, экспорт в JSON и Prometheus
+import json
+
+import pytest
+
+from core import METRICS_BUCKETS, RequestMetrics, S3ClientPool
+
+@pytest.fixture
+def metered(endpoint):
+    pool = S3ClientPool(RequestMetrics())
+    client = pool.get("testing", "testing", endpoint, "us-east-1", {"max_attempts": 1})
+    client.create_bucket(Bucket="metered")
+    yield client, pool.metrics
+    client.delete_objects(Bucket="metered", Delete={'Objects': [{'Key': "a.txt"}]})
+    client.delete_bucket(Bucket="metered")
+
+def test_snapshot_counts_operations(metered):
+    client, metrics = metered
+    metrics.reset()
+    client.put_object(Bucket="metered", Key="a.txt", Body=b"x" * 100)
+    client.get_object(Bucket="metered", Key="a.txt")['Body'].read()
+    with pytest.raises(Exception):
+        client.head_object(Bucket="metered", Key="missing")
+    metrics.phase("window", 1.5)
+    metrics.phase("window", 9)
+
+    data = metrics.snapshot()
+    put, get, head = (data['operations'][op] for op in ("PutObject", "GetObject", "HeadObject"))
+    assert (put['count'], put['bytes_sent'], put['status']) == (1, 100, {"200": 1})
+    assert get['bytes_received'] == 100
+    assert (head['errors'], head['status']) == (1, {"404": 1})
+    assert data['errors'][-1]['source'] == "HeadObject" and "404" in data['errors'][-1]['error']
+    assert 0 < put['p50_ms'] <= put['max_ms']
+    assert data['phases'] == {"window": 1.5}
+    assert "buckets" not in json.loads(metrics.to_json())['operations']["PutObject"]
+
+def test_prometheus_histogram_is_cumulative(metered):
+    client, metrics = metered
+    metrics.reset()
+    for _ in range(3): client.list_objects_v2(Bucket="metered")
+    lines = metrics.to_prometheus().splitlines()
+    buckets = [line for line in lines if line.startswith('s3cloud_request_duration_seconds_bucket{operation="ListObjectsV2"')]
+    counts = [int(line.rsplit(' ', 1)[1]) for line in buckets]
+    assert len(buckets) == len(METRICS_BUCKETS) + 1 and buckets[-1].startswith(
+        's3cloud_request_duration_seconds_bucket{operation="ListObjectsV2",le="+Inf"}')
+    assert counts == sorted(counts) and counts[-1] == 3
+    assert 's3cloud_requests_total{operation="ListObjectsV2",status="200"} 3' in lines
+    assert 's3cloud_request_duration_seconds_count{operation="ListObjectsV2"} 3' in lines
+    assert "# TYPE s3cloud_sent_bytes_total counter" in lines
@@ -0,0 +1,46 @@
+# Перемещение папки: продолжение после отмены, защита от копии внутрь себя, отчет о неудаленных источниках
+import pytest
+
+from conftest import CancelAfter, RejectingDeletes, fill, keys
+from core import DELETE_MAX_REPORTED_ERRORS, JobCancelled, PrefixMover
+
+def test_move_resumes_after_cancel(storage):
+    fill(storage, "src/", 60, body=b"data")
+    with pytest.raises(JobCancelled):
+        storage.copy_prefix("src/", "dst/", move=True, gate=CancelAfter(20))
+    assert storage.pending_moves() == [{'src': "src/", 'dst': "dst/", 'move': True}]
+    copied = keys(storage, "dst/")
+    assert 0 < len(copied) < 60
+    # Ни один объект не потерян: каждый еще в источнике
+    assert len(keys(storage, "src/")) == 60
+
+    # Повтор без resume отказывается писать в непустой приемник
+    with pytest.raises(ValueError):
+        storage.copy_prefix("src/", "dst/", move=True)
+    result = storage.copy_prefix("src/", "dst/", move=True, resume=True)
+    assert result['failed'] == []
+    assert (result['skipped'], result['copied']) == (len(copied), 60 - len(copied))
+    assert keys(storage, "src/") == []
+    assert keys(storage, "dst/") == [f"dst/{i:05d}" for i in range(60)]
+    assert storage.pending_moves() == []
+
+@pytest.mark.parametrize("dst", ["src/", "src/inner/"])
+def test_copy_into_itself_is_refused(storage, dst):
+    fill(storage, "src/", 3)
+    with pytest.raises(ValueError):
+        storage.copy_prefix("src/", dst, resume=True)
+    assert storage.pending_moves() == []
+    assert len(keys(storage, "")) == 3
+
+def test_all_failed_deletes_are_reported(storage, monkeypatch):
+    # Неудач в пакете больше, чем попадает в отчет PrefixDeleter - источник все равно не считается перенесенным
+    monkeypatch.setattr("core.time.sleep", lambda s: None)
+    count = DELETE_MAX_REPORTED_ERRORS + 50
+    fill(storage, "src/", count + 10)
+    storage.reconcile()
+    rejected = {f"src/{i:05d}" for i in range(count)}
+    mover = PrefixMover(RejectingDeletes(storage.s3, rejected), storage.bucket, "src/", "dst/", indexes=storage.indexes)
+    result = mover.run()
+    assert result['copied'] == count + 10
+    assert sorted(key for key, _ in result['failed']) == sorted(rejected)
+    assert storage.usage("src/") == (count, count)
@@ -0,0 +1,45 @@
+# Предзагрузка листингов: бюджет на переход, порядок по истории, пауза на время передач
+import time
+
+import pytest
+
+from conftest import wait_for
+from core import AsyncRunner, ListingPrefetcher
+
+FOLDERS = [f"top/f{i:02d}/" for i in range(8)]
+
+@pytest.fixture
+def tree(storage):
+    for folder in FOLDERS: storage.s3.put_object(Bucket=storage.bucket, Key=folder + "file.txt", Body=b"x")
+    return storage
+
+def fresh(storage):
+    cache = storage.indexes.listing_cache
+    return [p for p in ["", *FOLDERS] if cache.is_fresh(storage.scope, p)]
+
+def test_budget_and_history_order(tree):
+    prefetcher = ListingPrefetcher(AsyncRunner(), budget=3)
+    for _ in range(3): tree.history.visit("top/f05/")
+    tree.history.visit("top/f02/")
+    # Родитель первым, затем самые посещаемые подпапки; уже свежие в кэше не повторяются
+    assert prefetcher.candidates(tree, "top/", FOLDERS) == ["", "top/f05/", "top/f02/"]
+    prefetcher.schedule(tree, "top/", FOLDERS)
+    wait_for(lambda: prefetcher.requests == 3)
+    assert fresh(tree) == ["", "top/f02/", "top/f05/"]
+    assert "top/f05/" not in prefetcher.candidates(tree, "top/", FOLDERS)
+
+    prefetcher.visit(tree, "top/f05/")
+    prefetcher.visit(tree, "top/f07/")
+    assert prefetcher.hits == 1
+
+def test_paused_during_transfers(tree, monkeypatch):
+    monkeypatch.setattr("core.PREFETCH_PAUSE_POLL", 0.01)
+    prefetcher = ListingPrefetcher(AsyncRunner(), budget=2)
+    with prefetcher.paused():
+        with prefetcher.paused():
+            prefetcher.schedule(tree, "", FOLDERS)
+        time.sleep(0.1)
+        # Одна передача закончилась, вторая еще идет
+        assert prefetcher.requests == 0 and fresh(tree) == []
+    wait_for(lambda: prefetcher.requests == 2)
+    assert fresh(tree) == FOLDERS[:2]
@@ -0,0 +1,195 @@
+# Планировщик передач: очередь задач, пауза и отмена, общие слоты запросов.
+# S3 не нужен - задачи здесь только проходят через gate.
+import threading
+import time
+
+import pytest
+
+from conftest import wait_for
+from core import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, TransferScheduler
+
+@pytest.fixture
+def scheduler(tmp_path):
+    return TransferScheduler(str(tmp_path / "jobs.json"))
+
+def blocking_job(scheduler, title, priority=None, **kwargs):
+    # Задача, которая ждет release и отмечает старт в started
+    started, release = threading.Event(), threading.Event()
+
+    def run(job):
+        started.set()
+        release.wait(5)
+    if priority is not None: kwargs['priority'] = priority
+    return scheduler.submit("test", title, run=run, **kwargs), started, release
+
+def test_max_jobs_queue_by_priority(scheduler):
+    scheduler.configure(max_jobs=1)
+    order = []
+    first, started, release = blocking_job(scheduler, "first")
+    background = scheduler.submit("test", "background", run=lambda job: order.append("background"), priority=PRIORITY_BACKGROUND)
+    transfer = scheduler.submit("test", "transfer", run=lambda job: order.append("transfer"))
+    assert started.wait(5)
+    assert (background.state, transfer.state) == ("queued", "queued")
+
+    # Действия пользователя идут без очереди
+    interactive = scheduler.submit("test", "interactive", run=lambda job: order.append("interactive"), priority=PRIORITY_INTERACTIVE)
+    wait_for(lambda: interactive.state == "done")
+
+    release.set()
+    wait_for(lambda: background.state == "done")
+    assert order == ["interactive", "transfer", "background"]
+    assert first.state == "done"
+
+def test_pause_stops_before_next_request(scheduler):
+    count = {'n': 0}
+    go = threading.Event()
+
+    def run(job):
+        while True:
+            go.wait(5)
+            with job.request():
+                count['n'] += 1
+            time.sleep(0.005)
+    job = scheduler.submit("test", "loop", run=run)
+    go.set()
+    wait_for(lambda: count['n'] > 3)
+
+    scheduler.pause(job)
+    time.sleep(0.05)
+    paused_at = count['n']
+    time.sleep(0.1)
+    assert job.state == "paused"
+    assert count['n'] == paused_at
+    assert scheduler.active == 0
+
+    scheduler.resume(job)
+    assert job.state == "running"
+    wait_for(lambda: count['n'] > paused_at + 3)
+
+    scheduler.cancel(job)
+    wait_for(lambda: job.finished)
+    assert job.state == "cancelled"
+    assert job.error is None
+    assert scheduler.active == 0
+
+def test_cancel_queued_job_never_runs(scheduler):
+    scheduler.configure(max_jobs=1)
+    ran = []
+    blocker, started, release = blocking_job(scheduler, "blocker")
+    assert started.wait(5)
+    queued = scheduler.submit("test", "queued", run=lambda job: ran.append(job))
+    scheduler.cancel(queued)
+    release.set()
+    wait_for(lambda: blocker.finished)
+    time.sleep(0.05)
+    assert queued.state == "cancelled"
+    assert not queued.started and not ran
+
+def test_request_slots_are_shared(scheduler):
+    scheduler.configure(max_requests=3)
+    lock = threading.Lock()
+    state = {'now': 0, 'peak': 0}
+
+    def request(job):
+        with job.request():
+            with lock:
+                state['now'] += 1
+                state['peak'] = max(state['peak'], state['now'])
+            time.sleep(0.02)
+            with lock:
+                state['now'] -= 1
+
+    def run(job):
+        threads = [threading.Thread(target=request, args=(job,)) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    jobs = [scheduler.submit("test", f"job{i}", run=run, workers=8) for i in range(2)]
+    wait_for(lambda: all(job.finished for job in jobs))
+    assert [job.state for job in jobs] == ["done", "done"]
+    assert 1 < state['peak'] <= 3
+    assert scheduler.active == 0
+
+def test_job_workers_limit_its_requests(scheduler):
+    lock = threading.Lock()
+    state = {'now': 0, 'peak': 0}
+
+    def request(job):
+        with job.request():
+            with lock:
+                state['now'] += 1
+                state['peak'] = max(state['peak'], state['now'])
+            time.sleep(0.02)
+            with lock:
+                state['now'] -= 1
+
+    def run(job):
+        threads = [threading.Thread(target=request, args=(job,)) for _ in range(6)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    job = scheduler.submit("test", "narrow", run=run, workers=2)
+    wait_for(lambda: job.finished)
+    assert state['peak'] == 2
+
+def test_speed_limit_sleeps_without_slot(scheduler):
+    # Пока задача спит на ограничении скорости, ее слот запроса свободен для других
+    scheduler.configure(max_requests=1, download_rate=10000)
+    seen = {}
+    sleeping = threading.Event()
+
+    def throttled(job):
+        with job.request():
+            sleeping.set()
+            job.transferred("download", 20000)
+            seen['active'] = scheduler.active
+
+    def other(job):
+        with job.request():
+            pass
+    slow = scheduler.submit("test", "throttled", run=throttled)
+    assert sleeping.wait(5)
+    quick = scheduler.submit("test", "other", run=other)
+    wait_for(lambda: quick.finished, timeout=0.5)
+    wait_for(lambda: slow.finished)
+    assert (slow.state, quick.state) == ("done", "done")
+    assert seen['active'] == 1
+    assert scheduler.active == 0
+
+def test_cancel_while_waiting_for_slot(scheduler):
+    scheduler.configure(max_requests=1)
+    holding, release = threading.Event(), threading.Event()
+
+    def hold(job):
+        with job.request():
+            holding.set()
+            release.wait(5)
+
+    def wait_slot(job):
+        with job.request():
+            pass
+    holder = scheduler.submit("test", "holder", run=hold)
+    assert holding.wait(5)
+    waiter = scheduler.submit("test", "waiter", run=wait_slot)
+    wait_for(lambda: waiter in scheduler.waiting)
+    scheduler.cancel(waiter)
+    wait_for(lambda: waiter.finished)
+    assert waiter.state == "cancelled"
+    assert scheduler.active == 1
+    release.set()
+    wait_for(lambda: holder.finished)
+    assert scheduler.active == 0
+
+def test_persisted_jobs_restore_paused(scheduler, tmp_path):
+    release = threading.Event()
+    scheduler.register("upload", lambda job: release.wait(5))
+    scheduler.submit("upload", "running", spec={'files': ["a"]}, scope=("e", "b"), persist=True)
+    paused = scheduler.submit("upload", "paused", spec={'files': ["b"]}, scope=("e", "b"), persist=True)
+    scheduler.pause(paused)
+    scheduler.save()
+    release.set()
+
+    restored = TransferScheduler(str(tmp_path / "jobs.json"))
+    restored.register("upload", lambda job: None)
+    assert restored.restore(("other", "b")) == 0
+    assert restored.restore(("e", "b")) == 2
+    wait_for(lambda: len([j for j in restored.all() if j.state == "done"]) == 1)
+    assert {j.title: j.state for j in restored.all()} == {"running": "done", "paused": "paused"}
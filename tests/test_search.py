@@ -0,0 +1,37 @@
+# Поиск по каталогу: имя (FTS5 trigram или LIKE), тип файла, размер, дата, страницы
+import pytest
+
+from core import BucketCatalog
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = BucketCatalog(str(tmp_path / "catalog.sqlite"))
+    for key, size, modified in [("photos/Summer_2024.JPG", 500, 100.0), ("photos/winter.png", 50, 200.0),
+                                ("docs/summary.txt", 10, 300.0), ("docs/report.pdf", 5000, 400.0),
+                                ("docs/", 0, 300.0), (".folder_metadata/summer.json", 1, 100.0)]:
+        catalog.upsert(key, size, modified=modified)
+    return catalog
+
+def found(catalog, **query):
+    return [e['key'] for e in catalog.search(**query)[0]]
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_name_search(catalog, fts):
+    catalog.fts = catalog.fts and fts
+    assert found(catalog, text="summ") == ["docs/summary.txt", "photos/Summer_2024.JPG"]
+    # Короткий запрос и спецсимволы LIKE ищутся как обычный текст
+    assert found(catalog, text="_2") == ["photos/Summer_2024.JPG"]
+    assert found(catalog, text="%") == []
+    assert found(catalog, text="docs") == []
+
+def test_filters(catalog):
+    assert found(catalog, group="image") == ["photos/Summer_2024.JPG", "photos/winter.png"]
+    assert found(catalog, min_size=50, max_size=500) == ["photos/Summer_2024.JPG", "photos/winter.png"]
+    assert found(catalog, since=200.0, until=300.0) == ["docs/summary.txt", "photos/winter.png"]
+    assert found(catalog, text="er", group="image", max_size=100) == ["photos/winter.png"]
+
+def test_pages(catalog):
+    entries, more = catalog.search(limit=2)
+    assert [e['key'] for e in entries] == ["docs/report.pdf", "docs/summary.txt"] and more
+    entries, more = catalog.search(limit=2, offset=2)
+    assert [e['key'] for e in entries] == ["photos/Summer_2024.JPG", "photos/winter.png"] and not more
@@ -0,0 +1,104 @@
+# Синхронизация каталога с префиксом: решения по журналу и выполнение плана на moto
+import os
+import time
+
+import pytest
+
+def write(path, data, mtime=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if mtime is not None: os.utime(path, (mtime, mtime))
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def remote_files(storage, prefix):
+    return {obj['Key'][len(prefix):]: storage.s3.get_object(Bucket=storage.bucket, Key=obj['Key'])['Body'].read()
+            for obj in storage.s3.list_objects_v2(Bucket=storage.bucket, Prefix=prefix).get('Contents', [])}
+
+def plan(engine):
+    return {a['rel']: (a['action'], a['conflict']) for a in engine.plan()}
+
+def sync(engine):
+    result = engine.run(engine.plan())
+    assert result['failed'] == []
+    return result
+
+@pytest.fixture
+def local(tmp_path):
+    return str(tmp_path / "local")
+
+def test_first_run_copies_missing_sides(storage, local):
+    write(os.path.join(local, "only_local.txt"), b"local")
+    write(os.path.join(local, "same.txt"), b"same")
+    storage.s3.put_object(Bucket=storage.bucket, Key="s/only_remote.txt", Body=b"remote")
+    storage.s3.put_object(Bucket=storage.bucket, Key="s/same.txt", Body=b"same")
+    engine = storage.sync_engine(local, "s/")
+
+    # Одинаковое содержимое на первом прогоне - только запись в журнал, без передачи
+    assert plan(engine) == {"only_local.txt": ("upload", False), "only_remote.txt": ("download", False), "same.txt": ("record", False)}
+    result = sync(engine)
+    assert (result['uploaded'], result['downloaded'], result['conflicts']) == (1, 1, 0)
+    assert read(os.path.join(local, "only_remote.txt")) == b"remote"
+    assert remote_files(storage, "s/")["only_local.txt"] == b"local"
+    assert plan(engine) == {}
+
+def test_changed_side_wins_without_conflict(storage, local):
+    write(os.path.join(local, "a.txt"), b"one")
+    write(os.path.join(local, "b.txt"), b"two")
+    engine = storage.sync_engine(local, "s/")
+    sync(engine)
+
+    write(os.path.join(local, "a.txt"), b"one, edited", mtime=time.time() + 5)
+    storage.s3.put_object(Bucket=storage.bucket, Key="s/b.txt", Body=b"two, edited remotely")
+    assert plan(engine) == {"a.txt": ("upload", False), "b.txt": ("download", False)}
+    sync(engine)
+    assert remote_files(storage, "s/") == {"a.txt": b"one, edited", "b.txt": b"two, edited remotely"}
+    assert read(os.path.join(local, "b.txt")) == b"two, edited remotely"
+    assert plan(engine) == {}
+
+def test_deletes_follow_the_journal(storage, local):
+    for name in ("gone_local.txt", "gone_remote.txt"): write(os.path.join(local, name), name.encode())
+    engine = storage.sync_engine(local, "s/")
+    sync(engine)
+    os.remove(os.path.join(local, "gone_local.txt"))
+    storage.s3.delete_object(Bucket=storage.bucket, Key="s/gone_remote.txt")
+
+    # Без deletes удаление не распространяется и ничего не возвращает обратно
+    assert plan(engine) == {}
+    engine = storage.sync_engine(local, "s/", deletes=True)
+    assert plan(engine) == {"gone_local.txt": ("delete_remote", False), "gone_remote.txt": ("delete_local", False)}
+    assert sync(engine)['deleted'] == 2
+    assert remote_files(storage, "s/") == {}
+    assert os.listdir(local) == []
+
+def test_one_way_modes(storage, local):
+    write(os.path.join(local, "up.txt"), b"up")
+    storage.s3.put_object(Bucket=storage.bucket, Key="s/down.txt", Body=b"down")
+    assert plan(storage.sync_engine(local, "s/", mode="upload")) == {"up.txt": ("upload", False)}
+    assert plan(storage.sync_engine(local, "s/", mode="download")) == {"down.txt": ("download", False)}
+
+def test_conflict_keeps_losing_version(storage, local):
+    write(os.path.join(local, "old_local.txt"), b"local, older", mtime=time.time() - 3600)
+    write(os.path.join(local, "dir", "new_local.txt"), b"local, newer", mtime=time.time() + 3600)
+    storage.s3.put_object(Bucket=storage.bucket, Key="s/old_local.txt", Body=b"remote, newer")
+    storage.s3.put_object(Bucket=storage.bucket, Key="s/dir/new_local.txt", Body=b"remote, older")
+    engine = storage.sync_engine(local, "s/")
+    assert plan(engine) == {"old_local.txt": ("download", True), "dir/new_local.txt": ("upload", True)}
+
+    assert sync(engine)['conflicts'] == 2
+    assert read(os.path.join(local, "old_local.txt")) == b"remote, newer"
+    assert remote_files(storage, "s/")["dir/new_local.txt"] == b"local, newer"
+    kept_local = [n for n in os.listdir(local) if n.startswith("old_local (конфликт ")]
+    kept_remote = [k for k in remote_files(storage, "s/") if k.startswith("dir/new_local (конфликт ")]
+    assert len(kept_local) == 1 and kept_local[0].endswith(".txt")
+    assert len(kept_remote) == 1 and kept_remote[0].endswith(".txt")
+    assert read(os.path.join(local, kept_local[0])) == b"local, older"
+    assert remote_files(storage, "s/")[kept_remote[0]] == b"remote, older"
+
+    # Сохраненные версии расходятся на другую сторону обычным прогоном
+    assert plan(engine) == {kept_local[0]: ("upload", False), kept_remote[0]: ("download", False)}
+    sync(engine)
+    assert plan(engine) == {}
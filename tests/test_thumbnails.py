@@ -0,0 +1,63 @@
+# Миниатюры: дисковый LRU-кэш по ETag и загрузка из облака
+import io
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from core import ThumbnailCache, ThumbnailLoader
+
+SCOPE = ("endpoint", "bucket")
+
+def test_pillow_is_not_imported_at_startup():
+    # В этом процессе PIL уже могли загрузить другие тесты - проверка в чистом интерпретаторе
+    code = "import sys, core; assert core.has_pil() and 'PIL' not in sys.modules and core.boto3 is None"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], cwd=root, check=True)
+
+def test_overwrite_keeps_total_exact(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=1000)
+    cache.put(SCOPE, "a.jpg", "e1", b"x" * 100)
+    cache.put(SCOPE, "a.jpg", "e1", b"x" * 60)
+    cache.put(SCOPE, "b.jpg", "e1", b"x" * 10)
+    assert cache.total == 70
+    assert ThumbnailCache(str(tmp_path)).total == 70
+    assert cache.get(SCOPE, "a.jpg", "e1") == b"x" * 60
+    # Новый ETag - другая миниатюра
+    assert cache.get(SCOPE, "a.jpg", "e2") is None
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ThumbnailCache(str(tmp_path), max_bytes=300)
+    for i, name in enumerate(["old", "middle", "new"]):
+        cache.put(SCOPE, name, "", b"x" * 100)
+        path = cache.path(SCOPE, name, "")
+        os.utime(path, (1000 + i, 1000 + i))
+    cache.get(SCOPE, "old", "")
+    # Лимит превышен - удаляются самые давние по доступу, пока не останется 80%
+    cache.put(SCOPE, "extra", "", b"x" * 100)
+    assert cache.get(SCOPE, "middle", "") is None and cache.get(SCOPE, "new", "") is None
+    assert cache.get(SCOPE, "old", "") and cache.get(SCOPE, "extra", "")
+    assert cache.total == 200
+
+def test_loader_makes_and_caches_thumbnail(storage, tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    source = io.BytesIO()
+    Image.new('RGB', (800, 600), (200, 30, 30)).save(source, 'PNG')
+    response = storage.s3.put_object(Bucket=storage.bucket, Key="pics/red.png", Body=source.getvalue())
+    entry = {'key': "pics/red.png", 'size': len(source.getvalue()), 'etag': response['ETag'].strip('"')}
+    cache = ThumbnailCache(str(tmp_path / "thumbs"))
+    loader = ThumbnailLoader(cache, use_processes=False)
+    got, done = {}, threading.Event()
+
+    def callback(key, data):
+        got[key] = data
+        done.set()
+    loader.set_visible([entry['key']])
+    loader.request(storage.s3, storage.bucket, storage.scope, entry, callback)
+    assert done.wait(10)
+    with Image.open(io.BytesIO(got[entry['key']])) as thumb:
+        assert thumb.format == "JPEG" and max(thumb.size) <= 160
+    assert cache.get(storage.scope, entry['key'], entry['etag']) == got[entry['key']]
+    assert not [n for n in os.listdir(tmp_path / "thumbs") if n.endswith(".tmp")]
@@ -0,0 +1,85 @@
+# Индекс занятого места: правки на месте, сверка с догоном правок, расписание сверок
+import threading
+import time
+
+import pytest
+
+from core import StorageUsageIndex
+
+@pytest.fixture
+def usage(tmp_path):
+    return StorageUsageIndex(str(tmp_path / "usage.json"))
+
+def test_totals_per_prefix(usage):
+    usage.add("a/b/one.txt", 10)
+    usage.add("a/two.txt", 5)
+    usage.add("three.txt", 1)
+    assert usage.get("") == (16, 3)
+    assert usage.get("a/") == (15, 2)
+    assert usage.get("a/b/") == (10, 1)
+    assert usage.children("") == ["a/"]
+
+    usage.resize("a/b/one.txt", -4)
+    usage.remove("a/two.txt", 5)
+    assert usage.get("a/") == (6, 1)
+    usage.remove_prefix("a/")
+    assert usage.get("") == (1, 1)
+    assert usage.children("") == []
+
+def test_reconcile_replays_changes_made_during_scan(usage):
+    scanning, finish = threading.Event(), threading.Event()
+
+    def compute_totals():
+        scanning.set()
+        finish.wait(5)
+        return {"": [30, 2], "a/": [20, 1]}
+    thread = threading.Thread(target=usage.reconcile, args=(compute_totals,))
+    thread.start()
+    assert scanning.wait(5)
+    # Правки во время обхода могли в него не попасть - накладываются поверх результата
+    usage.add("b/new.txt", 7)
+    usage.resize("a/old.txt", 3)
+    finish.set()
+    thread.join()
+    assert usage.get("") == (40, 3)
+    assert usage.get("a/") == (23, 1)
+    assert usage.get("b/") == (7, 1)
+    assert usage.has_data() and not usage.reconcile_due()
+
+def test_overwrite_counts_only_size_delta(storage, tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"x" * 100)
+    storage.reconcile()
+    storage.upload([(str(path), "docs/file.bin")])
+    path.write_bytes(b"x" * 30)
+    storage.upload([(str(path), "docs/file.bin")])
+    assert storage.usage("docs/") == (30, 1)
+    assert storage.usage("") == (30, 1)
+
+def test_scheduled_reconcile_skips_when_done_meanwhile(usage):
+    calls = []
+    assert usage.reconcile_due()
+    assert usage.reconcile(lambda: calls.append(1) or {"": [0, 0]})
+    # Задача из очереди, поставленная до этой сверки, обход не повторяет; явная сверка - повторяет
+    assert not usage.reconcile(lambda: calls.append(2) or {}, if_due=True)
+    assert usage.reconcile(lambda: calls.append(3) or {"": [0, 0]})
+    assert calls == [1, 3]
+    usage.mark_stale()
+    assert usage.reconcile(lambda: calls.append(4) or {"": [0, 0]}, if_due=True)
+    assert calls == [1, 3, 4]
+
+def test_failed_reconcile_backs_off(usage):
+    def broken():
+        raise ConnectionError("offline")
+    with pytest.raises(ConnectionError):
+        usage.reconcile(broken)
+    assert usage.failures == 1 and not usage.reconcile_due()
+    usage.last_attempt = time.time() - usage.RECONCILE_RETRY - 1
+    assert usage.reconcile_due()
+    with pytest.raises(ConnectionError):
+        usage.reconcile(broken)
+    # Вторая неудача - пауза вдвое дольше
+    usage.last_attempt = time.time() - usage.RECONCILE_RETRY - 1
+    assert not usage.reconcile_due()
+    usage.last_attempt = time.time() - 2 * usage.RECONCILE_RETRY - 1
+    assert usage.reconcile_due()